@@ -112,7 +112,10 @@ class ChargingPlaceForm(FormAction):
                     e_type = e['entity']
                     e_confidence = e['confidence']
 
-                    requested_entity = e['entity_linking'][requested_slot]
+                    # no link for the requested entity type (ex: no candidate in a retrieval index)
+                    requested_entity = e.get('entity_linking', {}).get(requested_slot)
+                    if not requested_entity:
+                        continue
                     requested_entity_confidence = requested_entity['confidence']
 
                     if requested_entity_confidence >= e_confidence:
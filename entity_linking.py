@@ -1,18 +1,39 @@
+import functools
 import hashlib
 import logging
 import math
 import pickle
 import os
 import subprocess
-import unidecode
+import sys
+import threading
+import time
+import weakref
 
-import fofe_entity_linking.predict as predict
+from concurrent.futures import ThreadPoolExecutor
+
+import yaml
+
+from fofe_entity_linking import metrics, normalizer, numpy_predict, retrieval
+from fofe_entity_linking.cache import LRUCache
+from fofe_entity_linking.disambiguation import DisambiguationRules
+from fofe_entity_linking.fuzzy_index import SymmetricDeleteIndex
+from fofe_entity_linking.metrics import STAGE_DURATION
+from fofe_entity_linking.service import LinkerClient, RemoteModel
 
 from rasa.nlu.components import Component
 
 
 logger = logging.getLogger(__name__)
 
+# opt-in instrumentation (the "metrics" component option), exported by the GET /metrics route of ga_connector
+LINKED_MENTIONS = metrics.registry.counter(
+    "entity_linking_mentions_total", "Mentions linked, by entity type and source (exact_map, fuzzy, cache, model)",
+    ["entity_type", "source"])
+ENTITY_TYPE_OVERRIDES = metrics.registry.counter(
+    "entity_linking_entity_type_overrides_total", "Entity types changed by the disambiguation rules",
+    ["from_type", "to_type", "rule"])
+
 
 class CityMetro(Component):
     """
@@ -25,10 +46,77 @@ class CityMetro(Component):
 
     requires = []
 
-    defaults = {}
+    defaults = {
+        # fold the n-gram embedding into the first layer of each model (faster, same predictions)
+        "folded_inference": True,
+
+        # entity linking results cache, keyed by (gazetteer, normalized mention). 0 to disable the cache.
+        "cache_size": 1024,
+        # number of seconds a cached result stays valid, None to keep it until evicted
+        "cache_ttl": None,
+        # number of seconds between two checks for a changed model or gazetteer file
+        "cache_check_interval": 10,
+
+        # maximum edit distance of the typo-tolerant gazetteer lookup done before the models, 0 to disable.
+        # Enabled, it changes the linking: a mention within this distance of a single gazetteer name is linked
+        # to that name (confidence 1.0 - 0.05 per edit) instead of the model prediction
+        "fuzzy_max_distance": 0,
+
+        # yaml file of the rules choosing the entity type of a mention from its context and linking confidences
+        # (see fofe_entity_linking.disambiguation)
+        "disambiguation_rules": "./disambiguation.yml",
+
+        # name of a multi-head model trained on the four gazetteers (ex: "shared", see train_shared.sh),
+        # used in place of the four gazetteer models. None to use the four models.
+        "shared_model": None,
+
+        # names of the models run with int8 linear layers (ex: ["cities", "streets_montreal"]),
+        # check the accuracy first with: python -m fofe_entity_linking.quantization --name cities
+        "quantized": [],
+
+        # "torch" to run the .pth models, "numpy" to run the .fofe artifacts exported by fofe_entity_linking.export
+        # without importing torch (folded_inference and quantized are then ignored)
+        "runtime": "torch",
+
+        # load the models on a background thread, process() waits for them (see is_ready())
+        "background_loading": True,
+        # number of entity names of each gazetteer run through its model once loaded, 0 to skip the warm-up
+        "warmup_mentions": 4,
+
+        # torch runtime: run the models from the memory-mapped .fofe artifacts (see fofe_entity_linking.export),
+        # so the rasa processes of a host share a single copy of the weights (quantized is then ignored)
+        "shared_memory": False,
+        # maximum number of intra-op threads of this process (ex: number of cores / number of rasa processes),
+        # None to keep the runtime default (one thread per core)
+        "num_threads": None,
+
+        # url of a linker service shared by the NLU processes of the host (ex: "http://127.0.0.1:8765",
+        # see fofe_entity_linking.service), None to run the models in this process.
+        # When the service does not answer within the timeout (seconds), the models are loaded in this process
+        # and used for retry_interval seconds before the service is tried again.
+        "linker_service": None,
+        "linker_service_timeout": 0.5,
+        "linker_service_retry_interval": 30,
+
+        # gazetteer name -> retrieval index built by fofe_entity_linking.retrieval
+        # (ex: {"streets_montreal": "./fofe_entity_linking/models/streets_quebec.index"}): the names of the index
+        # are linked by nearest neighbor search in place of the softmax model of this gazetteer,
+        # the confidence is then a similarity score between 0 and 1
+        "retrieval_indexes": {},
+
+        # on a gazetteer change, update the trained model (new labels appended, fine-tuned for a few epochs,
+        # see fofe_entity_linking.incremental) instead of running its full train_*.sh script
+        "incremental_training": False,
+
+        # True to record the stage durations and linked mentions in fofe_entity_linking.metrics (GET /metrics)
+        "metrics": False,
+    }
 
     language_list = None
 
+    # every CityMetro component of this process, see loading_status()
+    instances = weakref.WeakSet()
+
     def __init__(self, component_config=None):
         super(CityMetro, self).__init__(component_config)
 
@@ -37,59 +125,312 @@ class CityMetro(Component):
         self.quartier_data_filename = "./fofe_entity_linking/quartiers.csv"
         self.street_data_filename = "./fofe_entity_linking/streets_montreal.csv"
 
-        # create exact match map from data
-        self.exact_map_cities = self.create_exact_map(self.cities_data_filename)
-        self.exact_map_metro = self.create_exact_map(self.metro_data_filename)
-        self.exact_map_quartier = self.create_exact_map(self.quartier_data_filename)
-        self.exact_map_steet = self.create_exact_map(self.street_data_filename)
-
-        # load cities model
-        self.cities_model, self.cities_embedding = predict.load_models(
-                                                "./fofe_entity_linking/models/cities.pth",
-                                                "./fofe_entity_linking/data/cities_embedding.pth",
-                                                "./fofe_entity_linking/data/cities_vocab.pickle")
-        with open("./fofe_entity_linking/data/cities_training_labels.pickle", "rb") as cities_label_file:
-            self.cities_labels, _, _ = pickle.load(cities_label_file)
+        self.shared_model_name = self.component_config.get("shared_model")
+        self.runtime = self.component_config.get("runtime", "torch")
+        self.instrumented = self.component_config.get("metrics", False)
+        self.disambiguation_rules = DisambiguationRules.load(
+            self.component_config.get("disambiguation_rules", "./disambiguation.yml"))
+
+        # cache of the entity linking results, cleared when a model or gazetteer file changes
+        cache_size = self.component_config.get("cache_size", 1024)
+        self.cache = LRUCache(cache_size, self.component_config.get("cache_ttl")) if cache_size else None
+        self.cache_check_interval = self.component_config.get("cache_check_interval", 10)
+        self.cache_files_signature = self.files_signature()
+        self.cache_last_check = time.monotonic()
+
+        # entity type -> everything needed to link a mention to this gazetteer, set by initialize_models()
+        self.linkers = {}
+        self._local_models = None
+        self.local_models_lock = threading.Lock()
+        self.loaded = threading.Event()
+        self.loading_error = None
+        CityMetro.instances.add(self)
+
+        num_threads = self.component_config.get("num_threads")
+        if num_threads:
+            self.limit_threads(num_threads, self.runtime)
+
+        if self.component_config.get("background_loading", True):
+            threading.Thread(target=self.initialize_models, name="CityMetro.initialize_models", daemon=True).start()
+        else:
+            self.initialize_models()
+
+    @classmethod
+    def loading_status(cls, config_filename="./config.yml"):
+        """
+        Returns "ready" when the models of every CityMetro component of this process are loaded and warmed up,
+        "failed" when a loading failed, "loading" otherwise.
+        Before a component is created, returns "loading" when the NLU pipeline of config_filename has
+        a CityMetro component, "not_applicable" otherwise (ex: a pipeline without entity linking).
+        """
+        instances = list(cls.instances)
+        if not instances:
+            return "loading" if cls.is_configured(config_filename) else "not_applicable"
+        if any(instance.loading_error is not None for instance in instances):
+            return "failed"
+        if all(instance.is_ready() for instance in instances):
+            return "ready"
+        return "loading"
+
+    @staticmethod
+    def is_configured(config_filename="./config.yml"):
+        """ Returns True if the NLU pipeline of the rasa config file has a CityMetro component. """
+        try:
+            with open(config_filename, encoding="utf-8") as f:
+                config = yaml.safe_load(f) or {}
+        except (OSError, yaml.YAMLError):
+            return False
+        return any(component.get("name") in ("entity_linking.CityMetro", CityMetro.name)
+                   for component in config.get("pipeline") or [] if isinstance(component, dict))
+
+    def is_ready(self):
+        return self.loaded.is_set() and self.loading_error is None
+
+    def wait_until_loaded(self, timeout=None):
+        """ Block until the models are loaded, raise the loading error if the loading failed. """
+        if not self.loaded.wait(timeout):
+            raise TimeoutError(f"entity linking models not loaded after {timeout} seconds")
+        if self.loading_error is not None:
+            raise RuntimeError("entity linking models loading failed") from self.loading_error
+
+    def initialize_models(self):
+        """ Load the models (concurrently), warm them up, then mark the component as ready. """
+        start_time = time.monotonic()
+        try:
+            self.load_linkers()
+            logger.info(f"*** entity linking models loaded in {time.monotonic() - start_time:.2f}s ***")
+
+            self.warm_up(self.component_config.get("warmup_mentions", 4))
+            logger.info(f"*** entity linking ready in {time.monotonic() - start_time:.2f}s ***")
+        except Exception as e:
+            logger.exception("*** entity linking models loading failed ***")
+            self.loading_error = e
+        finally:
+            self.loaded.set()
+
+    def load_linkers(self):
+        service_url = self.component_config.get("linker_service")
+        if service_url:
+            # thin client of a linker service, the models are only loaded in this process if the service fails
+            client = LinkerClient(service_url, self.component_config.get("linker_service_timeout", 0.5))
+            logger.info(f"*** entity linking with the linker service {service_url} ***")
+
+            models = {name: (self.remote_model(client, name), None)
+                      for name in ["cities", "metro", "quartiers", "streets_montreal"]}
+        else:
+            models = dict(self.local_models())
+
+        for name, index_filename in (self.component_config.get("retrieval_indexes") or {}).items():
+            models[name] = retrieval.load_linker(index_filename, "./fofe_entity_linking/models"), None
+            logger.info(f"*** {name} linked by nearest neighbor search in {index_filename} ***")
+
+        self.cities_model, self.cities_embedding = models["cities"]
+        self.metro_model, self.metro_embedding = models["metro"]
+        self.quartier_model, self.quartier_embedding = models["quartiers"]
+        self.streets_model, self.streets_embedding = models["streets_montreal"]
+
+        self.cities_labels = self.load_labels("cities", self.cities_model)
         logger.info(f"*** {len(self.cities_labels)} cities ***")
 
-        # load metro model
-        self.metro_model, self.metro_embedding = predict.load_models(
-                                                "./fofe_entity_linking/models/metro.pth",
-                                                "./fofe_entity_linking/data/metro_embedding.pth",
-                                                "./fofe_entity_linking/data/metro_vocab.pickle")
-        with open("./fofe_entity_linking/data/metro_training_labels.pickle", "rb") as metro_label_file:
-            self.metro_labels, _, _ = pickle.load(metro_label_file)
+        self.metro_labels = self.load_labels("metro", self.metro_model)
         logger.info(f"*** {len(self.metro_labels)} metro stations ***")
 
-        # load quartier model
-        self.quartier_model, self.quartier_embedding = predict.load_models(
-                                                "./fofe_entity_linking/models/quartiers.pth",
-                                                "./fofe_entity_linking/data/quartiers_embedding.pth",
-                                                "./fofe_entity_linking/data/quartiers_vocab.pickle")
-        with open("./fofe_entity_linking/data/quartiers_training_labels.pickle", "rb") as quartier_label_file:
-            self.quartier_labels, _, _ = pickle.load(quartier_label_file)
+        self.quartier_labels = self.load_labels("quartiers", self.quartier_model)
         logger.info(f"*** {len(self.quartier_labels)} quartiers ***")
 
-        # load steet model
-        self.streets_model, self.streets_embedding = predict.load_models(
-                                                "./fofe_entity_linking/models/streets_montreal.pth",
-                                                "./fofe_entity_linking/data/streets_montreal_embedding.pth",
-                                                "./fofe_entity_linking/data/streets_montreal_vocab.pickle")
-        with open("./fofe_entity_linking/data/streets_montreal_training_labels.pickle", "rb") as streets_label_file:
-            self.streets_labels, _, _ = pickle.load(streets_label_file)
+        self.streets_labels = self.load_labels("streets_montreal", self.streets_model)
         logger.info(f"*** {len(self.streets_labels)} streets ***")
 
+        # create exact match map from data (from the artifact gazetteer with the numpy runtime)
+        self.exact_map_cities = self.create_exact_map(self.cities_data_filename, self.cities_model)
+        self.exact_map_metro = self.create_exact_map(self.metro_data_filename, self.metro_model)
+        self.exact_map_quartier = self.create_exact_map(self.quartier_data_filename, self.quartier_model)
+        self.exact_map_steet = self.create_exact_map(self.street_data_filename, self.streets_model)
+
+        # typo-tolerant index over the exact maps, resolve unambiguous typos without the models
+        fuzzy_max_distance = self.component_config.get("fuzzy_max_distance", 0)
+        if fuzzy_max_distance:
+            self.fuzzy_index_cities = SymmetricDeleteIndex(self.exact_map_cities, fuzzy_max_distance)
+            self.fuzzy_index_metro = SymmetricDeleteIndex(self.exact_map_metro, fuzzy_max_distance)
+            self.fuzzy_index_quartier = SymmetricDeleteIndex(self.exact_map_quartier, fuzzy_max_distance)
+            self.fuzzy_index_street = SymmetricDeleteIndex(self.exact_map_steet, fuzzy_max_distance)
+        else:
+            self.fuzzy_index_cities = self.fuzzy_index_metro = None
+            self.fuzzy_index_quartier = self.fuzzy_index_street = None
+
+        # entity type -> everything needed to link a mention to this gazetteer
+        self.linkers = {
+            "city": (self.cities_model, self.cities_embedding, self.cities_labels,
+                     self.exact_map_cities, self.fuzzy_index_cities),
+            "metro": (self.metro_model, self.metro_embedding, self.metro_labels,
+                      self.exact_map_metro, self.fuzzy_index_metro),
+            "quartier": (self.quartier_model, self.quartier_embedding, self.quartier_labels,
+                         self.exact_map_quartier, self.fuzzy_index_quartier),
+            "street": (self.streets_model, self.streets_embedding, self.streets_labels,
+                       self.exact_map_steet, self.fuzzy_index_street),
+        }
+
+    def remote_model(self, client, name):
+        return RemoteModel(client, name, lambda: self.local_models()[name],
+                           self.component_config.get("linker_service_retry_interval", 30))
+
+    def local_models(self):
+        """ Returns the in-process models, dict: gazetteer name -> (model, embedding), loaded on the first call. """
+        with self.local_models_lock:
+            if self._local_models is None:
+                self._local_models = self.load_local_models()
+            return self._local_models
+
+    def load_local_models(self):
+        folded = self.component_config.get("folded_inference", True)
+        quantized = self.component_config.get("quantized") or []
+        shared_memory = self.component_config.get("shared_memory", False)
+
+        def load_model(name):
+            return self.load_model(name, folded, name in quantized, self.runtime, shared_memory)
+
+        if self.shared_model_name:
+            # one multi-head model for the four gazetteers: a mention is encoded once
+            # and a single forward pass gives the four distributions
+            shared_model, shared_embedding = load_model(self.shared_model_name)
+            if self.runtime == "numpy":
+                predictor = shared_model
+            else:
+                import fofe_entity_linking.predict as predict
+                predictor = predict.MultiHeadPredictor(shared_model, shared_embedding)
+            logger.info(f"*** shared model <{self.shared_model_name}> with heads {list(shared_model.heads)} ***")
+
+            return {name: (predictor.head(name), shared_embedding)
+                    for name in ["cities", "metro", "quartiers", "streets_montreal"]}
+
+        # the four models are loaded concurrently, torch.load and the numpy memory maps mostly release the GIL
+        with ThreadPoolExecutor(max_workers=4, thread_name_prefix="CityMetro.load_model") as executor:
+            futures = {name: executor.submit(load_model, name)
+                       for name in ["cities", "metro", "quartiers", "streets_montreal"]}
+            return {name: future.result() for name, future in futures.items()}
+
+    def warm_up(self, mentions_per_gazetteer=4):
+        """
+        Run each model on a few of its entity names, so the first request does not pay
+        the lazy initialization of the runtime (thread pools, memory allocation, ...).
+        The results are not cached.
+        """
+        for entity_type, (model, embedding, labels, _, _) in self.linkers.items():
+            for label in labels[:mentions_per_gazetteer]:
+                self.link_entity_model_inference(self.normalize_name(label), model, embedding, labels)
+
+    @staticmethod
+    def load_model(name, folded=True, quantized=False, runtime="torch", shared_memory=False):
+        """
+        Load the model ./fofe_entity_linking/models/{name}.pth with its n-gram embedding.
+
+        With the numpy runtime, or with shared_memory, load the artifact ./fofe_entity_linking/models/{name}.fofe
+        instead: the weights stay in its read-only memory map, shared by every process of the host.
+        A numpy model also carries its labels and gazetteer.
+        """
+        artifact_filename = f"./fofe_entity_linking/models/{name}.fofe"
+        if runtime == "numpy":
+            model = numpy_predict.load_model(artifact_filename)
+            CityMetro.log_artifact(name, model.header)
+            return model, None
+
+        # torch is only imported when a torch model is used
+        import fofe_entity_linking.predict as predict
+        if shared_memory:
+            model, embedding = predict.load_artifact(artifact_filename)
+            CityMetro.log_artifact(name, model.header)
+            return model, embedding
+
+        return predict.load_models(f"./fofe_entity_linking/models/{name}.pth",
+                                   f"./fofe_entity_linking/data/{name}_embedding.pth",
+                                   f"./fofe_entity_linking/data/{name}_vocab.pickle",
+                                   folded=folded, quantized=quantized)
+
+    @staticmethod
+    def limit_threads(num_threads, runtime="torch"):
+        """ Limit the intra-op threads, so the rasa processes of a host do not oversubscribe its cores. """
+        if runtime == "torch":
+            import torch
+            torch.set_num_threads(num_threads)
+
+        # numpy BLAS thread pools
+        try:
+            from threadpoolctl import threadpool_limits
+        except ImportError:
+            logger.warning(f"*** threadpoolctl not installed, set OMP_NUM_THREADS={num_threads} "
+                           f"to limit the numpy threads ***")
+        else:
+            threadpool_limits(num_threads)
+        logger.info(f"*** entity linking limited to {num_threads} threads ***")
+
+    @staticmethod
+    def log_artifact(name, header):
+        logger.info(f"*** {name}.fofe: created {header.get('created')}, checksum {header['checksum']:08x}, "
+                    f"hidden {header['hidden_size']}, hyperparameters {header['hyperparameters']} ***")
+
+    @staticmethod
+    def load_labels(name, model=None):
+        """
+        Returns the list of entity names of the gazetteer, in the model classes order.
+        A numpy runtime model carries its own labels, they are used when given.
+        """
+        if getattr(model, "labels", None) is not None:
+            return model.labels
+
+        with open(f"./fofe_entity_linking/data/{name}_training_labels.pickle", "rb") as label_file:
+            labels, _, _ = pickle.load(label_file)
+        return labels
+
+    def files_signature(self):
+        """ Returns the modification time of every gazetteer and model file used by this component. """
+        filenames = [self.cities_data_filename, self.metro_data_filename,
+                     self.quartier_data_filename, self.street_data_filename]
+        for name in ["cities", "metro", "quartiers", "streets_montreal", self.shared_model_name]:
+            if not name:
+                continue
+            filenames += [f"./fofe_entity_linking/models/{name}.pth",
+                          f"./fofe_entity_linking/models/{name}.fofe",
+                          f"./fofe_entity_linking/data/{name}_embedding.pth",
+                          f"./fofe_entity_linking/data/{name}_vocab.pickle",
+                          f"./fofe_entity_linking/data/{name}_training_labels.pickle"]
+        filenames += list((self.component_config.get("retrieval_indexes") or {}).values())
+
+        return tuple(os.path.getmtime(f) if os.path.exists(f) else None for f in filenames)
+
+    def check_cache_validity(self):
+        """ Clear the cache if a model or gazetteer file changed since the last check. """
+        if self.cache is None or time.monotonic() - self.cache_last_check < self.cache_check_interval:
+            return
+
+        self.cache_last_check = time.monotonic()
+        signature = self.files_signature()
+        if signature != self.cache_files_signature:
+            logger.info(f"*** model or gazetteer file changed, clearing entity linking cache ***")
+            self.cache.clear()
+            self.cache_files_signature = signature
+
+    def cache_stats(self):
+        """ Returns the cache counters (hits, misses, evictions, ...), None if the cache is disabled. """
+        return self.cache.stats() if self.cache is not None else None
+
     @staticmethod
-    def train_model(model_name, script_path, data_filename):
+    def train_model(model_name, script_path, data_filename, incremental=False):
         if CityMetro.data_changed(data_filename):
-            CityMetro.run_training_subprocess(model_name, script_path, data_filename)
+            CityMetro.run_training_subprocess(model_name, script_path, data_filename, incremental)
         else:
             logger.info(f"*** <{data_filename}> did not change. No need to retrain. ***")
 
     @staticmethod
-    def run_training_subprocess(model_name, script_path, data_filename):
-        logger.info(f"*** training {model_name} ***")
-        completed_process = subprocess.run([script_path])
+    def run_training_subprocess(model_name, script_path, data_filename, incremental=False):
+        if incremental and os.path.isfile(f"./fofe_entity_linking/models/{model_name}.pth"):
+            logger.info(f"*** incremental training {model_name} ***")
+            command = [sys.executable, "-m", "fofe_entity_linking.incremental",
+                       "--name", model_name, "--gazetteer", data_filename,
+                       "--data_dir", "./fofe_entity_linking/data", "--models_dir", "./fofe_entity_linking/models"]
+        else:
+            logger.info(f"*** training {model_name} ***")
+            command = [script_path]
+        completed_process = subprocess.run(command)
 
         if completed_process.returncode == 0:
             CityMetro.save_md5_file(data_filename)
@@ -97,58 +438,77 @@ class CityMetro(Component):
             logger.error(f"*** training {model_name} - error returncode={completed_process.returncode} ***")
 
     def train(self, training_data, cfg, **kwargs):
-        self.train_model("cities", "./train_cities.sh", self.cities_data_filename)
-        self.train_model("metro", "./train_metro.sh", self.metro_data_filename)
-        self.train_model("quartiers", "./train_quartiers.sh", self.quartier_data_filename)
-        self.train_model("streets_montreal", "./train_steets_montreal.sh", self.street_data_filename)
+        data_filenames = [self.cities_data_filename, self.metro_data_filename,
+                          self.quartier_data_filename, self.street_data_filename]
+        shared_model_outdated = any(CityMetro.data_changed(f) for f in data_filenames)
+
+        incremental = self.component_config.get("incremental_training", False)
+        self.train_model("cities", "./train_cities.sh", self.cities_data_filename, incremental)
+        self.train_model("metro", "./train_metro.sh", self.metro_data_filename, incremental)
+        self.train_model("quartiers", "./train_quartiers.sh", self.quartier_data_filename, incremental)
+        self.train_model("streets_montreal", "./train_steets_montreal.sh", self.street_data_filename, incremental)
+
+        if self.shared_model_name:
+            # the shared model uses the training sets generated by the scripts above
+            if shared_model_outdated:
+                logger.info(f"*** training {self.shared_model_name} ***")
+                subprocess.run(["./train_shared.sh"])
+            else:
+                logger.info(f"*** gazetteers did not change. No need to retrain {self.shared_model_name}. ***")
+
+        if self.cache is not None:
+            self.cache.clear()
 
     @staticmethod
     def expand_saint_abreviation(s):
-        s = s.lower()
-
         # replace "st-" by "saint-" only when it's start with or is preceeded by a space or a dash.
         # to avoid situation like this:
         #        Saint-Juste-du-Lac  -->  Saint-Jusainte-du-Lac
-        i = s.find('st-')
-        if i >= 0 and (i == 0 or s[i-1] in [' ','-']):
-            s = s.replace('st-', 'saint-', 1)
-
-        i = s.find('st ')
-        if i >= 0 and (i == 0 or s[i - 1] in [' ', '-']):
-            s = s.replace('st ', 'saint ', 1)
-
-        i = s.find('ste-')
-        if i >= 0 and (i == 0 or s[i-1] in [' ','-']):
-            s = s.replace('ste-', 'sainte-', 1)
-
-        i = s.find('ste ')
-        if i >= 0 and (i == 0 or s[i - 1] in [' ', '-']):
-            s = s.replace('ste ', 'sainte ', 1)
-
-        return s
+        return normalizer.expand_saint_abbreviation(s)
 
     @staticmethod
     def link_entity_model_inference(text, model, embedding, labels, max_length=50):
-        prediction = predict.predict(model, embedding, text, max_length)
-
-        # max = prediction.argmax(1)[0]
-        # predicted_label = labels[max]
+        if isinstance(model, RemoteModel):
+            linked = model.link(text, max_length)
+            if linked is not None:
+                return linked
+            # the linker service is not available
+            model, embedding = model.local_model()
+
+        if isinstance(model, retrieval.RetrievalLinker):
+            # None when the index has no candidate name for the text
+            return model.link([text], max_length)[0]
+
+        if embedding is None:
+            # numpy runtime model (or head), see fofe_entity_linking.numpy_predict
+            prediction = numpy_predict.predict(model, text, max_length)
+        else:
+            import fofe_entity_linking.predict as predict
+            prediction = predict.predict(model, embedding, text, max_length)
 
-        # top-k
-        values, indices = prediction.topk(5)
-        predicted_label = labels[indices[0][0]]
-        predicted_prob = math.exp(values[0][0].item())
-        # for rank, indice in enumerate(indices[0]):
-        #     print(f'top {rank+1} ({math.exp(values[0][rank].item()):.10f}): {labels[indice]}')
+        # works the same on a torch tensor and on a numpy array
+        log_probs = prediction[0]
+        max = int(log_probs.argmax())
+        predicted_label = labels[max]
+        predicted_prob = math.exp(float(log_probs[max]))
 
         return predicted_label, predicted_prob
 
     @staticmethod
-    def predict_entity_linking(entities, model, embedding, labels, exact_map, entity_predicted):
+    def predict_entity_linking(entities, model, embedding, labels, exact_map, entity_predicted, cache=None,
+                               fuzzy_index=None, instrumented=False):
         """
         Make a prediction for each given entities using the given model and store the result
         in the entity dict under the key "entity_linking".
 
+        If a fuzzy index is given, a mention that is an unambiguous typo of a gazetteer name is linked
+        to that name without running the model, with a confidence of 1.0 - 0.05 per edit.
+
+        If a cache is given, the (linked_name, probability) model result is looked up and stored
+        in the cache under the key (entity_predicted, normalized_name).
+
+        If instrumented, each linked mention is counted by source (exact_map, fuzzy, cache or model).
+
         Example for metro model with CRFEntityExtractor that extracted a city entity.
         entities:         [{'start': 9, 'end': 17, 'value': 'longueuil', 'entity': 'city', 'confidence': 0.976792, 'extractor': 'CRFEntityExtractor'}]
 
@@ -159,19 +519,49 @@ class CityMetro(Component):
                           }]
         """
         for i, entity in enumerate(entities):
-            text = CityMetro.expand_saint_abreviation(entity.get('value'))
-            normalized_name = CityMetro.normalize_name(text)
+            # saint abbreviations expanded, then normalized as the gazetteer names (memoized)
+            normalized_name = normalizer.normalize_mention(entity.get('value'))
 
             # check for a direct match in dictionary before running the NN Model
             linked_name = exact_map.get(normalized_name)
+            fuzzy_match = None
+            cached = None
+            if not linked_name and fuzzy_index is not None:
+                fuzzy_match = fuzzy_index.best_match(normalized_name)
+            if not linked_name and not fuzzy_match and cache is not None:
+                cached = cache.get((entity_predicted, normalized_name))
+
             if linked_name:
+                source = "exact_map"
                 probability = 1.0
                 logger.info(f"*** {entity_predicted} entity linked found in dictionary <{linked_name}> ({probability:.4f}) ***")
+            elif fuzzy_match:
+                source = "fuzzy"
+                linked_name, distance = fuzzy_match
+                probability = 1.0 - 0.05 * distance
+                logger.info(f"*** {entity_predicted} entity linked from <{normalized_name}> to <{linked_name}> "
+                            f"({probability:.4f}) found in dictionary at distance {distance} ***")
+            elif cached:
+                source = "cache"
+                linked_name, probability = cached
+                logger.info(f"*** {entity_predicted} entity linked found in cache <{linked_name}> ({probability:.4f}) ***")
             else:
                 # ask the entity linking NN Model to predict the entity name
-                linked_name, probability = CityMetro.link_entity_model_inference(normalized_name, model, embedding, labels)
+                source = "model"
+                linked = CityMetro.link_entity_model_inference(normalized_name, model, embedding, labels)
+                if linked is None:
+                    # no candidate in the retrieval index: no link for this entity type
+                    logger.info(f"*** {entity_predicted} entity not linked, no candidate for <{normalized_name}> ***")
+                    continue
+                linked_name, probability = linked
                 logger.info(f"*** {entity_predicted} entity linked from <{normalized_name}> to <{linked_name}> ({probability:.4f}) ***")
 
+                if cache is not None:
+                    cache.put((entity_predicted, normalized_name), (linked_name, probability))
+
+            if instrumented:
+                LINKED_MENTIONS.inc(entity_type=entity_predicted, source=source)
+
             if not entities[i].get('entity_linking'):
                 entities[i]['entity_linking'] = {}
             if not entities[i]['entity_linking'].get(entity_predicted):
@@ -193,10 +583,16 @@ class CityMetro(Component):
         entities = [e for e in message.get('entities') if e['entity'] in ['city', 'metro', 'quartier', 'street']]
 
         if entities:
-            self.predict_entity_linking(entities, self.cities_model, self.cities_embedding, self.cities_labels, self.exact_map_cities, "city")
-            self.predict_entity_linking(entities, self.metro_model, self.metro_embedding, self.metro_labels, self.exact_map_metro, "metro")
-            self.predict_entity_linking(entities, self.quartier_model, self.quartier_embedding, self.quartier_labels, self.exact_map_quartier, "quartier")
-            self.predict_entity_linking(entities, self.streets_model, self.streets_embedding, self.streets_labels, self.exact_map_steet, "street")
+            start_time = time.perf_counter() if self.instrumented else None
+
+            # a message received while the models are still loading waits for them
+            self.wait_until_loaded()
+            self.check_cache_validity()
+
+            # link every entity type: the disambiguation rules and the requested slot correction of
+            # ChargingPlaceForm (actions.py) read the linking of each of them
+            for entity_type in self.linkers:
+                self.link(entities, entity_type)
 
             # logger.info(f"*** {entities} ***")
             # entities example:
@@ -232,109 +628,82 @@ class CityMetro(Component):
             #   }
             # ]
 
+            disambiguation_start_time = time.perf_counter() if self.instrumented else None
             for entity in entities:
-                disambiguated = False
-
-                # default is entity selected by CRFEntityExtractor
-                selected_entity = entity['entity']
-                text_15_chars_before = message.text[max(0, entity['start'] - 15):entity['start']]
-
-                # DISAMBIGUATION - METRO
-                if entity['entity_linking']['metro']['confidence'] > 0.60:
-                    if any(keyword in text_15_chars_before for keyword in ['métro']):
-                        # some keywords confirm that we are talking of a metro station.
-                        # ex: <Longueuil> the city or the metro station: "bornes au métro Longueuil"
-                        selected_entity = 'metro'
-                        disambiguated = True
-                    elif 'station' in text_15_chars_before:
-                        # the word station appears in the 15 chars before the entity name
-                        # ex: <Longueuil> the city or the metro station: "bornes à la station Longueuil",
-                        #                 but not "où sont les station de recharge à proximité de Longueuil"
-                        selected_entity = 'metro'
-                        disambiguated = True
-
-                # DISAMBIGUATION - STREET
-                if entity['entity_linking']['street']['confidence'] > 0.60:
-                    if any(keyword in text_15_chars_before for keyword in
-                           ['rue ', 'rues ', 'avenue', 'ave ', 'levard', 'boul.', 'boul ', 'bld', 'street', 'road', ' coin', 'rsection']):
-                        # one of these word appears in the 15 chars before the entity name
-                        selected_entity = 'street'
-                        disambiguated = True
-
-                # DISAMBIGUATION - QUARTIER
-                if not disambiguated:
-                    if entity['entity_linking']['quartier']['confidence'] > 0.60:
-                        if any(keyword in text_15_chars_before for keyword in ['quartier', 'dissement', 'secteur']):  # dissement -> arrondissement
-                            # some keywords confirm that we are talking of a quartier of Montreal.
-                            # ex: <Rosemont> guess as <Rougemont> city but is a quartier: "bornes dans le quartier Rosemont"
-                            selected_entity = 'quartier'
-                            disambiguated = True
-
-                # DISAMBIGUATION - CITY
-                if not disambiguated:
-                    if entity['entity_linking']['city']['confidence'] > 0.60:
-                        if any(keyword in text_15_chars_before for keyword in ['ville', 'village']):
-                            # some keywords confirm that we are talking of a quartier of Montreal.
-                            # ex: <Longueuil> as the metro but is a city: "bornes dans la ville de Longueuil"
-                            selected_entity = 'city'
-                            disambiguated = True
-
-                # DISAMBIGUATION - VERY LOW CONFIDENCE IN THE CRFENTITYEXTRACTOR CANDIDATE
-                if not disambiguated and entity['entity_linking'][selected_entity]['confidence'] < 0.60:
-                    if entity['entity_linking']['city']['confidence'] > 0.95:
-                        selected_entity = 'city'
-                        disambiguated = True
-                    elif entity['entity_linking']['metro']['confidence'] > 0.95:
-                        selected_entity = 'metro'
-                        disambiguated = True
-                    elif entity['entity_linking']['quartier']['confidence'] > 0.95:
-                        selected_entity = 'quartier'
-                        disambiguated = True
-                    elif entity['entity_linking']['street']['confidence'] > 0.95:
-                        selected_entity = 'quartier'
-                        disambiguated = True
+                # default is entity selected by CRFEntityExtractor, changed by the disambiguation rules
+                # (see disambiguation.yml) on keywords in the text before the entity and on the linking confidences
+                context = self.disambiguation_rules.context(message.text, entity['start'])
+                selected_entity, rule = self.disambiguation_rules.select(
+                    entity['entity'], context, functools.partial(self.confidence, entity))
+                if rule is not None:
+                    entity['disambiguation_rule'] = rule
 
                 # apply the entity found by entity linking model
                 if entity['entity'] != selected_entity:
-                    logger.info(f"*** CRFEntityExtractor decision changed from {entity['entity']} to {selected_entity} ***")
+                    logger.info(f"*** CRFEntityExtractor decision changed from {entity['entity']} to {selected_entity} "
+                                f"by the rule {rule} ***")
                     entity['old_entity'] = entity['entity']
                     entity['old_confidence'] = entity['confidence']
-
-                entity['value'] = entity['entity_linking'][selected_entity]['value']
-                entity['confidence'] = entity['entity_linking'][selected_entity]['confidence']
+                    if self.instrumented:
+                        ENTITY_TYPE_OVERRIDES.inc(from_type=entity['entity'], to_type=selected_entity, rule=rule)
+
+                # an entity type without link keeps the extracted value
+                linked = entity.get('entity_linking', {}).get(selected_entity)
+                if linked:
+                    entity['value'] = linked['value']
+                    entity['confidence'] = linked['confidence']
                 entity['entity'] = selected_entity
 
             message.set("entities", entities, add_to_output=True)
 
+            if self.instrumented:
+                end_time = time.perf_counter()
+                STAGE_DURATION.observe(end_time - disambiguation_start_time, stage="disambiguation")
+                STAGE_DURATION.observe(end_time - start_time, stage="entity_linking")
+
+    def link(self, entities, entity_type):
+        """ Link the given entities to the gazetteer of entity_type, unless already done. """
+        entities = [e for e in entities if entity_type not in e.get('entity_linking', {})]
+        if entities:
+            start_time = time.perf_counter() if self.instrumented else None
+
+            model, embedding, labels, exact_map, fuzzy_index = self.linkers[entity_type]
+            self.predict_entity_linking(entities, model, embedding, labels, exact_map, entity_type,
+                                        self.cache, fuzzy_index, self.instrumented)
+
+            if self.instrumented:
+                STAGE_DURATION.observe(time.perf_counter() - start_time, stage="link", entity_type=entity_type)
+        return entities
+
+    @staticmethod
+    def confidence(entity, entity_type):
+        """
+        Returns the entity linking confidence of the entity for entity_type, read by the disambiguation rules,
+        0.0 when the entity has no link for this type.
+        """
+        return entity.get('entity_linking', {}).get(entity_type, {}).get('confidence', 0.0)
+
     def persist(self, file_name, model_dir):
         """ Persist this component to disk for future loading. """
         pass
 
     @staticmethod
-    def create_exact_map(data_filename):
-        """ Create a map of normalized version of the entity with the entity. """
-        with open(data_filename) as f:
-            content = f.readlines()
+    def create_exact_map(data_filename, model=None):
+        """
+        Create a map of normalized version of the entity with the entity.
+        A numpy runtime model carries the gazetteer it was exported with, it is used when given.
+        """
+        content = getattr(model, "gazetteer", None)
+        if content is None:
+            with open(data_filename) as f:
+                content = f.readlines()
 
         return {CityMetro.normalize_name(entity): entity.strip() for entity in content}
 
     @staticmethod
     def normalize_name(s):
-        # lower case and accents removed
-        s = unidecode.unidecode(s).lower().strip()
-
-        # remove spaces around dash
-        s = s.replace(" - ", ' ')
-
-        # replace apostrophe and dash by space
-        s = s.replace("-", ' ')
-        s = s.replace("'", ' ')
-
-        # replace multiple spaces by a single space
-        s = s.replace("   ", ' ')
-        s = s.replace("  ", ' ')
-
-        return s
+        # lower case and accents removed, apostrophe and dash replaced by space, multiple spaces by one
+        return normalizer.normalize_name(s)
 
     @staticmethod
     def data_changed(filename):
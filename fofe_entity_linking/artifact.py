@@ -0,0 +1,104 @@
+import json
+import struct
+import zlib
+
+import numpy as np
+
+
+# file layout:
+#   magic (8 bytes) | format version (uint32) | header length (uint32) | JSON header | padding | arrays
+# each array starts on an ALIGNMENT boundary, so it can be used in place from a read-only memory map
+MAGIC = b'FOFELINK'
+FORMAT_VERSION = 1
+ALIGNMENT = 64
+
+_PREFIX = struct.Struct('<8sII')
+
+
+def _aligned(position):
+    return (position + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+def write_artifact(filename, arrays, metadata):
+    """
+    Write numpy arrays and JSON metadata to a single artifact file, see read_artifact().
+
+    Arguments
+        filename - string, the artifact file name
+        arrays - dict, array name -> numeric numpy array
+        metadata - dict, JSON serializable values (hyperparameters, vocab, labels, ...)
+    """
+    # data section: each array aligned, offsets relative to the start of the data section
+    array_table = {}
+    chunks = []
+    size = 0
+    for name, array in arrays.items():
+        array = np.ascontiguousarray(array)
+        start = _aligned(size)
+        chunks.append(b'\0' * (start - size))
+        chunks.append(array.tobytes())
+        array_table[name] = {'dtype': array.dtype.str, 'shape': list(array.shape), 'offset': start}
+        size = start + array.nbytes
+    data = b''.join(chunks)
+
+    header = dict(metadata)
+    header['format_version'] = FORMAT_VERSION
+    header['checksum'] = zlib.crc32(data)
+    header['data_size'] = len(data)
+    header['arrays'] = array_table
+    header_bytes = json.dumps(header, ensure_ascii=False).encode('utf-8')
+
+    data_start = _aligned(_PREFIX.size + len(header_bytes))
+    with open(filename, 'wb') as output_file:
+        output_file.write(_PREFIX.pack(MAGIC, FORMAT_VERSION, len(header_bytes)))
+        output_file.write(header_bytes)
+        output_file.write(b'\0' * (data_start - _PREFIX.size - len(header_bytes)))
+        output_file.write(data)
+
+
+def _read_header(filename):
+    """ Returns the JSON header of an artifact and the position of its data section. """
+    with open(filename, 'rb') as input_file:
+        magic, format_version, header_length = _PREFIX.unpack(input_file.read(_PREFIX.size))
+        if magic != MAGIC:
+            raise ValueError(f'{filename} is not an entity linking artifact')
+        if format_version != FORMAT_VERSION:
+            raise ValueError(f'{filename}: unsupported artifact format version {format_version}, '
+                             f'expected {FORMAT_VERSION}')
+        header = json.loads(input_file.read(header_length).decode('utf-8'))
+
+    return header, _aligned(_PREFIX.size + header_length)
+
+
+def read_header(filename):
+    """ Returns the JSON header of an artifact (hyperparameters, checksum, ...), without reading the arrays. """
+    return _read_header(filename)[0]
+
+
+def read_artifact(filename, verify=True):
+    """
+    Returns (header, arrays) of an artifact written by write_artifact().
+
+    The arrays are read-only views on a memory map of the file: nothing is copied, and the processes
+    that load the same artifact share its pages through the page cache.
+
+    Arguments
+        filename - string, the artifact file name
+        verify - boolean, True to check the data section checksum (reads the whole file once)
+    """
+    header, data_start = _read_header(filename)
+
+    data = np.memmap(filename, dtype=np.uint8, mode='r')[data_start:]
+    if len(data) != header['data_size']:
+        raise ValueError(f'{filename}: truncated artifact, {len(data)} bytes of data instead of {header["data_size"]}')
+    if verify and zlib.crc32(data) != header['checksum']:
+        raise ValueError(f'{filename}: checksum mismatch, the artifact is corrupted')
+
+    arrays = {}
+    for name, entry in header['arrays'].items():
+        dtype = np.dtype(entry['dtype'])
+        count = int(np.prod(entry['shape'], dtype=np.int64))
+        offset = entry['offset']
+        arrays[name] = data[offset:offset + count * dtype.itemsize].view(dtype).reshape(entry['shape'])
+
+    return header, arrays
@@ -0,0 +1,282 @@
+import argparse
+import copy
+import glob
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+from .normalizer import normalize_mention
+from .service import load_predictors
+from .workers_memory import process_memory
+
+
+# CityMetro entity type -> gazetteer name
+GAZETTEERS = {'city': 'cities', 'metro': 'metro', 'quartier': 'quartiers', 'street': 'streets_montreal'}
+
+
+def peak_memory():
+    """ Returns the peak resident set size of the current process, in bytes (ru_maxrss is in kilobytes on linux). """
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def latency_summary(timings):
+    """ Returns the number, mean, p50, p95, p99 and max of the given durations in seconds, in milliseconds. """
+    if not len(timings):
+        return {'count': 0}
+
+    timings = np.asarray(timings) * 1000
+    p50, p95, p99 = np.percentile(timings, [50, 95, 99])
+    return {
+        'count': len(timings),
+        'mean_ms': float(timings.mean()),
+        'p50_ms': float(p50),
+        'p95_ms': float(p95),
+        'p99_ms': float(p99),
+        'max_ms': float(timings.max()),
+    }
+
+
+def time_calls(function, items, warmup_items=()):
+    """ Returns the duration in seconds of function(item) for each item, after the untimed warm-up calls. """
+    for item in warmup_items:
+        function(item)
+
+    timings = []
+    for item in items:
+        start = time.perf_counter()
+        function(item)
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def throughput(predict_batch, texts, batch_sizes, max_tokens=50):
+    """ Returns a dict: batch size -> number of texts per second predicted by batches of that size. """
+    results = {}
+    for batch_size in batch_sizes:
+        predict_batch(texts[:batch_size], max_tokens)
+
+        start = time.perf_counter()
+        for i in range(0, len(texts), batch_size):
+            predict_batch(texts[i:i + batch_size], max_tokens)
+        results[str(batch_size)] = len(texts) / (time.perf_counter() - start)
+    return results
+
+
+def read_rasa_examples(filename):
+    """ Returns the examples of a rasa NLU json file with at least one entity linked by CityMetro. """
+    with open(filename, encoding='utf-8') as f:
+        examples = json.load(f)['rasa_nlu_data']['common_examples']
+    return [example for example in examples
+            if any(entity['entity'] in GAZETTEERS for entity in example.get('entities', []))]
+
+
+def read_mentions(data_dir, examples=(), max_mentions=None, seed=0):
+    """
+    Returns a dict: gazetteer name -> mentions, from data_dir/{name}_test_set.csv and from the entities
+    of the given rasa examples. Shuffled, at most max_mentions per gazetteer.
+    """
+    mentions = {}
+    for filename in sorted(glob.glob(os.path.join(data_dir, '*_test_set.csv'))):
+        name = os.path.basename(filename)[:-len('_test_set.csv')]
+        mentions[name] = pd.read_csv(filename)['EntityMention'].astype(str).tolist()
+
+    for example in examples:
+        for entity in example['entities']:
+            if entity['entity'] in GAZETTEERS:
+                mentions.setdefault(GAZETTEERS[entity['entity']], []).append(str(entity['value']))
+
+    random_state = np.random.RandomState(seed)
+    for name in mentions:
+        mentions[name] = [mentions[name][i] for i in random_state.permutation(len(mentions[name]))[:max_mentions]]
+    return mentions
+
+
+def benchmark_models(predictors, mentions, batch_sizes, max_tokens=50, warmup=10):
+    """
+    Returns the single mention latency (as CityMetro runs a model) and the batch throughput of each model,
+    on the mentions of its gazetteer.
+    """
+    latency, batch_throughput = {}, {}
+    for name, (predict_batch, _) in predictors.items():
+        texts = mentions.get(name)
+        if not texts:
+            continue
+        timings = time_calls(lambda text: predict_batch([text], max_tokens), texts, texts[:warmup])
+        latency[name] = latency_summary(timings)
+        batch_throughput[name] = throughput(predict_batch, texts, batch_sizes, max_tokens)
+    return latency, batch_throughput
+
+
+def benchmark_normalization(mentions):
+    """ Returns the latency of the mention normalization, without its memo. """
+    all_mentions = [mention for name in sorted(mentions) for mention in mentions[name]]
+    normalize = normalize_mention.__wrapped__
+    return latency_summary(time_calls(normalize, all_mentions, all_mentions[:100]))
+
+
+def benchmark_exact_maps(CityMetro, mentions, gazetteer_dir):
+    """ Returns the latency of the exact map lookup of each gazetteer. """
+    exact_map = {}
+    for name, texts in mentions.items():
+        gazetteer = CityMetro.create_exact_map(os.path.join(gazetteer_dir, f'{name}.csv'))
+        normalized_texts = [normalize_mention(text) for text in texts]
+        exact_map[name] = latency_summary(time_calls(gazetteer.get, normalized_texts))
+        exact_map[name]['hit_rate'] = float(np.mean([text in gazetteer for text in normalized_texts]))
+
+    return exact_map
+
+
+def benchmark_process(CityMetro, Message, examples, config, warmup=10):
+    """ Returns the latency of CityMetro.process() on a message of each example. """
+    component = CityMetro(dict(config, background_loading=False))
+
+    def message(example):
+        # the entities as CRFEntityExtractor gives them
+        entities = [dict(copy.deepcopy(entity), confidence=1.0, extractor='CRFEntityExtractor')
+                    for entity in example['entities']]
+        return Message(example['text'], {'entities': entities})
+
+    # process() changes the entities of its message, each call gets its own message
+    warmup_messages = [message(example) for example in examples[:warmup]]
+    messages = [message(example) for example in examples]
+    return latency_summary(time_calls(component.process, messages, warmup_messages))
+
+
+def import_citymetro():
+    """ Returns the CityMetro component and the rasa Message class, or the reason they cannot be imported. """
+    try:
+        from entity_linking import CityMetro
+        from rasa.nlu.training_data import Message
+    except ImportError as e:
+        return None, None, f'entity_linking cannot be imported: {e}'
+    return CityMetro, Message, None
+
+
+def environment():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True).stdout.strip() or None
+    except OSError:
+        commit = None
+
+    return {
+        'commit': commit,
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+    }
+
+
+def run(args):
+    examples = read_rasa_examples(args.rasa_dataset) if os.path.exists(args.rasa_dataset) else []
+    mentions = read_mentions(args.data_dir, examples, args.max_mentions, args.seed)
+    CityMetro, Message, citymetro_error = import_citymetro()
+    names = args.names.split(',')
+
+    results = {
+        'environment': dict(environment(), runtime=args.runtime, shared_model=args.shared_model,
+                            max_mentions=args.max_mentions, batch_sizes=args.batch_sizes),
+        'mentions': {name: len(texts) for name, texts in mentions.items()},
+        'examples': len(examples),
+        'stages': {},
+        'throughput': {},
+        'memory': {},
+    }
+    stages = results['stages']
+
+    stages['normalization'] = benchmark_normalization(mentions)
+    if CityMetro is None:
+        stages['exact_map'] = {'skipped': citymetro_error}
+    else:
+        stages['exact_map'] = benchmark_exact_maps(CityMetro, mentions, args.gazetteer_dir)
+
+    rss_before = process_memory()['rss']
+    predictors = load_predictors(names, args.runtime, args.models_dir, args.data_dir, args.shared_model)
+    results['memory']['models_rss_bytes'] = process_memory()['rss'] - rss_before
+
+    batch_sizes = [int(batch_size) for batch_size in args.batch_sizes.split(',')]
+    stages['model'], results['throughput'] = benchmark_models(predictors, mentions, batch_sizes, args.max_length)
+    del predictors
+
+    if CityMetro is None:
+        stages['process'] = {'skipped': citymetro_error}
+    elif not examples:
+        stages['process'] = {'skipped': f'no examples in {args.rasa_dataset}'}
+    else:
+        config = dict(json.loads(args.process_config), runtime=args.runtime)
+        if args.shared_model:
+            config['shared_model'] = args.shared_model
+        stages['process'] = benchmark_process(CityMetro, Message, examples[:args.max_examples], config)
+
+    results['memory']['peak_rss_bytes'] = peak_memory()
+    return results
+
+
+def changes(baseline, results, path=''):
+    """ Yields (metric path, baseline value, value) of the latency percentiles and throughputs of both results. """
+    for key, value in results.items():
+        if key == 'environment' or key not in baseline:
+            continue
+        if isinstance(value, dict):
+            yield from changes(baseline[key], value, f'{path}{key}.')
+        elif key in ('p50_ms', 'p95_ms', 'p99_ms') or path.startswith('throughput.'):
+            yield f'{path}{key}', baseline[key], value
+
+
+def print_results(results):
+    for stage, summary in results['stages'].items():
+        summaries = summary.items() if 'count' not in summary and 'skipped' not in summary else [('', summary)]
+        for name, s in summaries:
+            label = f'{stage} {name}'.strip()
+            if 'skipped' in s:
+                print(f'{label}: skipped ({s["skipped"]})')
+            elif s['count']:
+                print(f"{label}: {s['count']} calls, p50 {s['p50_ms']:.4f} ms, p95 {s['p95_ms']:.4f} ms, "
+                      f"p99 {s['p99_ms']:.4f} ms")
+    for name, by_batch_size in results['throughput'].items():
+        print(f'{name} mentions/s: ' + ', '.join(f'batch {b}: {t:.0f}' for b, t in by_batch_size.items()))
+    print(f"models +{results['memory']['models_rss_bytes'] / 2**20:.1f} MB, "
+          f"peak rss {results['memory']['peak_rss_bytes'] / 2**20:.1f} MB")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser('Latency and throughput of each entity linking stage, json output to diff')
+    parser.add_argument('--names', type=str, default='cities,metro,quartiers,streets_montreal')
+    parser.add_argument('--runtime', type=str, choices=['torch', 'numpy'], default='torch')
+    parser.add_argument('--shared_model', type=str, default=None, help='name of a multi-head model')
+    parser.add_argument('--models_dir', type=str, default='./fofe_entity_linking/models')
+    parser.add_argument('--data_dir', type=str, default='./fofe_entity_linking/data')
+    parser.add_argument('--gazetteer_dir', type=str, default='./fofe_entity_linking')
+    parser.add_argument('--rasa_dataset', type=str, default='./tests/rasa_dataset_testing.json')
+    parser.add_argument('--max_mentions', type=int, default=2000, help='per gazetteer')
+    parser.add_argument('--max_examples', type=int, default=1000, help='rasa examples given to process()')
+    parser.add_argument('--process_config', type=str, default='{"cache_size": 0}',
+                        help='json CityMetro configuration, the cache is disabled so every mention runs a model')
+    parser.add_argument('--batch_sizes', type=str, default='1,8,32,128,512')
+    parser.add_argument('--max_length', type=int, default=50)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', type=str, default='benchmark.json')
+    parser.add_argument('--baseline', type=str, default=None, help='json results of a previous run to compare with')
+
+    args = parser.parse_args()
+
+    results = run(args)
+    print_results(results)
+
+    with open(args.output, 'w') as output_file:
+        json.dump(results, output_file, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            baseline = json.load(baseline_file)
+        print(f'compared with {args.baseline} ({baseline["environment"].get("commit")}):', file=sys.stderr)
+        for metric, before, after in changes(baseline, results):
+            change = f' ({(after - before) / before:+.1%})' if before else ''
+            print(f'{metric}: {before:.4f} -> {after:.4f}{change}', file=sys.stderr)
@@ -0,0 +1,216 @@
+import argparse
+import collections
+import csv
+import itertools
+import json
+import multiprocessing
+import os
+import sys
+import time
+
+import numpy as np
+
+from .fuzzy_index import SymmetricDeleteIndex
+from .normalizer import normalize_mention, normalize_name
+from .service import load_predictors
+
+
+# gazetteer name -> (predict function: texts -> log probabilities array, labels), set in each worker process
+_predictors = None
+
+# gazetteer name -> (exact map, fuzzy index or None), the dictionaries CityMetro looks up before its models
+_dictionaries = None
+
+
+def read_mentions(input_file, input_format='txt', column='mention', id_column=None):
+    """
+    Yields (id, mention) of each record of input_file, without reading the whole file.
+
+    Arguments
+        input_format - 'txt' (one mention per line), 'csv' (with a header line) or 'jsonl' (one json object per line)
+        column - the mention column (csv) or key (jsonl)
+        id_column - column or key copied to the output to identify the mention, default to the record number
+    """
+    if input_format == 'csv':
+        records = csv.DictReader(input_file)
+    elif input_format == 'jsonl':
+        records = (json.loads(line) for line in input_file if line.strip())
+    else:
+        records = ({column: line.rstrip('\n')} for line in input_file)
+
+    for i, record in enumerate(records):
+        yield (record[id_column] if id_column else i), str(record[column])
+
+
+def batches(iterable, batch_size):
+    """ Yields lists of batch_size items of iterable (the last one may be shorter). """
+    iterator = iter(iterable)
+    while True:
+        batch = list(itertools.islice(iterator, batch_size))
+        if not batch:
+            return
+        yield batch
+
+
+def top_k(log_probs, labels, k):
+    """ Returns, for each row of log probabilities, the list of its k most probable (label, probability). """
+    log_probs = np.asarray(log_probs)
+    k = min(k, log_probs.shape[1])
+    best = np.argpartition(-log_probs, k - 1, axis=1)[:, :k]
+    best_log_probs = np.take_along_axis(log_probs, best, axis=1)
+    order = np.argsort(-best_log_probs, axis=1, kind='stable')
+    best = np.take_along_axis(best, order, axis=1)
+    probabilities = np.exp(np.take_along_axis(best_log_probs, order, axis=1))
+    return [[(labels[index], round(float(probability), 6)) for index, probability in zip(row, row_probabilities)]
+            for row, row_probabilities in zip(best, probabilities)]
+
+
+def load_dictionaries(names, gazetteer_dir, fuzzy_max_distance=0):
+    """
+    Returns a dict: gazetteer name -> (exact map, fuzzy index), built from {gazetteer_dir}/{name}.csv
+    as CityMetro builds them. The fuzzy index is None when fuzzy_max_distance is 0.
+    """
+    dictionaries = {}
+    for name in names:
+        with open(os.path.join(gazetteer_dir, f'{name}.csv'), encoding='utf-8') as gazetteer_file:
+            exact_map = {normalize_name(entity): entity.strip() for entity in gazetteer_file}
+        fuzzy_index = SymmetricDeleteIndex(exact_map, fuzzy_max_distance) if fuzzy_max_distance else None
+        dictionaries[name] = exact_map, fuzzy_index
+    return dictionaries
+
+
+def dictionary_link(text, exact_map, fuzzy_index=None):
+    """
+    Returns the [(entity name, confidence)] of a normalized mention found in the dictionaries, with the
+    confidences of CityMetro (1.0 for an exact match, 1.0 - 0.05 per edit for a typo), None if not found.
+    """
+    linked_name = exact_map.get(text)
+    if linked_name:
+        return [(linked_name, 1.0)]
+    fuzzy_match = fuzzy_index.best_match(text) if fuzzy_index is not None else None
+    if fuzzy_match:
+        linked_name, distance = fuzzy_match
+        return [(linked_name, round(1.0 - 0.05 * distance, 6))]
+    return None
+
+
+def initialize_worker(names, runtime, models_dir, data_dir, shared_model, num_threads, gazetteer_dir='.',
+                      fuzzy_max_distance=0):
+    """ Load the models and the dictionaries once per worker process, each worker uses num_threads threads. """
+    global _predictors, _dictionaries
+
+    if num_threads:
+        if runtime == 'torch':
+            import torch
+            torch.set_num_threads(num_threads)
+        try:
+            from threadpoolctl import threadpool_limits
+            threadpool_limits(num_threads)
+        except ImportError:
+            pass
+
+    _predictors = load_predictors(names, runtime, models_dir, data_dir, shared_model)
+    _dictionaries = load_dictionaries(names, gazetteer_dir, fuzzy_max_distance)
+
+
+def link_batch(batch, k=3, max_tokens=50):
+    """
+    Returns the output records of a batch of (id, mention), linked as CityMetro links them: the mentions are
+    normalized (saint abbreviations expanded), looked up in the dictionaries of each gazetteer, and the mentions
+    not found there are linked by one vectorized forward pass per gazetteer.
+    """
+    texts = [normalize_mention(mention) for _, mention in batch]
+    results = {}
+    for name, (predict_batch, labels) in _predictors.items():
+        exact_map, fuzzy_index = _dictionaries[name]
+        results[name] = [dictionary_link(text, exact_map, fuzzy_index) for text in texts]
+
+        model_rows = [i for i, linked in enumerate(results[name]) if linked is None]
+        if model_rows:
+            predictions = top_k(predict_batch([texts[i] for i in model_rows], max_tokens), labels, k)
+            for i, prediction in zip(model_rows, predictions):
+                results[name][i] = prediction
+
+    return [dict({'id': mention_id, 'mention': mention, 'input': texts[i]},
+                 **{name: results[name][i] for name in results})
+            for i, (mention_id, mention) in enumerate(batch)]
+
+
+def link_all(mentions, processes, batch_size=512, k=3, max_tokens=50, initializer_args=()):
+    """
+    Yields the output record of each (id, mention), in the input order.
+
+    The batches are linked by a pool of processes (in this process when processes is 0). At most 2 batches
+    per process are read ahead, so the memory does not depend on the number of mentions.
+    """
+    if not processes:
+        initialize_worker(*initializer_args)
+        for batch in batches(mentions, batch_size):
+            yield from link_batch(batch, k, max_tokens)
+        return
+
+    # spawn: the workers do not inherit the torch or BLAS thread pools of this process
+    context = multiprocessing.get_context('spawn')
+    with context.Pool(processes, initialize_worker, initializer_args) as pool:
+        pending = collections.deque()
+        for batch in batches(mentions, batch_size):
+            pending.append(pool.apply_async(link_batch, (batch, k, max_tokens)))
+            if len(pending) >= 2 * processes:
+                yield from pending.popleft().get()
+        while pending:
+            yield from pending.popleft().get()
+
+
+def open_input(filename):
+    return sys.stdin if filename == '-' else open(filename, encoding='utf-8', newline='')
+
+
+def input_format(filename, default='txt'):
+    extension = os.path.splitext(filename)[1].lower()
+    return {'.csv': 'csv', '.jsonl': 'jsonl', '.json': 'jsonl'}.get(extension, default)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser('Link many mentions with the four gazetteer models, JSONL output')
+    parser.add_argument('--input', type=str, default='-', help='csv, jsonl or txt file, - for stdin')
+    parser.add_argument('--format', type=str, choices=['txt', 'csv', 'jsonl'], default=None,
+                        help='default to the input file extension, txt for stdin')
+    parser.add_argument('--column', type=str, default='mention', help='mention column (csv) or key (jsonl)')
+    parser.add_argument('--id_column', type=str, default=None, help='default to the record number')
+    parser.add_argument('--output', type=str, default='-', help='jsonl file, - for stdout')
+    parser.add_argument('--names', type=str, default='cities,metro,quartiers,streets_montreal')
+    parser.add_argument('--runtime', type=str, choices=['torch', 'numpy'], default='numpy')
+    parser.add_argument('--shared_model', type=str, default=None, help='name of a multi-head model')
+    parser.add_argument('--models_dir', type=str, default='./models')
+    parser.add_argument('--data_dir', type=str, default='./data')
+    parser.add_argument('--gazetteer_dir', type=str, default='.', help='the {name}.csv gazetteers of the exact maps')
+    parser.add_argument('--fuzzy_max_distance', type=int, default=0,
+                        help='the CityMetro fuzzy_max_distance option, 0 to disable the typo-tolerant lookup')
+    parser.add_argument('--top_k', type=int, default=3)
+    parser.add_argument('--max_length', type=int, default=50)
+    parser.add_argument('--batch_size', type=int, default=512)
+    parser.add_argument('--processes', type=int, default=os.cpu_count(), help='0 to link in this process')
+    parser.add_argument('--threads_per_process', type=int, default=1)
+
+    args = parser.parse_args()
+
+    initializer_args = (args.names.split(','), args.runtime, args.models_dir, args.data_dir, args.shared_model,
+                        args.threads_per_process, args.gazetteer_dir, args.fuzzy_max_distance)
+
+    start = time.perf_counter()
+    count = 0
+    with open_input(args.input) as input_file:
+        output_file = sys.stdout if args.output == '-' else open(args.output, 'w', encoding='utf-8')
+        mentions = read_mentions(input_file, args.format or input_format(args.input), args.column, args.id_column)
+        for record in link_all(mentions, args.processes, args.batch_size, args.top_k, args.max_length,
+                               initializer_args):
+            output_file.write(json.dumps(record, ensure_ascii=False) + '\n')
+            count += 1
+            if count % 100000 == 0:
+                print(f'{count} mentions, {count / (time.perf_counter() - start):.0f} mentions/s', file=sys.stderr)
+        if output_file is not sys.stdout:
+            output_file.close()
+
+    elapsed = time.perf_counter() - start
+    print(f'{count} mentions linked in {elapsed:.1f}s, {count / max(elapsed, 1e-9):.0f} mentions/s '
+          f'({args.processes} processes, batches of {args.batch_size})', file=sys.stderr)
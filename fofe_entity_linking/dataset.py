@@ -1,26 +1,71 @@
 import argparse
+import hashlib
 import io
 import os
 import pickle
 import random
 import re
 import torch
-import unidecode
 
 import numpy as np
 import pandas as pd
 
 from io import StringIO
-from torch.utils.data import Dataset
+from torch.utils.data import BatchSampler, DataLoader, Dataset, RandomSampler, SequentialSampler
 
 # from fofe_entity_linking.embedding import NgramHashing, NgramEmbedding, Fofe
 from .embedding import NgramHashing, NgramEmbedding, Fofe
+from .normalizer import normalize_text
+
+
+# sample generation functions of DatasetGenerator, the basic ones are also applied to the expanded mentions
+basic_functions = [
+    "random_underscore_all",
+
+    # "dash_space",
+    # "apostrophe_space",
+    # "space_dash",
+    # "remove_dash",
+    # "remove_double_letter",
+    # "random_single_bad_stroke_all",
+    # "invert_two_letters_all",
+    # "remove_random_letter_all",
+    # "add_random_letter_all",
+]
+
+expanding_functions = [
+    "saint_next_word",
+    # "expand_saint",
+    "expand_de",
+
+    "remove_first_word",
+    "remove_last_word",
+
+    "only_first_word",
+    "only_last_word",
+    "only_first_and_last",
+]
 
 
 class FofeDataset(Dataset):
+    """
+    Training samples of a gazetteer model: (FOFE encoding of the mention, label index).
+
+    The FOFE encodings of all the samples are computed once, in batches, into one contiguous float tensor
+    (samples, embedding_dim): the epochs only slice it. A batch of indices (see batch_loader()) is sliced
+    in a single indexing.
+
+    With a cache_dir, the tensor is saved to {cache_dir}/{key}.npy and memory-mapped by the next datasets
+    with the same key, a hash of the texts, the vocab, the embedding weights, max_tokens and the forgetting
+    factor: a new training of the same data skips the encoding, and the DataLoader workers map the file
+    instead of receiving a copy of the tensor.
+    """
+
+    # number of samples encoded at once
+    encoding_batch_size = 4096
 
     def __init__(self, data_filename, text_column, label_column, encoding, number_of_classes,
-                 ngram=2, max_tokens=50, forgetting_factor=0.5, embedding=None):
+                 ngram=2, max_tokens=50, forgetting_factor=0.5, embedding=None, cache_dir=None):
         self.max_tokens = max_tokens
         self.num_classes = number_of_classes
         self.embedding = embedding
@@ -28,7 +73,7 @@ class FofeDataset(Dataset):
         # read csv file using pandas dataframe
         df = pd.read_csv(data_filename, usecols=[text_column, label_column], encoding=encoding)
         self.texts  = df[text_column].tolist()
-        self.labels = df[label_column].tolist()
+        self.labels = torch.tensor(df[label_column].to_numpy(), dtype=torch.long)
         self.length = len(self.labels)
 
         # build vocab by hashing words in ngrams
@@ -37,41 +82,157 @@ class FofeDataset(Dataset):
         self.vocab_size = len(self.vocab)
         self.embedding_dim = embedding.embedding_layer.embedding_dim if embedding else self.vocab_size
 
-        self.vocab_onehot_embedding = np.eye(len(self.vocab))
-        self.fofe = Fofe(forgetting_factor)
+        self.fofe = Fofe.shared(forgetting_factor)
+
+        self.cache_filename = os.path.join(cache_dir, self.cache_key() + ".npy") if cache_dir else None
+        if self.cache_filename and os.path.isfile(self.cache_filename):
+            self.features = self.load_features(self.cache_filename)
+        else:
+            self.features = self.encode_all()
+            if self.cache_filename:
+                self.save_features(self.cache_filename)
 
     def __len__(self):
         return self.length
 
     def __getitem__(self, index):
-        raw_text = self.texts[index]
-        normalized_text = DatasetGenerator.normalize_name(raw_text)
+        """ Returns (fofe encoding, label) of a sample, or (fofe encodings, labels) of a list of samples. """
+        return self.features[index], self.labels[index]
+
+    def __getstate__(self):
+        # a cached tensor is memory-mapped again by the DataLoader workers, not pickled
+        state = dict(self.__dict__)
+        if self.cache_filename:
+            state['features'] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        if self.features is None:
+            self.features = self.load_features(self.cache_filename)
+
+    def sentence_indices(self, raw_text):
+        """ Returns the vocab indices of the n-grams of a mention, max_tokens at most. """
+        return self.ngram_hashing.ngram_indexes(DatasetGenerator.normalize_name(raw_text))[:self.max_tokens]
+
+    def encode_all(self):
+        """ Returns the FOFE encodings of all the samples, float tensor of shape (samples, embedding_dim). """
+        features = torch.zeros(self.length, self.embedding_dim)
+
+        for start in range(0, self.length, self.encoding_batch_size):
+            sentences = [self.sentence_indices(text) for text in self.texts[start:start + self.encoding_batch_size]]
+            lengths = torch.tensor([len(sentence) for sentence in sentences], dtype=torch.long)
+            offsets = torch.cumsum(lengths, 0) - lengths
+            indices = torch.tensor([index for sentence in sentences for index in sentence], dtype=torch.long)
+            batch = features[start:start + len(sentences)]
+
+            if self.embedding:
+                # weighted sum of the embedding rows of each sentence
+                with torch.no_grad():
+                    batch.copy_(self.fofe.encode_bags(self.embedding.embedding_layer.weight, indices, offsets))
+            else:
+                # one-hot FOFE encoding: each token weight is added at its vocab index
+                rows = torch.repeat_interleave(torch.arange(len(sentences)), lengths)
+                batch.index_put_((rows, indices), self.fofe.bag_weights(offsets, len(indices)), accumulate=True)
+
+        return features
+
+    def cache_key(self):
+        """ Returns the hash of everything the FOFE encodings depend on. """
+        key = hashlib.sha256()
+        key.update(repr((self.max_tokens, self.fofe.forgetting_factor, self.embedding_dim)).encode('utf-8'))
+        key.update('\n'.join(self.vocab).encode('utf-8'))
+        if self.embedding:
+            key.update(self.embedding.embedding_layer.weight.detach().cpu().numpy().tobytes())
+        key.update('\n'.join(str(text) for text in self.texts).encode('utf-8'))
+        return key.hexdigest()
 
-        # get the indices list of the normalized text
-        sentence_indices = self.ngram_hashing.ngram_indexes(normalized_text)
+    def save_features(self, filename):
+        os.makedirs(os.path.dirname(filename) or '.', exist_ok=True)
 
-        if len(sentence_indices) > self.max_tokens:
-            sentence_indices = sentence_indices[:self.max_tokens]
+        # written next to the cache file then renamed, a concurrent training never reads a partial file
+        temporary_filename = f"{filename}.{os.getpid()}.tmp"
+        with open(temporary_filename, 'wb') as f:
+            np.save(f, self.features.numpy())
+        os.replace(temporary_filename, filename)
 
-        if self.embedding:
-            sentence_v = [self.embedding.embedding_layer.weight[i].numpy() for i in sentence_indices]
-        else:
-            # convert indices to one-hot
-            sentence_v = [self.vocab_onehot_embedding[i] for i in sentence_indices]
+    @staticmethod
+    def load_features(filename):
+        # copy-on-write mapping: the pages are shared by the processes reading the file
+        return torch.from_numpy(np.load(filename, mmap_mode='c'))
+
+
+class MultiHeadFofeDataset(Dataset):
+    """
+    Concatenation of the training sets of several gazetteers, encoded with a shared embedding.
+    Each sample is (fofe_encoding, label, head index), the label being an index in the labels of its head.
+
+    The encodings stay in the FofeDataset of each head, a batch is sliced from them head by head:
+    the memory-mapped cache files (see FofeDataset cache_dir) are not copied.
+    """
+
+    def __init__(self, head_data_filenames, text_column, label_column, encoding, embedding,
+                 max_tokens=50, forgetting_factor=0.5, cache_dir=None):
+        """
+        Arguments
+            head_data_filenames - list of (head name, training set csv filename)
+        """
+        self.head_names = [name for name, _ in head_data_filenames]
+        self.datasets = [FofeDataset(data_filename, text_column, label_column, encoding, 0,
+                                     max_tokens=max_tokens, forgetting_factor=forgetting_factor, embedding=embedding,
+                                     cache_dir=cache_dir)
+                         for _, data_filename in head_data_filenames]
+
+        self.embedding_dim = embedding.embedding_layer.embedding_dim
+        self.labels = torch.cat([dataset.labels for dataset in self.datasets])
+        self.heads = torch.cat([torch.full((len(dataset),), head, dtype=torch.long)
+                                for head, dataset in enumerate(self.datasets)])
+        # index of the first sample of each head
+        self.head_starts = torch.tensor([0] + [len(dataset) for dataset in self.datasets]).cumsum(0)[:-1]
+
+    def __len__(self):
+        return len(self.labels)
+
+    def __getitem__(self, index):
+        """ Returns (fofe encoding, label, head) of a sample, or (fofe encodings, labels, heads) of a list. """
+        if isinstance(index, int):
+            head = int(self.heads[index])
+            return self.datasets[head].features[index - self.head_starts[head]], self.labels[index], self.heads[index]
 
-        # convert one-hot to FOFE encoding
-        fofe_encoding = self.fofe.encode_sentence(sentence_v)
+        index = torch.as_tensor(index, dtype=torch.long)
+        heads = self.heads[index]
+        sample_indexes = index - self.head_starts[heads]
+        features = torch.empty(len(index), self.embedding_dim)
+        for head in heads.unique().tolist():
+            in_head = heads == head
+            features[in_head] = self.datasets[head].features[sample_indexes[in_head]]
 
-        return fofe_encoding, self.labels[index]
+        return features, self.labels[index], heads
+
+
+def batch_loader(dataset, batch_size, shuffle=False, num_workers=0):
+    """
+    Returns a DataLoader of a FofeDataset or MultiHeadFofeDataset (or of a subset of it, see random_split)
+    giving whole batches: each batch is sliced from the precomputed features in one indexing,
+    instead of being collated from one sample at a time.
+    """
+    sampler = RandomSampler(dataset) if shuffle else SequentialSampler(dataset)
+    return DataLoader(dataset, sampler=BatchSampler(sampler, batch_size, drop_last=False), batch_size=None,
+                      num_workers=num_workers)
 
 
 class DatasetGenerator(object):
 
-    def __init__(self, input_filename, basic_functions, expanding_functions, max_mixup=10):
+    def __init__(self, input_filename, basic_functions, expanding_functions, max_mixup=10, labels=None):
+        """
+        Arguments
+            input_filename - string, the gazetteer csv file, one entity name per line
+            labels - list of entity names, to generate the samples of these names instead of the file ones
+        """
         self.max_mixup = max_mixup
 
         # parse labels and create label to indexes
-        self.labels = self.get_entity_list(input_filename)
+        self.labels = list(labels) if labels is not None else self.get_entity_list(input_filename)
         # sort by length to make sure string like "Saint-Philippe" will appear before "Chute-Saint-Philippe"
         self.labels.sort(key=len)
 
@@ -118,14 +279,8 @@ class DatasetGenerator(object):
 
     @staticmethod
     def normalize_name(s):
-        # lower case and accents removed
-        s = unidecode.unidecode(s).lower()
-
-        # replace apostrophe and dash by space
-        s = s.replace("-", ' ')
-        s = s.replace("'", ' ')
-
-        return s
+        # lower case and accents removed, apostrophe and dash replaced by space
+        return normalize_text(s)
 
     def save(self, output_dir, text_column, label_column):
         """
@@ -483,7 +638,8 @@ def generate_training_set(args):
 
 
 def create_embedding(args, training_list):
-    ngram = NgramHashing(args.embedding_ngram_size, corpus_text_list=training_list)
+    ngram = NgramHashing(args.embedding_ngram_size, corpus_text_list=training_list,
+                         min_frequency=args.embedding_min_frequency, verbose=(args.verbose == "True"))
 
     # train the embedding with all samples except those that contains '_'
     # training_token_list = [t for w in training_list if '_' not in w for t in ngram.ngram(NgramHashing.ascii_trim_lowercase(w))]
@@ -500,34 +656,19 @@ def create_embedding(args, training_list):
     return embedding
 
 
-if __name__ == "__main__":
-    basic_functions = [
-        "random_underscore_all",
-
-        # "dash_space",
-        # "apostrophe_space",
-        # "space_dash",
-        # "remove_dash",
-        # "remove_double_letter",
-        # "random_single_bad_stroke_all",
-        # "invert_two_letters_all",
-        # "remove_random_letter_all",
-        # "add_random_letter_all",
-    ]
-
-    expanding_functions = [
-        "saint_next_word",
-        # "expand_saint",
-        "expand_de",
-
-        "remove_first_word",
-        "remove_last_word",
-
-        "only_first_word",
-        "only_last_word",
-        "only_first_and_last",
-    ]
+def create_shared_embedding(args):
+    """ Create a single embedding for the union of several generated training sets. """
+    training_list = [text for filename in args.shared_training_sets.split(',')
+                     for text in get_training_word_list(filename)]
+
+    embedding = create_embedding(args, training_list)
+
+    embedding_filename = os.path.join(args.output_path, args.shared_name + "_embedding.pth")
+    vocab_filename = os.path.join(args.output_path, args.shared_name + "_vocab.pickle")
+    embedding.save(embedding_filename, vocab_filename)
+
 
+if __name__ == "__main__":
     parser = argparse.ArgumentParser('Training dataset generator')
 
     parser.add_argument('--source_data_path', type=str, default='./metro.csv')
@@ -541,6 +682,12 @@ if __name__ == "__main__":
     parser.add_argument('--embedding_ngram_size', type=int, default=2)
     parser.add_argument('--embedding_learning_rate', type=float, default=0.0001)
     parser.add_argument('--embedding_epochs', type=int, default=15)
+    parser.add_argument('--embedding_min_frequency', type=int, default=1)
+
+    # shared embedding for a multi-head model, built from already generated training sets
+    parser.add_argument('--shared_training_sets', type=str, default=None,
+                        help='comma separated list of *_training_set.csv, to create a shared embedding only')
+    parser.add_argument('--shared_name', type=str, default='shared')
 
     parser.add_argument('--verbose', type=str, default="True")
 
@@ -549,6 +696,10 @@ if __name__ == "__main__":
     # -------------------------------------
     print(f"torch.cuda.is_available() = {torch.cuda.is_available()}")
 
+    if args.shared_training_sets:
+        create_shared_embedding(args)
+        exit(0)
+
     # training set generation
     training_set_filename, labels_filename, base_filename = generate_training_set(args)
 
@@ -0,0 +1,115 @@
+import re
+
+import yaml
+
+from .keywords import trie_pattern
+
+
+class Rule(object):
+    """ A disambiguation rule, see DisambiguationRules. """
+
+    fields = ('name', 'entity', 'keywords', 'min_confidence', 'max_selected_confidence', 'confidence_of',
+              'overrides')
+
+    def __init__(self, name, entity, keywords=(), min_confidence=0.0, max_selected_confidence=None,
+                 confidence_of=None, overrides=False):
+        self.name = name
+        self.entity = entity
+        self.keywords = list(keywords)
+        self.min_confidence = float(min_confidence)
+        self.max_selected_confidence = None if max_selected_confidence is None else float(max_selected_confidence)
+        self.confidence_of = confidence_of or entity
+        self.overrides = bool(overrides)
+
+    @classmethod
+    def from_dict(cls, rule):
+        unknown = set(rule) - set(cls.fields)
+        if unknown:
+            raise ValueError(f"unknown disambiguation rule fields {sorted(unknown)} in {rule}")
+        if 'name' not in rule or 'entity' not in rule:
+            raise ValueError(f"a disambiguation rule needs a name and an entity: {rule}")
+        return cls(**rule)
+
+
+class DisambiguationRules(object):
+    """
+    Entity type disambiguation rules of CityMetro, loaded from a YAML file (see disambiguation.yml).
+
+    The rules are evaluated in order on each entity, a rule fires when, in this order:
+      - no earlier rule fired, or the rule overrides the earlier ones (overrides: true),
+      - one of its keywords is in the context, the context_size characters before the entity (if it has keywords),
+      - the confidence of the currently selected entity type is below max_selected_confidence (if given),
+      - the confidence of its entity type (or of confidence_of) is above min_confidence.
+    The entity then gets the entity type of the rule. The confidences are only asked when the cheaper
+    conditions hold, so a model runs lazily only when its keywords are present.
+
+    The keywords of all the rules are found in a single scan of the context, by one compiled regex
+    factored in a trie (see trie_pattern), so adding keywords costs little.
+
+    Example:
+        rules = DisambiguationRules([Rule('metro_keyword', 'metro', ['métro', 'station'], 0.60)])
+        rules.select('city', 'bornes au métro ', {'metro': 0.99, 'city': 0.80}.get)  --> ('metro', 'metro_keyword')
+    """
+
+    def __init__(self, rules, context_size=15):
+        self.rules = list(rules)
+        self.context_size = context_size
+
+        # keyword -> bit mask of the rules having this keyword
+        masks = {}
+        for i, rule in enumerate(self.rules):
+            for keyword in rule.keywords:
+                masks[keyword] = masks.get(keyword, 0) | 1 << i
+
+        # the regex finds the longest keyword starting at each position of the context (the lookahead lets the
+        # matches overlap), the keywords it is a prefix of are then present too: their rules are in its mask
+        self.keyword_masks = {keyword: 0 for keyword in masks}
+        for keyword in masks:
+            for prefix, mask in masks.items():
+                if keyword.startswith(prefix):
+                    self.keyword_masks[keyword] |= mask
+
+        self.pattern = re.compile('(?=(' + trie_pattern(masks) + '))') if masks else None
+
+    @classmethod
+    def load(cls, filename):
+        with open(filename, encoding='utf-8') as f:
+            config = yaml.safe_load(f)
+        return cls([Rule.from_dict(rule) for rule in config['rules']], config.get('context_size', 15))
+
+    def context(self, text, start):
+        """ Returns the context window of an entity starting at the given position of the text. """
+        return text[max(0, start - self.context_size):start]
+
+    def matching_rules(self, context):
+        """ Returns the bit mask of the rules with a keyword in the given context. """
+        mask = 0
+        if self.pattern is not None:
+            for match in self.pattern.finditer(context):
+                mask |= self.keyword_masks[match.group(1)]
+        return mask
+
+    def select(self, entity_type, context, confidence):
+        """
+        Returns the disambiguated entity type and the name of the last rule that fired (None if no rule fired).
+
+        Arguments
+            entity_type - string, the entity type given by the entity extractor
+            context - string, the text before the entity, see context()
+            confidence - function: entity type -> linking confidence of the entity for this type
+        """
+        mask = self.matching_rules(context)
+        selected_entity, fired_rule = entity_type, None
+
+        for i, rule in enumerate(self.rules):
+            if fired_rule is not None and not rule.overrides:
+                continue
+            if rule.keywords and not mask >> i & 1:
+                continue
+            if (rule.max_selected_confidence is not None
+                    and not confidence(selected_entity) < rule.max_selected_confidence):
+                continue
+            if confidence(rule.confidence_of) > rule.min_confidence:
+                selected_entity, fired_rule = rule.entity, rule.name
+
+        return selected_entity, fired_rule
@@ -1,11 +1,12 @@
-import pickle
-import unidecode
-
+import numpy as np
 import torch
 import torch.nn as nn
 import torch.nn.functional as F
 import torch.optim as optim
 
+# NgramHashing does not need torch, it lives in its own module for the numpy runtime (see numpy_predict.py)
+from .ngram_hashing import NgramHashing
+
 
 class Fofe(object):
     """
@@ -25,21 +26,115 @@ class Fofe(object):
             https://www.aclweb.org/anthology/P15-2081.pdf
     """
 
+    # one instance per forgetting factor, see Fofe.shared()
+    _shared_instances = {}
+
     def __init__(self, forgetting_factor=0.5):
         """
         Arguments
             forgetting_factor - float, forgetting factor (alpha value) between 0 and 1 exclusively
         """
         self.forgetting_factor = forgetting_factor
-        self.m = self.compute_matrices()
+
+        # decay vector [ff**0, ff**1, ff**2, ...], grown on demand for longer sentences
+        self.powers = self.compute_powers(64)
+        self._m = None
+
+    @classmethod
+    def shared(cls, forgetting_factor):
+        """ Returns the Fofe instance shared by every caller using the same forgetting factor. """
+        fofe = cls._shared_instances.get(forgetting_factor)
+        if fofe is None:
+            fofe = cls(forgetting_factor)
+            cls._shared_instances[forgetting_factor] = fofe
+        return fofe
+
+    @property
+    def m(self):
+        """ List of lower triangular matrices (one per order), only built when accessed. """
+        if self._m is None:
+            self._m = self.compute_matrices()
+        return self._m
+
+    def compute_powers(self, length):
+        """ Returns a float tensor of shape (length,) holding [ff**0, ff**1, ..., ff**(length-1)]. """
+        return torch.tensor([self.forgetting_factor ** p for p in range(length)], dtype=torch.float32)
+
+    def position_weights(self, token_count):
+        """
+        Returns the weight applied to each token of a sentence of the given length:
+            [ff**(n-1), ff**(n-2), ..., ff**1, 1]
+
+        It is the last row of the matrix of order n, the only one needed for the sentence encoding.
+        """
+        if token_count > len(self.powers):
+            self.powers = self.compute_powers(max(token_count, 2 * len(self.powers)))
+        return self.powers[:token_count].flip(0)
 
     def encode_sentence(self, sentence_onehot):
-        token_count = len(sentence_onehot)
-        v = torch.tensor(sentence_onehot, dtype=torch.float32)
-        s = self.m[token_count].mm(v)
+        """
+        Returns the FOFE encoding of a sentence, computed as z_t = ff * z_(t-1) + e_t.
+
+        Arguments
+            sentence_onehot - list of vectors (or tensor of shape (tokens, dim)), one per token
+        """
+        v = sentence_onehot if torch.is_tensor(sentence_onehot) else torch.from_numpy(np.asarray(sentence_onehot))
+        v = v.to(torch.float32)
+
+        return self.position_weights(len(v)).matmul(v)
+
+    def encode_batch(self, sentences, lengths):
+        """
+        Returns the FOFE encoding of a batch of right padded sentences, tensor of shape (batch, dim).
+
+        Arguments
+            sentences - float tensor of shape (batch, max_tokens, dim)
+            lengths - long tensor of shape (batch,), the number of tokens of each sentence
+        """
+        max_tokens = sentences.shape[1]
+
+        # exponent of each token position: length - 1 - position (negative for padding)
+        exponents = lengths.view(-1, 1) - 1 - torch.arange(max_tokens).view(1, -1)
+        padding = exponents < 0
+
+        # make sure the decay vector is long enough, then gather ff**exponent
+        self.position_weights(max_tokens)
+        weights = self.powers[exponents.clamp(min=0)].masked_fill(padding, 0.0)
 
-        # return the sentence encoding (last row)
-        return s[-1]
+        return torch.bmm(weights.unsqueeze(1), sentences.to(torch.float32)).squeeze(1)
+
+    def bag_weights(self, offsets, token_count):
+        """
+        Returns the FOFE weight of every token of a batch of flattened sentences.
+
+        Arguments
+            offsets - long tensor of shape (batch,), start position of each sentence in the flat token list
+            token_count - integer, total number of tokens in the flat token list
+        """
+        lengths = torch.cat([offsets[1:], offsets.new_tensor([token_count])]) - offsets
+
+        # for each token: the sentence it belongs to and its position inside that sentence
+        sentence_ids = torch.repeat_interleave(torch.arange(len(offsets)), lengths)
+        positions = torch.arange(token_count) - offsets[sentence_ids]
+
+        self.position_weights(int(lengths.max()) if token_count else 0)
+        return self.powers[lengths[sentence_ids] - 1 - positions]
+
+    def encode_bags(self, weight, indices, offsets):
+        """
+        Returns the FOFE encodings of a batch of sentences, tensor of shape (batch, dim).
+
+        The token vectors are never materialized: the encoding is a single weighted
+        gather-sum (embedding bag) over the rows of the weight table.
+
+        Arguments
+            weight - float tensor of shape (vocab_size, dim), an embedding weight table
+            indices - long tensor, the vocab indices of all sentences concatenated
+            offsets - long tensor of shape (batch,), start position of each sentence in indices
+        """
+        per_sample_weights = self.bag_weights(offsets.cpu(), len(indices)).to(weight.device)
+        return F.embedding_bag(indices.to(weight.device), weight, offsets.to(weight.device), mode='sum',
+                               per_sample_weights=per_sample_weights)
 
     def compute_matrices(self, number_of_matrices=50):
         """
@@ -83,72 +178,6 @@ class Fofe(object):
         return m
 
 
-class NgramHashing(object):
-
-    def __init__(self, n=None, corpus_filename=None, corpus_text_list=None, vocab_filename=None):
-        """
-          n - Integer, the number of character in the ngram
-          corpus_filename -
-          corpus_text_list -
-          vocab_filename -
-        """
-        if vocab_filename:
-            # load vocab
-            with open(vocab_filename, "rb") as input_file:
-                self.vocab = pickle.load(input_file)
-            self.n = len(self.vocab[0])
-        else:
-            # read the file line by line to create the word corpus
-            if corpus_filename:
-                with open(corpus_filename) as f:
-                    corpus_text_list = f.readlines()
-
-            corpus = self.get_preprocessed_lines(corpus_text_list)
-
-            self.n = n
-            self.vocab = self._create_vocab(corpus)
-
-        self.ngram2idx = {ngram: i for i, ngram in enumerate(self.vocab)}
-
-    def save_vocab(self, ngram_vocab_filename):
-        with open(ngram_vocab_filename, "wb") as out:
-            pickle.dump(self.vocab, out)
-
-    def ngram(self, str):
-        ngram_list = []
-        word = '#' + self.ascii_trim_lowercase(str) + '#'
-        for i in range(len(word) - self.n + 1):
-            ngram = word[i:i + self.n]
-            # add the ngram if part of the vocab, otherwise OOV
-            ngram_list.append(ngram if ngram in self.vocab else '#'*self.n)
-        return ngram_list
-
-    def ngram_indexes(self, str):
-        ngram_list = self.ngram(str)
-        return [self.ngram2idx.get(ngram) for ngram in ngram_list]
-
-    def _create_vocab(self, corpus):
-        # first token of the vocab is OOV (out of vocab) token
-        vocab = ['#'*self.n]
-
-        for word in corpus:
-            word = '#' + word + '#'
-            for i in range(len(word) - self.n + 1):
-                ngram = word[i:i + self.n]
-                if ngram not in vocab and '_' not in ngram:
-                    vocab.append(ngram)
-        return vocab
-
-    @staticmethod
-    def ascii_trim_lowercase(text):
-        """ convert the given text to ascii (remove accent), remove leading spaces and lowercase. """
-        return unidecode.unidecode(text).strip().lower()
-
-    def get_preprocessed_lines(self, corpus_text_list):
-        """ read the given file and returns a list of lines, convert to ascii without leading spaces """
-        return [self.ascii_trim_lowercase(x) for x in corpus_text_list]
-
-
 class NGramLanguageModeler(nn.Module):
 
     def __init__(self, vocab_size, embedding_dim, context_size, hidden_size=128):
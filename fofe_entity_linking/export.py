@@ -0,0 +1,126 @@
+import argparse
+import datetime
+import json
+import os
+import pickle
+
+from .artifact import write_artifact
+from .predict import load_models
+
+
+def export_artifact(model, vocab, labels, forgetting_factor=0.95, gazetteers=None, hyperparameters=None):
+    """
+    Returns (metadata, arrays) of the artifact of a folded model, see NumpyFofeModel and write_artifact().
+
+    Arguments
+        model - FoldedFofeNNModel
+        vocab - list of ngrams, the vocab of the model embedding
+        labels - list of entity names (single model) or dict: head name -> list of entity names (multi-head model)
+        forgetting_factor - float, the FOFE forgetting factor used to train the model
+        gazetteers - list of gazetteer entries (or dict: head name -> list), the source of the exact match map
+        hyperparameters - dict, the training hyperparameters
+    """
+    arrays = {
+        'hidden_table': model.hidden_table.detach().cpu().numpy(),
+        'fc1_bias': model.fc1_bias.detach().cpu().numpy(),
+    }
+
+    if model.heads is not None:
+        head_names = list(model.heads)
+        outputs = [(f'{name}.', head) for name, head in model.heads.items()]
+    else:
+        head_names = None
+        outputs = [('', model.fc2)]
+        # a single model is stored as a model with a single head named ''
+        labels = {'': labels}
+        gazetteers = {'': gazetteers} if gazetteers is not None else None
+
+    for prefix, layer in outputs:
+        # stored transposed, (hidden_size, classes), so the runtime multiplies by it without a copy
+        arrays[prefix + 'fc2_weight'] = layer.weight.detach().cpu().numpy().T
+        arrays[prefix + 'fc2_bias'] = layer.bias.detach().cpu().numpy()
+
+    metadata = {
+        'created': datetime.datetime.now().isoformat(timespec='seconds'),
+        'forgetting_factor': forgetting_factor,
+        'ngram_size': len(vocab[0]),
+        'embedding_dim': model.embedding_dim,
+        'hidden_size': model.hidden_size,
+        'hyperparameters': hyperparameters or {},
+        'heads': head_names,
+        'vocab': list(vocab),
+        'labels': labels,
+        'gazetteers': gazetteers,
+    }
+
+    return metadata, arrays
+
+
+def load_labels(labels_filename):
+    with open(labels_filename, "rb") as labels_file:
+        labels, _, _ = pickle.load(labels_file)
+    return labels
+
+
+def read_gazetteer(gazetteer_filename):
+    """ Returns the entries of a gazetteer file (one entity name per line), None if the file does not exist. """
+    if not os.path.isfile(gazetteer_filename):
+        return None
+    with open(gazetteer_filename) as gazetteer_file:
+        return gazetteer_file.readlines()
+
+
+def export(name, models_dir, data_dir, output_filename, forgetting_factor=0.95, gazetteer_dir=None):
+    """
+    Export the model {models_dir}/{name}.pth with its embedding, vocab, labels, training hyperparameters
+    ({models_dir}/{name}_hyperparameters.json, written by train.py) and gazetteer ({gazetteer_dir}/{name}.csv)
+    to a single artifact file.
+
+    For a multi-head model, the labels and gazetteer of each head are read from the files named after the head.
+    """
+    model, embedding = load_models(os.path.join(models_dir, f'{name}.pth'),
+                                   os.path.join(data_dir, f'{name}_embedding.pth'),
+                                   os.path.join(data_dir, f'{name}_vocab.pickle'),
+                                   folded=True, forgetting_factor=forgetting_factor)
+
+    head_names = list(model.heads) if model.heads is not None else [name]
+    labels = {head_name: load_labels(os.path.join(data_dir, f'{head_name}_training_labels.pickle'))
+              for head_name in head_names}
+    gazetteers = {head_name: read_gazetteer(os.path.join(gazetteer_dir, f'{head_name}.csv'))
+                  for head_name in head_names} if gazetteer_dir else None
+
+    if model.heads is None:
+        labels = labels[name]
+        gazetteers = gazetteers[name] if gazetteers else None
+
+    hyperparameters_filename = os.path.join(models_dir, f'{name}_hyperparameters.json')
+    hyperparameters = None
+    if os.path.isfile(hyperparameters_filename):
+        with open(hyperparameters_filename) as hyperparameters_file:
+            hyperparameters = json.load(hyperparameters_file)
+
+    metadata, arrays = export_artifact(model, embedding.ngram.vocab, labels, forgetting_factor,
+                                       gazetteers, hyperparameters)
+    metadata['name'] = name
+    write_artifact(output_filename, arrays, metadata)
+    return metadata, arrays
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser('Export a FOFE model to a single memory-mapped artifact file')
+    parser.add_argument('--names', type=str, default='cities,metro,quartiers,streets_montreal',
+                        help='comma separated model names')
+    parser.add_argument('--models_dir', type=str, default='./models')
+    parser.add_argument('--data_dir', type=str, default='./data')
+    parser.add_argument('--gazetteer_dir', type=str, default='.', help='directory of the {name}.csv gazetteers')
+    parser.add_argument('--output_dir', type=str, help='default to models_dir')
+    parser.add_argument('--fofe_forgetting_factor', type=float, default=0.95)
+
+    args = parser.parse_args()
+
+    for name in args.names.split(','):
+        output_filename = os.path.join(args.output_dir or args.models_dir, f'{name}.fofe')
+        metadata, arrays = export(name, args.models_dir, args.data_dir, output_filename,
+                                  args.fofe_forgetting_factor, args.gazetteer_dir)
+        print(f'{name}: {len(metadata["vocab"])} ngrams, hidden {metadata["hidden_size"]}, '
+              f'{os.path.getsize(output_filename) / 2**20:.1f} MB --> {output_filename}')
@@ -0,0 +1,117 @@
+class SymmetricDeleteIndex(object):
+    """
+    Typo-tolerant lookup of gazetteer names (symmetric delete spelling correction).
+
+    Every name is indexed under all the strings obtained by deleting up to max_distance characters.
+    A query generates its own deletes: two strings within edit distance d share at least one delete
+    of at most d characters, so the candidates are found with a few dictionary lookups,
+    then verified with a real edit distance.
+
+    Example:
+        index = SymmetricDeleteIndex({'rosemont': 'Rosemont', 'berri uqam': 'Berri-UQAM'})
+        index.lookup('rosemon')      --> [('rosemont', 'Rosemont', 1)]
+        index.best_match('rosemon')  --> ('Rosemont', 1)
+    """
+
+    def __init__(self, names, max_distance=2):
+        """
+        Arguments
+            names - dict, normalized name -> entity name (ex: the CityMetro exact map)
+            max_distance - integer, the maximum edit distance supported by the index
+        """
+        self.names = names
+        self.max_distance = max_distance
+
+        # delete variant -> list of normalized names
+        self.deletes = {}
+        for name in names:
+            for variant in self.generate_deletes(name, max_distance):
+                self.deletes.setdefault(variant, []).append(name)
+
+    def __len__(self):
+        return len(self.names)
+
+    @staticmethod
+    def generate_deletes(term, max_distance):
+        """ Returns the set of strings made by deleting up to max_distance characters from term (term included). """
+        result = {term}
+        current = {term}
+        for _ in range(max_distance):
+            current = {word[:i] + word[i + 1:] for word in current if len(word) > 1 for i in range(len(word))}
+            result |= current
+        return result
+
+    @staticmethod
+    def allowed_distance(term):
+        """ Short names are too close to each other: no typo allowed under 4 chars, a single one under 8 chars. """
+        if len(term) < 4:
+            return 0
+        if len(term) < 8:
+            return 1
+        return 2
+
+    @staticmethod
+    def edit_distance(a, b, max_distance):
+        """
+        Returns the optimal string alignment distance (Levenshtein plus adjacent transpositions) between
+        a and b, or max_distance + 1 as soon as the distance is known to be greater than max_distance.
+        """
+        if abs(len(a) - len(b)) > max_distance:
+            return max_distance + 1
+
+        previous_previous = None
+        previous = list(range(len(b) + 1))
+        for i in range(1, len(a) + 1):
+            current = [i] + [0] * len(b)
+            for j in range(1, len(b) + 1):
+                cost = 0 if a[i - 1] == b[j - 1] else 1
+                current[j] = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + cost)
+                if i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                    current[j] = min(current[j], previous_previous[j - 2] + 1)
+
+            if min(current) > max_distance:
+                return max_distance + 1
+
+            previous_previous, previous = previous, current
+
+        return previous[-1]
+
+    def lookup(self, term, max_distance=None):
+        """
+        Returns the list of (normalized name, entity name, distance) within max_distance of term,
+        sorted by distance.
+        """
+        max_distance = self.max_distance if max_distance is None else min(max_distance, self.max_distance)
+
+        candidates = set()
+        for variant in self.generate_deletes(term, max_distance):
+            candidates.update(self.deletes.get(variant, ()))
+
+        result = []
+        for name in candidates:
+            distance = self.edit_distance(term, name, max_distance)
+            if distance <= max_distance:
+                result.append((name, self.names[name], distance))
+
+        result.sort(key=lambda x: (x[2], x[0]))
+        return result
+
+    def best_match(self, term, max_distance=None):
+        """
+        Returns (entity name, distance) when a single entity is at the smallest distance from term,
+        None when nothing is close enough or when the closest match is ambiguous.
+        The allowed distance is also limited by the length of term, see allowed_distance().
+        """
+        allowed = self.allowed_distance(term)
+        max_distance = allowed if max_distance is None else min(max_distance, allowed)
+
+        matches = self.lookup(term, max_distance)
+        if not matches:
+            return None
+
+        best_distance = matches[0][2]
+        best_entities = {entity for _, entity, distance in matches if distance == best_distance}
+        if len(best_entities) != 1:
+            return None
+
+        return best_entities.pop(), best_distance
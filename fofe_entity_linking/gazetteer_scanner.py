@@ -0,0 +1,187 @@
+import argparse
+import json
+import re
+import time
+
+from . import normalizer
+
+
+# the gazetteers of CityMetro: entity type -> names file, one name per line
+GAZETTEERS = {
+    "city": "./fofe_entity_linking/cities.csv",
+    "metro": "./fofe_entity_linking/metro.csv",
+    "quartier": "./fofe_entity_linking/quartiers.csv",
+    "street": "./fofe_entity_linking/streets_montreal.csv",
+}
+
+TOKEN = re.compile(r'\w+')
+
+# what can separate two tokens of a name in a message: spaces, dashes, apostrophes and abbreviation dots
+TOKEN_SEPARATOR = re.compile(r"[\s\-'’.]+")
+
+SAINT_ABBREVIATIONS = {'st': 'saint', 'ste': 'sainte'}
+
+# trie marker: the names ending at this node
+END = None
+
+
+def tokenize(text):
+    """
+    Returns the (start, end, key) of the tokens of a text: its runs of letters and digits, with their
+    position in the text and their normalized form (ascii, lower case, "st" and "ste" expanded).
+
+    Example:
+        tokenize("St-Jean") --> [(0, 2, 'saint'), (3, 7, 'jean')]
+    """
+    tokens = []
+    for match in TOKEN.finditer(text):
+        key = normalizer.fold(match.group(0))
+        tokens.append((match.start(), match.end(), SAINT_ABBREVIATIONS.get(key, key)))
+    return tokens
+
+
+class GazetteerScanner(object):
+    """
+    Find the gazetteer names in a text, as entity spans.
+
+    The names of all the gazetteers are stored in one trie of normalized tokens, tagged by entity type.
+    The text is tokenized once and scanned from left to right: the longest name starting at a token is
+    a span and the scan goes on after it. A name has a few tokens at most, so the scan is linear in the
+    length of the text.
+
+    A name in several gazetteers ("Sherbrooke": city, metro and street) gets the first of its entity types
+    in entity_types order, the disambiguation rules of CityMetro then choose from the context.
+
+    Example:
+        scanner = GazetteerScanner({'metro': ['Berri-UQAM'], 'street': ['Rue Saint-Denis']})
+        scanner.scan("bornes au métro berri uqam")
+        --> [{'start': 16, 'end': 26, 'value': 'berri uqam', 'entity': 'metro', 'confidence': 1.0}]
+    """
+
+    def __init__(self, gazetteers, entity_types=None, excluded_names=()):
+        """
+        Arguments
+            gazetteers - dict, entity type -> list of names
+            entity_types - list, the entity type order of the names in several gazetteers
+                           (default: the gazetteers order)
+            excluded_names - names never found, ex: common words that are also names ("parc")
+        """
+        self.entity_types = list(entity_types or gazetteers)
+        excluded = {tuple(key for _, _, key in tokenize(name)) for name in excluded_names}
+
+        # token -> child node, END -> entity types of the name ending at this node
+        self.trie = {}
+        self.max_tokens = 0
+        self.size = 0
+        for entity_type in sorted(gazetteers, key=self.type_order):
+            for name in gazetteers[entity_type]:
+                keys = tuple(key for _, _, key in tokenize(name))
+                if not keys or keys in excluded:
+                    continue
+
+                node = self.trie
+                for key in keys:
+                    node = node.setdefault(key, {})
+                types = node.setdefault(END, [])
+                if entity_type not in types:
+                    types.append(entity_type)
+                    self.size += 1
+                self.max_tokens = max(self.max_tokens, len(keys))
+
+    @classmethod
+    def load(cls, gazetteers=None, entity_types=None, excluded_names=()):
+        """
+        Arguments
+            gazetteers - dict, entity type -> names file (default: GAZETTEERS)
+        """
+        names = {}
+        for entity_type, filename in (gazetteers or GAZETTEERS).items():
+            with open(filename, encoding='utf-8') as f:
+                names[entity_type] = [line.strip() for line in f if line.strip()]
+        return cls(names, entity_types, excluded_names)
+
+    def type_order(self, entity_type):
+        return self.entity_types.index(entity_type) if entity_type in self.entity_types else len(self.entity_types)
+
+    def __len__(self):
+        return self.size
+
+    def scan(self, text):
+        """
+        Returns the entities of the gazetteer names found in the text, in the entity format of the rasa
+        entity extractors: [{'start', 'end', 'value', 'entity', 'confidence'}], in text order.
+        """
+        tokens = tokenize(text)
+        entities = []
+
+        i = 0
+        while i < len(tokens):
+            node, last, types = self.trie, None, None
+            for j in range(i, min(len(tokens), i + self.max_tokens)):
+                if j > i and not TOKEN_SEPARATOR.fullmatch(text, tokens[j - 1][1], tokens[j][0]):
+                    break
+                node = node.get(tokens[j][2])
+                if node is None:
+                    break
+                if END in node:
+                    last, types = j, node[END]
+
+            if last is None:
+                i += 1
+                continue
+
+            start, end = tokens[i][0], tokens[last][1]
+            entities.append({'start': start, 'end': end, 'value': text[start:end], 'entity': types[0],
+                             'confidence': 1.0})
+            i = last + 1
+
+        return entities
+
+
+def read_examples(filename):
+    """ Returns the (text, entities) of the common examples of a rasa NLU json file. """
+    with open(filename, encoding='utf-8') as f:
+        examples = json.load(f)['rasa_nlu_data']['common_examples']
+    return [(example['text'], example.get('entities', [])) for example in examples]
+
+
+def evaluate(scanner, examples):
+    """
+    Compare the scanner spans to the annotated entities of the examples.
+    Returns the precision and recall of the spans (same start and end), and the share of the spans found
+    with the annotated entity type.
+    """
+    found = expected = correct = typed = 0
+    for text, entities in examples:
+        annotated = {(entity['start'], entity['end']): entity['entity'] for entity in entities}
+        spans = scanner.scan(text)
+        found += len(spans)
+        expected += len(annotated)
+        for span in spans:
+            entity_type = annotated.get((span['start'], span['end']))
+            if entity_type is not None:
+                correct += 1
+                typed += entity_type == span['entity']
+
+    return {
+        'precision': correct / found if found else 0.0,
+        'recall': correct / expected if expected else 0.0,
+        'type_accuracy': typed / correct if correct else 0.0,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser('Evaluate and time the gazetteer scanner on an annotated rasa dataset')
+    parser.add_argument('--rasa_dataset', type=str, default='./data/rasa_dataset_training.json')
+
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    scanner = GazetteerScanner.load()
+    print(f'{len(scanner)} names loaded in {(time.perf_counter() - start) * 1000:.0f} ms')
+
+    examples = read_examples(args.rasa_dataset)
+    start = time.perf_counter()
+    results = evaluate(scanner, examples)
+    print(f'{(time.perf_counter() - start) / len(examples) * 1e6:.1f} us/message on {len(examples)} messages')
+    print(', '.join(f'{name} {value:.1%}' for name, value in results.items()))
@@ -0,0 +1,330 @@
+import argparse
+import datetime
+import json
+import os
+import pickle
+import random
+import time
+
+from io import StringIO
+
+import numpy as np
+import pandas as pd
+import torch
+import torch.nn as nn
+
+from .dataset import DatasetGenerator, FofeDataset, basic_functions, batch_loader, expanding_functions
+from .embedding import NgramEmbedding
+from .export import export
+from .model import FofeNNModel
+from .ngram_hashing import NgramHashing
+from .train import evaluate, train
+
+
+# output bias of the labels removed from the gazetteer: they keep their index but are never predicted
+REMOVED_LABEL_BIAS = -1e4
+
+
+def gazetteer_changes(old_labels, old_labels_weight, gazetteer_labels):
+    """
+    Compare the labels of a trained model with the entity names of its updated gazetteer.
+
+    A label removed from the gazetteer keeps its index (and its output row) with a weight of 0,
+    so the indexes of the other labels never change and the model is only extended.
+
+    Returns (labels, new_labels, removed_labels)
+        labels - the old labels in the same order, followed by the names added to the gazetteer
+        new_labels - the names to generate samples for: added to the gazetteer, or back after a removal
+        removed_labels - the labels removed from the gazetteer since the last update
+                         (the labels already removed by an earlier update are not removed again)
+    """
+    gazetteer_labels = list(dict.fromkeys(gazetteer_labels))
+    known = set(old_labels)
+    gazetteer = set(gazetteer_labels)
+    removed_before = {label for label, weight in zip(old_labels, old_labels_weight) if weight == 0}
+
+    labels = list(old_labels) + [label for label in gazetteer_labels if label not in known]
+    new_labels = [label for label in gazetteer_labels if label not in known or label in removed_before]
+    removed_labels = [label for label in old_labels if label not in gazetteer and label not in removed_before]
+    return labels, new_labels, removed_labels
+
+
+def generate_samples(gazetteer_filename, labels, new_labels, text_column, label_column):
+    """ Returns a DataFrame of the generated samples of new_labels, labelled with their index in labels. """
+    generator = DatasetGenerator(gazetteer_filename, basic_functions, expanding_functions, labels=new_labels)
+    samples = pd.read_csv(StringIO(generator.training_set_list), sep=',', header=None,
+                          names=[text_column, label_column])
+
+    label2idx = {label: i for i, label in enumerate(labels)}
+    samples[label_column] = [label2idx[generator.labels[i]] for i in samples[label_column]]
+    return samples
+
+
+def merge_samples(old_samples, new_samples, new_indexes, removed_indexes, text_column, label_column):
+    """
+    Returns the training set of the updated gazetteer: the old samples of the labels still in the gazetteer
+    and the samples of the new labels.
+    """
+    old_samples = old_samples[~old_samples[label_column].isin(set(new_indexes) | set(removed_indexes))]
+    samples = pd.concat([old_samples, new_samples], ignore_index=True)
+
+    # a mention of several entities is ambiguous, it is removed (see DatasetGenerator._remove_duplicate_samples)
+    return samples[~samples[text_column].duplicated(keep=False)].reset_index(drop=True)
+
+
+def labels_weight(label_indexes, number_of_classes):
+    """ Same class weights as DatasetGenerator: 1.0 for the smallest class, 0 for the labels without samples. """
+    counts = np.bincount(np.asarray(label_indexes), minlength=number_of_classes)
+    smallest = counts[counts > 0].min()
+    return np.where(counts > 0, smallest / np.maximum(counts, 1), 0.0).tolist()
+
+
+def extend_vocab(ngram, texts):
+    """
+    Returns a NgramHashing with the n-grams of texts missing from the vocab of ngram appended,
+    the indexes of the known n-grams do not change.
+    """
+    oov = ngram.vocab[0]
+    new_ngrams = {}
+    for text in texts:
+        word = '#' + ngram.ascii_trim_lowercase(text) + '#'
+        for i in range(len(word) - ngram.n + 1):
+            gram = word[i:i + ngram.n]
+            if gram not in ngram.ngram2idx and gram != oov and '_' not in gram:
+                new_ngrams[gram] = True
+    return NgramHashing(vocab=ngram.vocab + list(new_ngrams))
+
+
+def extend_embedding(weight, vocab, new_vocab):
+    """
+    Returns the embedding weight of new_vocab (vocab followed by new n-grams).
+
+    The embedding language model is not retrained: the row of a new n-gram is the mean of the rows of the known
+    n-grams sharing its prefix or its suffix (ex: 'xy' from 'x?' and '?y'), the OOV row when there is none.
+    """
+    prefixes, suffixes = {}, {}
+    for i, gram in enumerate(vocab[1:], 1):
+        prefixes.setdefault(gram[:-1], []).append(i)
+        suffixes.setdefault(gram[1:], []).append(i)
+
+    rows = []
+    for gram in new_vocab[len(vocab):]:
+        neighbors = prefixes.get(gram[:-1], []) + suffixes.get(gram[1:], [])
+        rows.append(weight[neighbors].mean(0) if neighbors else weight[0])
+
+    if not rows:
+        return weight
+    return torch.cat([weight, torch.stack(rows)])
+
+
+def extend_model(state_dict, embedding_dim, number_of_classes, dropout_rate, labels_weight=None, new_indexes=()):
+    """
+    Returns a FofeNNModel with the weights of a trained model (state_dict) and number_of_classes outputs:
+    the first outputs are the trained ones, the new ones start with zero weights and the smallest bias of the
+    trained labels still in use, so the predictions of the trained labels are unchanged before the fine-tuning.
+
+    Arguments
+        labels_weight - the weights of the trained labels, a label removed by an update has a weight of 0
+                        and a REMOVED_LABEL_BIAS bias, left out of the smallest bias (default: all in use)
+        new_indexes - the labels to fine-tune from the smallest bias: the new outputs and the labels back
+                      after a removal, which would never be predicted with their REMOVED_LABEL_BIAS bias
+    """
+    hidden_size, trained_embedding_dim = state_dict['fc1.weight'].shape
+    assert trained_embedding_dim == embedding_dim, \
+        f"embedding dim {embedding_dim} does not match the model: {trained_embedding_dim}"
+
+    model = FofeNNModel(embedding_dim, hidden_size, dropout_rate, number_of_classes)
+    trained_classes = state_dict['fc2.weight'].shape[0]
+
+    trained_bias = state_dict['fc2.bias']
+    if labels_weight is not None and any(weight > 0 for weight in labels_weight[:trained_classes]):
+        trained_bias = trained_bias[torch.tensor(labels_weight[:trained_classes]) > 0]
+
+    with torch.no_grad():
+        model.fc1.weight.copy_(state_dict['fc1.weight'])
+        model.fc1.bias.copy_(state_dict['fc1.bias'])
+        model.fc2.weight[:trained_classes] = state_dict['fc2.weight']
+        model.fc2.bias[:trained_classes] = state_dict['fc2.bias']
+        model.fc2.weight[trained_classes:] = 0
+        model.fc2.bias[trained_classes:] = trained_bias.min()
+        model.fc2.bias[list(new_indexes)] = trained_bias.min()
+    return model
+
+
+def replay_samples(samples, exclude_indexes, per_label, label_column, seed=999):
+    """ Returns up to per_label random samples of each label, except the excluded ones. """
+    samples = samples[~samples[label_column].isin(set(exclude_indexes))]
+    return samples.sample(frac=1, random_state=seed).groupby(label_column, sort=False).head(per_label)
+
+
+def test_accuracy(args, model, embedding):
+    """ Returns the model accuracy on {data_dir}/{name}_test_set.csv, None without test set. """
+    test_set_filename = os.path.join(args.data_dir, f'{args.name}_test_set.csv')
+    if not os.path.isfile(test_set_filename):
+        return None
+
+    test_set = FofeDataset(test_set_filename, args.text_column, args.label_column, args.encoding,
+                           model.fc2.out_features, embedding=embedding,
+                           forgetting_factor=args.fofe_forgetting_factor, max_tokens=args.max_length)
+    test_generator = batch_loader(test_set, batch_size=256, shuffle=False, num_workers=args.workers)
+    _, accuracy, _, _ = evaluate(model, test_generator, nn.NLLLoss())
+    return accuracy
+
+
+def update(args):
+    """
+    Update the model {models_dir}/{name}.pth to the gazetteer args.gazetteer without a full retraining:
+    the label indexes are kept, the vocab, embedding and output layer are extended, and the model is
+    fine-tuned from its checkpoint on the samples of the new labels and a replay of the old ones.
+
+    Returns a dict describing the update, None when the gazetteer did not change.
+    """
+    start_time = time.time()
+    labels_filename = os.path.join(args.data_dir, f'{args.name}_training_labels.pickle')
+    training_set_filename = os.path.join(args.data_dir, f'{args.name}_training_set.csv')
+    embedding_filename = os.path.join(args.data_dir, f'{args.name}_embedding.pth')
+    vocab_filename = os.path.join(args.data_dir, f'{args.name}_vocab.pickle')
+    model_filename = os.path.join(args.models_dir, f'{args.name}.pth')
+    hyperparameters_filename = os.path.join(args.models_dir, f'{args.name}_hyperparameters.json')
+
+    with open(labels_filename, 'rb') as labels_file:
+        old_labels, _, old_labels_weight = pickle.load(labels_file)
+
+    labels, new_labels, removed_labels = gazetteer_changes(old_labels, old_labels_weight,
+                                                           DatasetGenerator.get_entity_list(args.gazetteer))
+    if not new_labels and not removed_labels:
+        print(f'{args.name}: the gazetteer did not change')
+        return None
+
+    label2idx = {label: i for i, label in enumerate(labels)}
+    new_indexes = [label2idx[label] for label in new_labels]
+    removed_indexes = [label2idx[label] for label in removed_labels]
+    print(f'{args.name}: {len(new_labels)} new labels {new_labels[:10]}, '
+          f'{len(removed_labels)} removed labels {removed_labels[:10]}')
+
+    # TRAINING SET - only the new labels samples are generated
+    old_samples = pd.read_csv(training_set_filename, encoding=args.encoding)
+    new_samples = generate_samples(args.gazetteer, labels, new_labels, args.text_column, args.label_column) \
+        if new_labels else old_samples.iloc[:0]
+    samples = merge_samples(old_samples, new_samples, new_indexes, removed_indexes,
+                            args.text_column, args.label_column)
+    weights = labels_weight(samples[args.label_column], len(labels))
+
+    # EMBEDDING - the n-grams of the new samples are added at the end of the vocab
+    embedding = NgramEmbedding(embedding_filename=embedding_filename, vocab_filename=vocab_filename)
+    old_vocab = embedding.ngram.vocab
+    ngram = extend_vocab(embedding.ngram, new_samples[args.text_column].astype(str))
+    extended_weight = extend_embedding(embedding.embedding_layer.weight.detach().cpu(), old_vocab, ngram.vocab)
+    embedding = NgramEmbedding(ngram=ngram)
+    embedding.embedding_layer = nn.Embedding.from_pretrained(extended_weight, freeze=True)
+
+    # MODEL - extended output layer, fine-tuned on the new samples and a replay of the old ones
+    model = extend_model(torch.load(model_filename, map_location='cpu'), extended_weight.shape[1],
+                         len(labels), args.dropout_rate, old_labels_weight, new_indexes)
+    previous_accuracy = test_accuracy(args, model, embedding)
+
+    fine_tuning_samples = pd.concat([samples[samples[args.label_column].isin(set(new_indexes))],
+                                     replay_samples(samples, new_indexes, args.replay_per_label,
+                                                    args.label_column, args.seed)])
+    fine_tuning_set_filename = os.path.join(args.data_dir, f'{args.name}_incremental_set.csv')
+    fine_tuning_samples.to_csv(fine_tuning_set_filename, index=False, encoding=args.encoding)
+    fine_tuning_set = FofeDataset(fine_tuning_set_filename, args.text_column, args.label_column, args.encoding,
+                                  len(labels), embedding=embedding,
+                                  forgetting_factor=args.fofe_forgetting_factor, max_tokens=args.max_length)
+    training_generator = batch_loader(fine_tuning_set, batch_size=args.batch_size, shuffle=True,
+                                      num_workers=args.workers)
+
+    criterion = nn.NLLLoss(weight=torch.tensor(np.array(weights), dtype=torch.float32))
+    optimizer = torch.optim.Adam(model.parameters(), lr=args.learning_rate)
+    for epoch in range(args.epochs):
+        train_loss, train_accuracy, _ = train(model, training_generator, optimizer, criterion)
+        print(f'[Epoch: {epoch + 1} / {args.epochs}]\ttrain_loss: {train_loss:.4f} \ttrain_acc: {train_accuracy:.4f}')
+
+    with torch.no_grad():
+        model.fc2.bias[removed_indexes] = REMOVED_LABEL_BIAS
+    model.eval()
+    accuracy = test_accuracy(args, model, embedding)
+
+    # SAVE - the same files as a full training, so the next update (or a full training) starts from them
+    samples.to_csv(training_set_filename, index=False, encoding=args.encoding)
+    with open(labels_filename, 'wb') as labels_file:
+        pickle.dump([labels, label2idx, weights], labels_file)
+    embedding.save(embedding_filename, vocab_filename)
+    torch.save(model.state_dict(), model_filename)
+
+    result = {
+        'date': datetime.datetime.now().isoformat(timespec='seconds'),
+        'new_labels': new_labels,
+        'removed_labels': removed_labels,
+        'new_ngrams': len(ngram.vocab) - len(old_vocab),
+        'new_samples': len(new_samples),
+        'fine_tuning_samples': len(fine_tuning_samples),
+        'epochs': args.epochs,
+        'test_accuracy_before_fine_tuning': previous_accuracy,
+        'test_accuracy': accuracy,
+        'seconds': round(time.time() - start_time, 1),
+    }
+
+    hyperparameters = {}
+    if os.path.isfile(hyperparameters_filename):
+        with open(hyperparameters_filename) as hyperparameters_file:
+            hyperparameters = json.load(hyperparameters_file)
+    hyperparameters['number_of_classes'] = len(labels)
+    hyperparameters.setdefault('incremental_updates', []).append(result)
+    with open(hyperparameters_filename, 'w') as hyperparameters_file:
+        json.dump(hyperparameters, hyperparameters_file, indent=2)
+
+    if args.export:
+        export(args.name, args.models_dir, args.data_dir, os.path.join(args.models_dir, f'{args.name}.fofe'),
+               args.fofe_forgetting_factor, os.path.dirname(args.gazetteer) or '.')
+
+    return result
+
+
+def set_training_defaults(args):
+    """ The unspecified training arguments are read from the hyperparameters of the trained model. """
+    hyperparameters = {}
+    hyperparameters_filename = os.path.join(args.models_dir, f'{args.name}_hyperparameters.json')
+    if os.path.isfile(hyperparameters_filename):
+        with open(hyperparameters_filename) as hyperparameters_file:
+            hyperparameters = json.load(hyperparameters_file)
+
+    defaults = {'fofe_forgetting_factor': 0.95, 'dropout_rate': 0.25, 'max_length': 50,
+                'learning_rate': 0.0005, 'batch_size': 64}
+    for name, default in defaults.items():
+        if getattr(args, name) is None:
+            setattr(args, name, hyperparameters.get(name, default))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser('Update a trained model to its changed gazetteer without a full retraining')
+    parser.add_argument('--name', type=str, default='metro', help='model name, ex: metro')
+    parser.add_argument('--gazetteer', type=str, default='./metro.csv', help='the updated gazetteer')
+    parser.add_argument('--data_dir', type=str, default='./data')
+    parser.add_argument('--models_dir', type=str, default='./models')
+    parser.add_argument('--epochs', type=int, default=3)
+    parser.add_argument('--replay_per_label', type=int, default=5,
+                        help='number of samples of each old label replayed during the fine-tuning')
+    parser.add_argument('--learning_rate', type=float, default=None)
+    parser.add_argument('--batch_size', type=int, default=None)
+    parser.add_argument('--dropout_rate', type=float, default=None)
+    parser.add_argument('--fofe_forgetting_factor', type=float, default=None)
+    parser.add_argument('--max_length', type=int, default=None)
+    parser.add_argument('--label_column', type=str, default='EntityName')
+    parser.add_argument('--text_column', type=str, default='EntityMention')
+    parser.add_argument('--encoding', type=str, default='utf-8')
+    parser.add_argument('--workers', type=int, default=0)
+    parser.add_argument('--seed', type=int, default=999)
+    parser.add_argument('--export', type=int, choices=[0, 1], default=1,
+                        help='export the updated model to {models_dir}/{name}.fofe')
+
+    args = parser.parse_args()
+    set_training_defaults(args)
+
+    random.seed(args.seed)
+    torch.manual_seed(args.seed)
+
+    result = update(args)
+    if result:
+        print(f"{args.name}: updated in {result['seconds']}s, test accuracy "
+              f"{result['test_accuracy_before_fine_tuning']} --> {result['test_accuracy']}")
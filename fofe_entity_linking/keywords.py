@@ -0,0 +1,163 @@
+import argparse
+import json
+import random
+import re
+import time
+
+import yaml
+
+
+# trie markers: a keyword ends at this node, or ends here when followed by a space (not part of the match)
+END = ''
+END_BEFORE_SPACE = None
+
+
+def trie_pattern(keywords, space_ended_keywords=()):
+    """
+    Returns a regex matching the longest of the given keywords at a position. The alternatives are factored
+    in a trie ('rue|rues|road' -> 'r(?:oad|ue(?:s)?)'): the regex branches on one character at a time
+    instead of trying every keyword, its cost hardly depends on the number of keywords.
+
+    The space_ended_keywords only match when followed by a space, which is left out of the match.
+    """
+    trie = {}
+    for marker, marked_keywords in [(END, keywords), (END_BEFORE_SPACE, space_ended_keywords)]:
+        for keyword in marked_keywords:
+            node = trie
+            for char in keyword:
+                node = node.setdefault(char, {})
+            node[marker] = {}
+
+    def pattern(node):
+        characters = sorted(char for char in node if char is not END and char is not END_BEFORE_SPACE)
+        branches = [re.escape(char) + pattern(node[char]) for char in characters]
+        if END_BEFORE_SPACE in node:
+            # after the longer keywords
+            branches.append('(?= )')
+        if not branches:
+            return ''
+        body = branches[0] if len(branches) == 1 else '(?:' + '|'.join(branches) + ')'
+        # a keyword ends here, the greedy ? tries the longer keywords first
+        return f'(?:{body})?' if END in node else body
+
+    return pattern(trie)
+
+
+class KeywordReplacer(object):
+    """
+    Replace many keywords of a text in a single pass, with a regex compiled once (see trie_pattern).
+
+    The text is scanned from left to right, the longest keyword starting at a position is replaced
+    and the scan goes on after it: a replacement is not scanned again for other keywords.
+    A keyword that ends with a space replaced by a space (' metro ' -> ' métro ') does not take that space
+    from the next keyword, which can start on it.
+
+    Same text as the successive str.replace calls of sequential_replace() when no replacement contains
+    a keyword and no two keywords are found on the same characters, the case of normalization.yml on the
+    training messages. Otherwise the results differ:
+        - a replacement is not replaced again: 'ab' with [('a', 'b'), ('b', 'c')] gives 'bc', not 'cc'
+        - the longest keyword wins, not the first one of the list: 'boul.' with [('boul', 'boulevard'),
+          ('boul.', 'boulevard')] gives 'boulevard', not 'boulevard.'
+        - a keyword found twice on a shared space is replaced twice: ' metro metro ' gives ' métro métro ',
+          where str.replace, which does not overlap its matches, leaves the second one: ' métro metro '
+
+    Example:
+        replacer = KeywordReplacer([(' metro ', ' métro '), (' pres ', ' près ')])
+        replacer.replace('bornes au metro pres de berri')  --> 'bornes au métro près de berri'
+    """
+
+    def __init__(self, replacements):
+        """
+        Arguments
+            replacements - list of (keyword, replacement), for a keyword given twice the first one is used
+        """
+        keywords = {}
+        for keyword, replacement in replacements:
+            if keyword:
+                keywords.setdefault(keyword, replacement)
+
+        # matched text -> replacement
+        self.replacements = {}
+        space_ended_keywords = set()
+        for keyword, replacement in keywords.items():
+            if keyword.endswith(' ') and replacement.endswith(' ') and keyword[:-1] and keyword[:-1] not in keywords:
+                space_ended_keywords.add(keyword[:-1])
+                self.replacements[keyword[:-1]] = replacement[:-1]
+            else:
+                self.replacements[keyword] = replacement
+
+        plain_keywords = [keyword for keyword in self.replacements if keyword not in space_ended_keywords]
+        self.pattern = re.compile(trie_pattern(plain_keywords, space_ended_keywords)) if self.replacements else None
+
+    def __len__(self):
+        return len(self.replacements)
+
+    def replace(self, text):
+        if self.pattern is None:
+            return text
+        return self.pattern.sub(lambda match: self.replacements[match.group(0)], text)
+
+
+def read_replacements(filename):
+    """
+    Returns the list of (keyword, replacement) of a normalization yaml file: one 'keyword: replacement'
+    per line, '_' marks a space.
+    """
+    with open(filename, encoding='utf-8') as file:
+        yaml_dict = yaml.load(file, Loader=yaml.BaseLoader) or {}
+    return [(key.replace('_', ' '), value.replace('_', ' ')) for key, value in yaml_dict.items()]
+
+
+def sequential_replace(replacements, text):
+    """ Returns the text with each keyword replaced in turn, as normalization.Keywords did before KeywordReplacer. """
+    for keyword, replacement in replacements:
+        text = text.replace(keyword, replacement)
+    return text
+
+
+def synthetic_replacements(texts, size, seed=0):
+    """
+    Returns size spelling fixes ' word ' -> ' WORD ': the words of the texts first, random words after.
+    The replacements do not match another keyword, so both replacement methods give the same texts.
+    """
+    random_state = random.Random(seed)
+    words = sorted({word for text in texts for word in text.lower().split() if word.isalpha()})
+    random_state.shuffle(words)
+    while len(words) < size:
+        length = random_state.randint(4, 10)
+        words.append(''.join(random_state.choice('abcdefghijklmnopqrstuvwxyz') for _ in range(length)))
+    return [(f' {word} ', f' {word.upper()} ') for word in words[:size]]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser('Time the keyword replacement of normalization.Keywords on many keywords')
+    parser.add_argument('--messages', type=str, default='./data/rasa_dataset_training.json',
+                        help='rasa NLU json file, the texts of its examples are normalized')
+    parser.add_argument('--sizes', type=str, default='10,1000,10000', help='numbers of keywords')
+    parser.add_argument('--max_messages', type=int, default=2000)
+
+    args = parser.parse_args()
+
+    with open(args.messages, encoding='utf-8') as f:
+        texts = [example['text'] for example in json.load(f)['rasa_nlu_data']['common_examples']]
+    texts = [f' {text} ' for text in texts[:args.max_messages]]
+
+    for size in [int(size) for size in args.sizes.split(',')]:
+        replacements = synthetic_replacements(texts, size)
+
+        start = time.perf_counter()
+        replacer = KeywordReplacer(replacements)
+        build_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        expected = [sequential_replace(replacements, text) for text in texts]
+        sequential_time = (time.perf_counter() - start) / len(texts)
+
+        start = time.perf_counter()
+        replaced = [replacer.replace(text) for text in texts]
+        single_pass_time = (time.perf_counter() - start) / len(texts)
+
+        agreement = sum(a == b for a, b in zip(expected, replaced)) / len(texts)
+        print(f'{size} keywords: str.replace loop {sequential_time * 1e6:.1f} us/message, '
+              f'single pass {single_pass_time * 1e6:.1f} us/message (x{sequential_time / single_pass_time:.0f}), '
+              f'compiled in {build_time * 1000:.0f} ms, same text for {agreement:.1%} of the messages')
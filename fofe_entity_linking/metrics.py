@@ -0,0 +1,157 @@
+import bisect
+import threading
+
+
+# histogram buckets in seconds, from 100 microseconds (an exact map lookup) to 1 second (a cold model)
+DEFAULT_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+
+
+def format_labels(labels):
+    """ Returns the Prometheus text format of a list of (name, value) labels: {name="value",...} """
+    if not labels:
+        return ''
+    escaped = (str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n') for _, value in labels)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(labels, escaped)) + '}'
+
+
+def format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter(object):
+    """
+    Monotonic counter, one value per combination of label values.
+
+    Example:
+        counter = Counter('entity_linking_mentions_total', 'Linked mentions', ['entity_type'])
+        counter.inc(entity_type='metro')
+    """
+
+    type = 'counter'
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+
+        # label values tuple -> value
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def label_values(self, labels):
+        """ Returns the tuple of the label values, in the labelnames order (missing labels are empty). """
+        return tuple(str(labels.get(name, '')) for name in self.labelnames)
+
+    def inc(self, value=1, **labels):
+        key = self.label_values(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + value
+
+    def value(self, **labels):
+        return self._values.get(self.label_values(labels), 0)
+
+    def samples(self):
+        """ Yields (sample name, labels list, value) of each label values combination. """
+        with self._lock:
+            values = sorted(self._values.items())
+        for key, value in values:
+            yield self.name, list(zip(self.labelnames, key)), value
+
+    def clear(self):
+        with self._lock:
+            self._values.clear()
+
+
+class Histogram(Counter):
+    """
+    Distribution of observed values (durations in seconds) in cumulative buckets, with their sum and count.
+
+    Example:
+        histogram = Histogram('nlu_stage_duration_seconds', 'Stage duration', ['stage'])
+        histogram.observe(0.0012, stage='keywords')
+    """
+
+    type = 'histogram'
+
+    def __init__(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super(Histogram, self).__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self.label_values(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            # per bucket counts (not cumulative, the last one is +Inf) and sum of the observed values
+            counts, total = self._values.get(key) or ([0] * (len(self.buckets) + 1), 0.0)
+            counts[index] += 1
+            self._values[key] = counts, total + value
+
+    def count(self, **labels):
+        counts, _ = self._values.get(self.label_values(labels), ([0], 0.0))
+        return sum(counts)
+
+    def samples(self):
+        with self._lock:
+            values = sorted((key, (list(counts), total)) for key, (counts, total) in self._values.items())
+        for key, (counts, total) in values:
+            labels = list(zip(self.labelnames, key))
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                yield f'{self.name}_bucket', labels + [('le', format_value(float(bound)))], cumulative
+            yield f'{self.name}_sum', labels, total
+            yield f'{self.name}_count', labels, cumulative
+
+
+class Registry(object):
+    """
+    The metrics of a process, exported in the Prometheus text format by exposition().
+
+    counter() and histogram() return the metric already registered under the same name, so the components
+    of a process can declare the metrics they share.
+    """
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _register(self, metric_class, name, *args):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = metric_class(name, *args)
+            elif not isinstance(metric, metric_class):
+                raise ValueError(f'metric {name} is already registered as a {metric.type}')
+            return metric
+
+    def counter(self, name, help, labelnames=()):
+        return self._register(Counter, name, help, labelnames)
+
+    def histogram(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram, name, help, labelnames, buckets)
+
+    def clear(self):
+        """ Reset the values of every metric, they stay registered. """
+        for metric in list(self._metrics.values()):
+            metric.clear()
+
+    def exposition(self):
+        """ Returns the metrics in the Prometheus text format (version 0.0.4). """
+        lines = []
+        for name, metric in sorted(self._metrics.items()):
+            lines.append(f'# HELP {name} {metric.help}')
+            lines.append(f'# TYPE {name} {metric.type}')
+            for sample_name, labels, value in metric.samples():
+                lines.append(f'{sample_name}{format_labels(labels)} {format_value(value)}')
+        return '\n'.join(lines) + '\n'
+
+
+# the registry of this process, exported by the GET /metrics route of the google_assistant channel
+registry = Registry()
+
+# duration of the NLU custom components, when their "metrics" option is on: normalization.Keywords,
+# gazetteer.GazetteerExtractor and entity_linking.CityMetro
+STAGE_DURATION = registry.histogram(
+    "nlu_stage_duration_seconds", "Duration of the NLU custom component stages", ["stage", "entity_type"])
@@ -1,7 +1,11 @@
+import warnings
+
 import torch
 import torch.nn as nn
 import torch.nn.functional as F
 
+from .embedding import Fofe
+
 
 class FofeNNModel(nn.Module):
 
@@ -25,3 +29,130 @@ class FofeNNModel(nn.Module):
         output = self.fc2(x)
         log_probs = F.log_softmax(output, dim=1)    # F.log_softmax() ??? why not just a F.softmax()
         return log_probs
+
+
+class MultiHeadFofeNNModel(nn.Module):
+    """
+    FOFE-based NN with a shared hidden layer and one output layer (head) per gazetteer.
+
+    A mention is encoded once and a single forward pass returns the log probabilities of every head.
+    """
+
+    def __init__(self, embedding_dim, hidden_size, dropoutrate, head_classes):
+        """
+        Arguments
+            embedding_dim - integer, the size of the shared n-gram embedding
+            hidden_size - integer, the size of the shared hidden layer
+            dropoutrate - float, dropout rate applied to the hidden layer
+            head_classes - list of (head name, number of classes), ex: [('cities', 869), ('metro', 68)]
+        """
+        super(MultiHeadFofeNNModel, self).__init__()
+
+        self.embedding_dim = embedding_dim
+        self.hidden_size = hidden_size
+        self.head_names = [name for name, _ in head_classes]
+
+        self.fc1 = nn.Linear(in_features=self.embedding_dim, out_features=self.hidden_size)
+        self.heads = nn.ModuleDict([(name, nn.Linear(in_features=self.hidden_size, out_features=number_of_classes))
+                                    for name, number_of_classes in head_classes])
+
+        self.dropout = nn.Dropout(p=dropoutrate)
+
+    def forward(self, input):
+        """ Returns a dict: head name -> log probabilities tensor of shape (batch, number of classes of the head) """
+        x = F.relu(self.fc1(input))
+        x = self.dropout(x)
+        return {name: F.log_softmax(head(x), dim=1) for name, head in self.heads.items()}
+
+
+class FoldedFofeNNModel(nn.Module):
+    """
+    Inference only version of FofeNNModel where the n-gram embedding is folded into fc1.
+
+    Everything before the ReLU is linear, so for a FOFE encoding x = sum(w_i * e_i):
+        fc1(x) = sum(w_i * (W1 . e_i)) + b1
+
+    The product W1 . e_i is precomputed once for every n-gram of the vocab (vocab_size x hidden_size table),
+    then a mention is classified with a weighted gather-sum of the table rows, a ReLU and fc2.
+
+    A MultiHeadFofeNNModel can be folded the same way, the output is then a dict of log probabilities per head.
+    """
+
+    def __init__(self, model, embedding_weight, forgetting_factor=0.95):
+        """
+        Arguments
+            model - FofeNNModel or MultiHeadFofeNNModel, a trained model
+            embedding_weight - tensor of shape (vocab_size, embedding_dim), the n-gram embedding weights
+            forgetting_factor - float, the FOFE forgetting factor used to train the model
+        """
+        super(FoldedFofeNNModel, self).__init__()
+
+        self.embedding_dim = model.embedding_dim
+        self.hidden_size = model.hidden_size
+        self.fofe = Fofe.shared(forgetting_factor)
+
+        with torch.no_grad():
+            hidden_table = embedding_weight.to(model.fc1.weight.device).matmul(model.fc1.weight.t())
+
+        self.hidden_table = nn.Parameter(hidden_table, requires_grad=False)
+        self.fc1_bias = nn.Parameter(model.fc1.bias.detach().clone(), requires_grad=False)
+        self.fc2 = getattr(model, 'fc2', None)
+        self.heads = getattr(model, 'heads', None)
+
+    @classmethod
+    def from_arrays(cls, header, arrays):
+        """
+        Returns a folded model using the arrays of an exported artifact (see fofe_entity_linking.artifact) in place.
+
+        The tensors share the memory of the arrays: with arrays read from an artifact memory map,
+        the processes loading the same artifact share the weights pages. The tensors must not be written.
+        """
+        folded_model = cls.__new__(cls)
+        nn.Module.__init__(folded_model)
+
+        def shared_tensor(array):
+            with warnings.catch_warnings():
+                # the memory map is read-only, and the model is never trained
+                warnings.simplefilter('ignore', UserWarning)
+                return nn.Parameter(torch.from_numpy(array), requires_grad=False)
+
+        def linear(prefix):
+            # fc2 weights are stored transposed, (hidden_size, classes)
+            weight = arrays[prefix + 'fc2_weight']
+            layer = nn.Linear(weight.shape[0], weight.shape[1])
+            layer.weight = shared_tensor(weight.T)
+            layer.bias = shared_tensor(arrays[prefix + 'fc2_bias'])
+            return layer
+
+        folded_model.header = header
+        folded_model.embedding_dim = header['embedding_dim']
+        folded_model.hidden_size = header['hidden_size']
+        folded_model.fofe = Fofe.shared(header['forgetting_factor'])
+        folded_model.hidden_table = shared_tensor(arrays['hidden_table'])
+        folded_model.fc1_bias = shared_tensor(arrays['fc1_bias'])
+
+        if header['heads']:
+            folded_model.fc2 = None
+            folded_model.heads = nn.ModuleDict([(name, linear(f'{name}.')) for name in header['heads']])
+        else:
+            folded_model.fc2 = linear('')
+            folded_model.heads = None
+
+        folded_model.eval()
+        return folded_model
+
+    def forward(self, indices, offsets):
+        """
+        Arguments
+            indices - long tensor, the n-gram indices of all mentions concatenated
+            offsets - long tensor of shape (batch,), start position of each mention in indices
+        """
+        x = self.fofe.encode_bags(self.hidden_table, indices, offsets) + self.fc1_bias
+        x = F.relu(x)
+
+        if self.heads is not None:
+            return {name: F.log_softmax(head(x), dim=1) for name, head in self.heads.items()}
+
+        output = self.fc2(x)
+        log_probs = F.log_softmax(output, dim=1)
+        return log_probs
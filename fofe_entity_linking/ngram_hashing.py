@@ -0,0 +1,117 @@
+import pickle
+import time
+
+import numpy as np
+
+from .normalizer import fold
+
+
+class NgramHashing(object):
+
+    def __init__(self, n=None, corpus_filename=None, corpus_text_list=None, vocab_filename=None,
+                 min_frequency=1, verbose=False, vocab=None):
+        """
+          n - Integer, the number of character in the ngram
+          corpus_filename -
+          corpus_text_list -
+          vocab_filename -
+          min_frequency - Integer, ngram seen less than this number of times in the corpus are left out of the vocab
+          verbose - Boolean, true to print the vocab build time and size
+          vocab - List, an already built vocab (ex: read from an exported artifact), OOV ngram first
+        """
+        if vocab is not None:
+            self.vocab = list(vocab)
+            self.n = len(self.vocab[0])
+        elif vocab_filename:
+            # load vocab
+            with open(vocab_filename, "rb") as input_file:
+                self.vocab = pickle.load(input_file)
+            self.n = len(self.vocab[0])
+        else:
+            # read the file line by line to create the word corpus
+            if corpus_filename:
+                with open(corpus_filename) as f:
+                    corpus_text_list = f.readlines()
+
+            corpus = self.get_preprocessed_lines(corpus_text_list)
+
+            self.n = n
+
+            start_time = time.time()
+            self.vocab = self._create_vocab(corpus, min_frequency)
+            if verbose:
+                print(f"ngram vocab of {len(self.vocab)} ngrams built in {time.time() - start_time:.3f} sec "
+                      f"({len(corpus)} lines, min_frequency={min_frequency})")
+
+        self.ngram2idx = {ngram: i for i, ngram in enumerate(self.vocab)}
+
+    def save_vocab(self, ngram_vocab_filename):
+        with open(ngram_vocab_filename, "wb") as out:
+            pickle.dump(self.vocab, out)
+
+    def ngram(self, str):
+        ngram_list = []
+        oov = self.vocab[0]
+        word = '#' + self.ascii_trim_lowercase(str) + '#'
+        for i in range(len(word) - self.n + 1):
+            ngram = word[i:i + self.n]
+            # add the ngram if part of the vocab, otherwise OOV
+            ngram_list.append(ngram if ngram in self.ngram2idx else oov)
+        return ngram_list
+
+    def ngram_indexes(self, str):
+        """ Returns the vocab index of each ngram of the given string, 0 (OOV) for unknown ngram. """
+        get_index = self.ngram2idx.get
+        word = '#' + self.ascii_trim_lowercase(str) + '#'
+        return [get_index(word[i:i + self.n], 0) for i in range(len(word) - self.n + 1)]
+
+    def index_array(self, str):
+        """ Returns the vocab indexes of the given string as an int32 numpy array. """
+        return np.array(self.ngram_indexes(str), dtype=np.int32)
+
+    def index_batch(self, str_list, max_tokens=None):
+        """
+        Index many strings at once.
+
+        Returns
+            indices - int32 numpy array, the vocab indexes of all strings concatenated
+            offsets - int64 numpy array, the start position of each string in indices
+        """
+        indices = []
+        offsets = np.empty(len(str_list), dtype=np.int64)
+        for i, str in enumerate(str_list):
+            offsets[i] = len(indices)
+            indices.extend(self.ngram_indexes(str)[:max_tokens])
+
+        return np.array(indices, dtype=np.int32), offsets
+
+    def _create_vocab(self, corpus, min_frequency=1):
+        """
+        Returns the list of ngrams found in the corpus, in first-seen order, in a single pass.
+        The order is the same as previous versions so the vocab indexes stay compatible.
+        """
+        oov = '#'*self.n
+
+        # ngram -> count, a dict keeps the insertion (first-seen) order
+        ngram_counts = {}
+
+        for word in corpus:
+            word = '#' + word + '#'
+            for i in range(len(word) - self.n + 1):
+                ngram = word[i:i + self.n]
+                ngram_counts[ngram] = ngram_counts.get(ngram, 0) + 1
+
+        # first token of the vocab is OOV (out of vocab) token
+        vocab = [oov]
+        vocab.extend(ngram for ngram, count in ngram_counts.items()
+                     if count >= min_frequency and ngram != oov and '_' not in ngram)
+        return vocab
+
+    @staticmethod
+    def ascii_trim_lowercase(text):
+        """ convert the given text to ascii (remove accent), remove leading spaces and lowercase. """
+        return fold(text).strip()
+
+    def get_preprocessed_lines(self, corpus_text_list):
+        """ read the given file and returns a list of lines, convert to ascii without leading spaces """
+        return [self.ascii_trim_lowercase(x) for x in corpus_text_list]
@@ -0,0 +1,70 @@
+import functools
+import re
+
+import unidecode
+
+
+# number of texts remembered by each memoized normalization
+MEMO_SIZE = 16384
+
+# accented latin letters (latin-1 and latin extended-a/b) -> ascii, precomputed with unidecode, which
+# transliterates each character independently: the other characters are left to unidecode
+ASCII_TABLE = str.maketrans({chr(code): unidecode.unidecode(chr(code)) for code in range(0x80, 0x250)})
+
+# dash and apostrophe separate words
+SEPARATORS_TABLE = str.maketrans({'-': ' ', "'": ' '})
+
+MULTIPLE_SPACES = re.compile(r' {2,}')
+
+# "st" and "ste" followed by a space or a dash, at the start or after a space or a dash
+SAINT_ABBREVIATION = re.compile(r'(?<![^ -])st(e?)(?=[ -])')
+
+
+@functools.lru_cache(maxsize=MEMO_SIZE)
+def fold(text):
+    """ Returns the text in ascii (accents removed) and lower case, same as unidecode(text).lower(). """
+    if not text.isascii():
+        text = text.translate(ASCII_TABLE)
+        if not text.isascii():
+            text = unidecode.unidecode(text)
+    return text.lower()
+
+
+@functools.lru_cache(maxsize=MEMO_SIZE)
+def normalize_text(text):
+    """
+    Normalization of a model input, in training and inference: ascii, lower case, dash and apostrophe
+    replaced by a space.
+    """
+    return fold(text).translate(SEPARATORS_TABLE)
+
+
+def normalize_name(text):
+    """
+    Normalization of a gazetteer name (the exact map keys): ascii, lower case, no leading or trailing space,
+    dash and apostrophe replaced by a space, multiple spaces replaced by one.
+
+    Example:
+        normalize_name("Côte-des-Neiges - Notre-Dame-de-Grâce") --> 'cote des neiges notre dame de grace'
+    """
+    return MULTIPLE_SPACES.sub(' ', fold(text).strip().translate(SEPARATORS_TABLE))
+
+
+def expand_saint_abbreviation(text):
+    """
+    Returns the text in lower case with "st" and "ste" expanded to "saint" and "sainte", when followed by
+    a space or a dash and at the start or after a space or a dash ("st-jean", but not "ouest-").
+    """
+    return SAINT_ABBREVIATION.sub(lambda match: 'sainte' if match.group(1) else 'saint', text.lower())
+
+
+@functools.lru_cache(maxsize=MEMO_SIZE)
+def normalize_mention(text):
+    """
+    Normalization of an entity mention, before its linking: the gazetteer name normalization
+    with the saint/sainte abbreviations expanded.
+
+    Example:
+        normalize_mention("Ste-Anne-de-Bellevue") --> 'sainte anne de bellevue'
+    """
+    return normalize_name(expand_saint_abbreviation(fold(text)))
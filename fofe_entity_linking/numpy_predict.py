@@ -0,0 +1,171 @@
+import numpy as np
+
+from .artifact import read_artifact
+from .ngram_hashing import NgramHashing
+from .normalizer import normalize_text
+
+
+def log_softmax(x):
+    x = x - x.max(axis=1, keepdims=True)
+    return x - np.log(np.exp(x).sum(axis=1, keepdims=True))
+
+
+class NumpyFofeModel(object):
+    """
+    Torch-free inference of an exported (folded) FOFE model, see fofe_entity_linking.export.
+
+    Same computation as FoldedFofeNNModel: a FOFE weighted sum of the hidden table rows of the mention n-grams,
+    the fc1 bias, a ReLU, then fc2 (or one output layer per head) and a log softmax.
+
+    The weights are used in place, when loaded from an artifact file they stay in its read-only memory map.
+
+    Example:
+        model = NumpyFofeModel.load('./fofe_entity_linking/models/metro.fofe')
+        log_probs = model.predict(['berri uqam'])
+        model.labels[log_probs[0].argmax()]  --> 'Berri-UQAM'
+    """
+
+    # number of mentions whose table rows are gathered at once, so the gathered rows stay in the CPU cache
+    gather_chunk_size = 32
+
+    # a batch of at least dense_min_batch mentions, with a vocab of at most dense_max_vocab n-grams (ex: bulk
+    # linking), is computed as a (mentions, vocab) FOFE matrix times the table. Its cost grows with the vocab
+    # for every mention: slower than the gather for the small serving batches and for the large vocabs.
+    dense_min_batch = 64
+    dense_max_vocab = 2048
+    # maximum number of entries of the FOFE matrix, larger batches are computed by chunks
+    max_fofe_matrix_size = 1 << 22
+
+    def __init__(self, header, arrays):
+        """
+        Arguments
+            header - dict, the artifact metadata (forgetting factor, vocab, labels, ...)
+            arrays - dict, array name -> numpy array, as written by fofe_entity_linking.export
+        """
+        self.header = header
+        self.forgetting_factor = float(header['forgetting_factor'])
+        self.ngram = NgramHashing(vocab=header['vocab'])
+
+        self.hidden_table = arrays['hidden_table']
+        self.fc1_bias = arrays['fc1_bias']
+
+        # output layers: head name -> (weight of shape (hidden_size, classes), bias),
+        # a single head named '' for a single model
+        self.head_names = header['heads'] or []
+        self.outputs = {}
+        for name in self.head_names or ['']:
+            prefix = f'{name}.' if name else ''
+            self.outputs[name] = (arrays[prefix + 'fc2_weight'], arrays[prefix + 'fc2_bias'])
+
+        # head name -> entity names in the classes order, and the gazetteer entries (exact map source)
+        self.head_labels = header['labels']
+        self.gazetteers = header.get('gazetteers') or {}
+        self.labels = self.head_labels.get('')
+        self.gazetteer = self.gazetteers.get('')
+        self.powers = self.forgetting_factor ** np.arange(64, dtype=np.float32)
+
+        # (texts, max_tokens, output) of the last multi-head forward pass, see predict_heads()
+        self._last = (None, None, None)
+
+    @property
+    def heads(self):
+        """ Names of the heads of a multi-head model, None for a single model (same as FoldedFofeNNModel). """
+        return self.head_names or None
+
+    @classmethod
+    def load(cls, artifact_filename, verify=True):
+        return cls(*read_artifact(artifact_filename, verify))
+
+    def hidden(self, texts, max_tokens=50):
+        """ Returns the hidden layer output of the given texts, array of shape (len(texts), hidden_size). """
+        normalized_texts = [normalize_text(text) for text in texts]
+        indices, offsets = self.ngram.index_batch(normalized_texts, max_tokens)
+        lengths = np.diff(np.append(offsets, len(indices)))
+
+        # FOFE weight of each n-gram: ff ** (number of n-grams after it in its mention)
+        if len(lengths) and lengths.max() > len(self.powers):
+            self.powers = self.forgetting_factor ** np.arange(2 * lengths.max(), dtype=np.float32)
+        positions = np.arange(len(indices)) - np.repeat(offsets, lengths)
+        weights = self.powers[np.repeat(lengths, lengths) - 1 - positions]
+
+        # weighted sum of the table rows, per mention (empty mentions are left to zero)
+        if len(texts) >= self.dense_min_batch and len(self.hidden_table) <= self.dense_max_vocab:
+            x = self.dense_sum(indices, offsets, lengths, weights)
+        else:
+            x = self.gather_sum(indices, offsets, lengths, weights)
+
+        return np.maximum(x + self.fc1_bias, 0)
+
+    def gather_sum(self, indices, offsets, lengths, weights):
+        """ Returns the FOFE weighted sums of the table rows of the mentions n-grams, gathered by chunks. """
+        x = np.zeros((len(offsets), self.hidden_table.shape[1]), dtype=np.float32)
+        if len(offsets) <= self.gather_chunk_size:
+            non_empty = lengths > 0
+            if non_empty.any():
+                rows = self.hidden_table[indices] * weights[:, None]
+                x[non_empty] = np.add.reduceat(rows, offsets[non_empty], axis=0)
+            return x
+
+        bounds = np.append(offsets, len(indices))
+        for start in range(0, len(offsets), self.gather_chunk_size):
+            stop = min(start + self.gather_chunk_size, len(offsets))
+            x[start:stop] = self.gather_sum(indices[bounds[start]:bounds[stop]], offsets[start:stop] - bounds[start],
+                                            lengths[start:stop], weights[bounds[start]:bounds[stop]])
+        return x
+
+    def dense_sum(self, indices, offsets, lengths, weights):
+        """ Same as gather_sum(), as the product of the (mentions, vocab) FOFE matrix by the table. """
+        vocab_size, hidden_size = self.hidden_table.shape
+        mention_ids = np.repeat(np.arange(len(offsets)), lengths)
+        bounds = np.append(offsets, len(indices))
+        x = np.empty((len(offsets), hidden_size), dtype=np.float32)
+        chunk_size = max(1, self.max_fofe_matrix_size // vocab_size)
+        for start in range(0, len(offsets), chunk_size):
+            stop = min(start + chunk_size, len(offsets))
+            chunk = slice(bounds[start], bounds[stop])
+            fofe = np.bincount((mention_ids[chunk] - start) * vocab_size + indices[chunk], weights[chunk],
+                               (stop - start) * vocab_size)
+            x[start:stop] = fofe.reshape(stop - start, vocab_size).astype(np.float32).dot(self.hidden_table)
+        return x
+
+    def predict(self, texts, max_tokens=50):
+        """
+        Returns the log probabilities of each given text, array of shape (len(texts), number_of_classes).
+        For a multi-head model, returns a dict: head name -> log probabilities array.
+        """
+        x = self.hidden(texts, max_tokens)
+        output = {name: log_softmax(x.dot(weight) + bias) for name, (weight, bias) in self.outputs.items()}
+        return output if self.head_names else output['']
+
+    def predict_heads(self, texts, max_tokens=50):
+        """ Same as predict() for a multi-head model, but keeps the last result so each head reuses it. """
+        texts = list(texts)
+        last_texts, last_max_tokens, output = self._last
+        if texts != last_texts or max_tokens != last_max_tokens:
+            output = self.predict(texts, max_tokens)
+            self._last = (texts, max_tokens, output)
+        return output
+
+    def head(self, head_name):
+        return NumpyModelHead(self, head_name)
+
+
+class NumpyModelHead(object):
+    """ A single head of a multi-head NumpyFofeModel, used like a single gazetteer model. """
+
+    def __init__(self, model, head_name):
+        self.model = model
+        self.head_name = head_name
+        self.labels = model.head_labels[head_name]
+        self.gazetteer = model.gazetteers.get(head_name)
+
+    def predict(self, texts, max_tokens=50):
+        return self.model.predict_heads(texts, max_tokens)[self.head_name]
+
+
+def load_model(artifact_filename, verify=True):
+    return NumpyFofeModel.load(artifact_filename, verify)
+
+
+def predict(model, text, max_tokens=50):
+    return model.predict([text], max_tokens)
@@ -2,56 +2,158 @@ import argparse
 import math
 import pickle
 import torch
+import torch.nn as nn
 
-from .dataset import DatasetGenerator
-from .embedding import NgramEmbedding, Fofe
-from .model import FofeNNModel
+from .artifact import read_artifact
+from .embedding import NgramEmbedding, NgramHashing, Fofe
+from .model import FofeNNModel, FoldedFofeNNModel, MultiHeadFofeNNModel
+from .normalizer import normalize_text
 
 
 use_cuda = torch.cuda.is_available()
 
 
-def load_models(model_pathname, embedding_pathname, vocab_filename):
+def load_models(model_pathname, embedding_pathname, vocab_filename, folded=False, forgetting_factor=0.95,
+                quantized=False):
+    """
+    Load a trained model and its n-gram embedding.
+
+    When folded is True, the embedding is folded into the model first layer (see FoldedFofeNNModel):
+    predictions stay the same but no embedding-dim matrix product is done per mention.
+
+    When quantized is True, the linear layers weights are converted to int8 (dynamic quantization,
+    activations are quantized on the fly). Check the accuracy with fofe_entity_linking.quantization first.
+    """
     e = NgramEmbedding(embedding_filename=embedding_pathname, vocab_filename=vocab_filename)
 
     load_dict = torch.load(model_pathname, map_location=torch.device('cpu'))
     hidden_layer_size = len(load_dict['fc1.bias'])
-    number_of_classes = len(load_dict['fc2.bias'])
-    m = FofeNNModel(e.embedding_layer.embedding_dim, hidden_layer_size, 0.25, number_of_classes)
+
+    # a multi-head model has one 'heads.{name}.bias' entry per head, in the order they were created
+    head_classes = [(key[len('heads.'):-len('.bias')], len(value))
+                    for key, value in load_dict.items() if key.startswith('heads.') and key.endswith('.bias')]
+    if head_classes:
+        m = MultiHeadFofeNNModel(e.embedding_layer.embedding_dim, hidden_layer_size, 0.25, head_classes)
+    else:
+        number_of_classes = len(load_dict['fc2.bias'])
+        m = FofeNNModel(e.embedding_layer.embedding_dim, hidden_layer_size, 0.25, number_of_classes)
     m.load_state_dict(load_dict)
 
+    if folded:
+        m = FoldedFofeNNModel(m, e.embedding_layer.weight, forgetting_factor)
+
     m.eval()
+
+    if quantized:
+        # the folded model hidden table is a lookup table, only fc2 (or the heads) are quantized
+        m = torch.quantization.quantize_dynamic(m, {nn.Linear}, dtype=torch.qint8, inplace=True)
+
     return m, e
 
 
+def load_artifact(artifact_filename, verify=True):
+    """
+    Load a folded model from an artifact written by fofe_entity_linking.export (see FoldedFofeNNModel.from_arrays).
+
+    The weights stay in the read-only memory map of the artifact: the processes loading the same artifact
+    share them through the page cache. The returned embedding only holds the n-gram vocab.
+    """
+    header, arrays = read_artifact(artifact_filename, verify)
+    model = FoldedFofeNNModel.from_arrays(header, arrays)
+    return model, NgramEmbedding(ngram=NgramHashing(vocab=header['vocab']))
+
+
 def predict(model, embedding, text, max_tokens=50):
-    # process input text
-    fofe_input = get_fofe_embedding(embedding, text, max_tokens)
-    processed_input = fofe_input.unsqueeze(0)
+    return predict_batch(model, embedding, [text], max_tokens)
+
+
+def predict_batch(model, embedding, texts, max_tokens=50):
+    """
+    Returns the log probabilities of each given text, tensor of shape (len(texts), number_of_classes).
+    For a multi-head model, returns a dict: head name -> log probabilities tensor.
+    """
+    if isinstance(model, ModelHead):
+        return model.predict(texts, max_tokens)
 
     if use_cuda:
-        processed_input = processed_input.to('cuda')
         model = model.to('cuda')
 
-    probabilities = model(processed_input)
+    with torch.no_grad():
+        if isinstance(model, FoldedFofeNNModel):
+            # the folded model does its own gather-sum from the n-gram indices
+            indices, offsets = get_ngram_bags(embedding, texts, max_tokens)
+            probabilities = model(indices, offsets)
+        else:
+            # process input texts
+            processed_input = get_fofe_embeddings(embedding, texts, max_tokens)
+
+            if use_cuda:
+                processed_input = processed_input.to('cuda')
+
+            probabilities = model(processed_input)
 
     return probabilities
 
 
-def get_fofe_embedding(embedding, text, max_tokens):
-    normalized_text = DatasetGenerator.normalize_name(text)
+class MultiHeadPredictor(object):
+    """
+    Run a multi-head model and keep the result of the last forward pass,
+    so all the heads of a same mention are computed with a single forward pass.
+    """
 
-    # get the indices list of the normalized text
-    sentence_indices = embedding.ngram.ngram_indexes(normalized_text)
+    def __init__(self, model, embedding):
+        self.model = model
+        self.embedding = embedding
 
-    if len(sentence_indices) > max_tokens:
-        sentence_indices = sentence_indices[max_tokens]
+        # (texts, max_tokens, output) of the last forward pass
+        self._last = (None, None, None)
 
-    sentence_v = [embedding.embedding_layer.weight[i].numpy() for i in sentence_indices]
+    def predict(self, texts, max_tokens=50):
+        texts = list(texts)
+        last_texts, last_max_tokens, output = self._last
+        if texts != last_texts or max_tokens != last_max_tokens:
+            output = predict_batch(self.model, self.embedding, texts, max_tokens)
+            self._last = (texts, max_tokens, output)
+        return output
 
-    # convert one-hot to FOFE encoding
-    fofe = Fofe(0.95)
-    return fofe.encode_sentence(sentence_v)
+    def head(self, head_name):
+        return ModelHead(self, head_name)
+
+
+class ModelHead(object):
+    """ A single head of a multi-head model, can be passed to predict() in place of a single gazetteer model. """
+
+    def __init__(self, predictor, head_name):
+        self.predictor = predictor
+        self.head_name = head_name
+
+    def predict(self, texts, max_tokens=50):
+        return self.predictor.predict(texts, max_tokens)[self.head_name]
+
+
+def get_ngram_bags(embedding, texts, max_tokens):
+    """
+    Returns the n-gram indices of the given texts as a flat list and the start offset of each text.
+    Both are long tensors, ready to be passed to an embedding bag.
+    """
+    normalized_texts = [normalize_text(text) for text in texts]
+
+    # get the indices of the normalized texts
+    indices, offsets = embedding.ngram.index_batch(normalized_texts, max_tokens)
+
+    return torch.from_numpy(indices).long(), torch.from_numpy(offsets)
+
+
+def get_fofe_embeddings(embedding, texts, max_tokens, forgetting_factor=0.95):
+    indices, offsets = get_ngram_bags(embedding, texts, max_tokens)
+
+    # convert indices to FOFE encoding, in a single gather-sum over the embedding weights
+    fofe = Fofe.shared(forgetting_factor)
+    return fofe.encode_bags(embedding.embedding_layer.weight, indices, offsets)
+
+
+def get_fofe_embedding(embedding, text, max_tokens):
+    return get_fofe_embeddings(embedding, [text], max_tokens)[0]
 
 
 if __name__ == "__main__":
@@ -63,11 +165,17 @@ if __name__ == "__main__":
 
     parser.add_argument('--text', type=str, default='Roberval', help='text string')
     parser.add_argument('--max_length', type=int, default=50)
+    parser.add_argument('--head', type=str, help='head name, for a multi-head model')
+    parser.add_argument('--folded', type=int, choices=[0, 1], default=0, help='1 to fold the embedding into the model')
+    parser.add_argument('--quantized', type=int, choices=[0, 1], default=0, help='1 for int8 linear layers')
 
     args = parser.parse_args()
 
-    model, embedding = load_models(args.model, args.embedding, args.vocab)
+    model, embedding = load_models(args.model, args.embedding, args.vocab,
+                                   folded=(args.folded == 1), quantized=(args.quantized == 1))
     prediction = predict(model, embedding, args.text, args.max_length)
+    if isinstance(prediction, dict):
+        prediction = prediction[args.head]
 
     print(f'prediction : {prediction}')
     print(f'input : {args.text}\n')
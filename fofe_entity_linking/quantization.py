@@ -0,0 +1,140 @@
+import argparse
+import io
+import json
+import multiprocessing
+import os
+import resource
+import time
+
+import numpy as np
+import pandas as pd
+import torch
+
+from .predict import load_models, predict, predict_batch
+
+
+def resident_memory():
+    """ Returns the resident set size of the current process, in bytes. """
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        # no procfs: fall back to the peak resident size (kilobytes on linux)
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def serialized_size(model):
+    """ Returns the size in bytes of the saved model parameters. """
+    buffer = io.BytesIO()
+    torch.save(model.state_dict(), buffer)
+    return buffer.tell()
+
+
+def accuracy(model, embedding, texts, labels, max_tokens=50, batch_size=256):
+    """ Returns the top-1 accuracy and the predicted classes of the model on the given texts. """
+    predictions = []
+    for start in range(0, len(texts), batch_size):
+        output = predict_batch(model, embedding, texts[start:start + batch_size], max_tokens)
+        predictions.append(output.argmax(1).cpu().numpy())
+
+    predictions = np.concatenate(predictions)
+    return float((predictions == np.asarray(labels)).mean()), predictions
+
+
+def latency(model, embedding, texts, max_tokens=50, repeat=1):
+    """ Returns the mean, p50 and p95 latency in milliseconds of a single mention prediction, as in the bot. """
+    timings = []
+    for _ in range(repeat):
+        for text in texts:
+            start = time.perf_counter()
+            predict(model, embedding, text, max_tokens)
+            timings.append((time.perf_counter() - start) * 1000)
+
+    return float(np.mean(timings)), float(np.percentile(timings, 50)), float(np.percentile(timings, 95))
+
+
+def evaluate(args, quantized):
+    """ Load the model (int8 when quantized is True) and returns its accuracy, latency and memory figures. """
+    torch.set_num_threads(args.threads)
+
+    test_set = pd.read_csv(os.path.join(args.data_dir, f'{args.name}_test_set.csv'), encoding=args.encoding)
+    texts = test_set[args.text_column].astype(str).tolist()
+    labels = test_set[args.label_column].tolist()
+
+    rss_before = resident_memory()
+    model, embedding = load_models(os.path.join(args.models_dir, f'{args.name}.pth'),
+                                   os.path.join(args.data_dir, f'{args.name}_embedding.pth'),
+                                   os.path.join(args.data_dir, f'{args.name}_vocab.pickle'),
+                                   folded=(args.folded == 1), quantized=quantized)
+    rss_loaded = resident_memory()
+
+    test_accuracy, predictions = accuracy(model, embedding, texts, labels, args.max_length)
+    mean, p50, p95 = latency(model, embedding, texts[:args.latency_samples], args.max_length, args.repeat)
+
+    return {
+        'quantized': quantized,
+        'accuracy': test_accuracy,
+        'latency_mean_ms': mean,
+        'latency_p50_ms': p50,
+        'latency_p95_ms': p95,
+        'model_bytes': serialized_size(model),
+        'rss_model_bytes': rss_loaded - rss_before,
+        'rss_bytes': resident_memory(),
+        'predictions': predictions.tolist(),
+    }
+
+
+def compare(args):
+    """
+    Evaluate the fp32 and the int8 model, each one in a fresh process so the resident memory
+    of one does not hide the other.
+    """
+    context = multiprocessing.get_context('spawn')
+    results = {}
+    for quantized in [False, True]:
+        with context.Pool(1) as pool:
+            results['int8' if quantized else 'fp32'] = pool.apply(evaluate, (args, quantized))
+
+    fp32_predictions = results['fp32'].pop('predictions')
+    int8_predictions = results['int8'].pop('predictions')
+    results['agreement'] = float(np.mean(np.asarray(fp32_predictions) == np.asarray(int8_predictions)))
+    results['accuracy_drop'] = results['fp32']['accuracy'] - results['int8']['accuracy']
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser('Compare the accuracy, latency and memory of a fp32 and an int8 model')
+    parser.add_argument('--name', type=str, default='metro', help='gazetteer name (cities, metro, quartiers)')
+    parser.add_argument('--models_dir', type=str, default='./models')
+    parser.add_argument('--data_dir', type=str, default='./data')
+    parser.add_argument('--label_column', type=str, default='EntityName')
+    parser.add_argument('--text_column', type=str, default='EntityMention')
+    parser.add_argument('--encoding', type=str, default='utf-8')
+    parser.add_argument('--max_length', type=int, default=50)
+    parser.add_argument('--folded', type=int, choices=[0, 1], default=1, help='1 to fold the embedding into the model')
+    parser.add_argument('--latency_samples', type=int, default=500, help='number of test mentions timed')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--threads', type=int, default=1, help='torch intra-op threads')
+    parser.add_argument('--max_accuracy_drop', type=float, default=0.005)
+    parser.add_argument('--output', type=str, help='json file for the results')
+
+    args = parser.parse_args()
+
+    results = compare(args)
+    for mode in ['fp32', 'int8']:
+        r = results[mode]
+        print(f"{mode}: accuracy {r['accuracy']:.4f} | "
+              f"latency mean {r['latency_mean_ms']:.3f} ms p50 {r['latency_p50_ms']:.3f} ms "
+              f"p95 {r['latency_p95_ms']:.3f} ms | "
+              f"model {r['model_bytes'] / 2**20:.1f} MB | rss +{r['rss_model_bytes'] / 2**20:.1f} MB")
+    print(f"agreement with fp32: {results['agreement']:.4f}")
+
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            json.dump(results, output_file, indent=2)
+
+    if results['accuracy_drop'] > args.max_accuracy_drop:
+        print(f"int8 accuracy drop {results['accuracy_drop']:.4f} > {args.max_accuracy_drop}: keep {args.name} in fp32")
+        exit(1)
+
+    print(f'{args.name} can be added to the CityMetro "quantized" list')
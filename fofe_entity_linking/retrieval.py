@@ -0,0 +1,330 @@
+import argparse
+import os
+import time
+
+import numpy as np
+
+from .artifact import read_artifact, read_header, write_artifact
+from .normalizer import normalize_text
+from .numpy_predict import load_model
+
+
+def normalize_rows(x):
+    """ Returns the rows of x scaled to unit length (zero rows are left to zero), as float32. """
+    x = np.asarray(x, dtype=np.float32)
+    norms = np.linalg.norm(x, axis=1, keepdims=True)
+    return x / np.maximum(norms, 1e-12)
+
+
+def top_k(scores, k):
+    """ Returns the indices of the k highest scores, highest first. """
+    if k < len(scores):
+        candidates = np.argpartition(-scores, k - 1)[:k]
+    else:
+        candidates = np.arange(len(scores))
+    return candidates[np.argsort(-scores[candidates], kind='stable')]
+
+
+def char_ngrams(text, n=3):
+    """ Returns the set of character n-grams of text, padded with '#' so short names have n-grams too. """
+    text = f'#{text}#'
+    return {text[i:i + n] for i in range(max(1, len(text) - n + 1))}
+
+
+def ngram_similarity(a, b, n=3):
+    """ Returns the Dice coefficient of the character n-grams of a and b, between 0 and 1. """
+    a, b = char_ngrams(a, n), char_ngrams(b, n)
+    return 2 * len(a & b) / (len(a) + len(b))
+
+
+class BruteForceIndex(object):
+    """ Exact cosine similarity search: a single matrix product against every vector. """
+
+    kind = 'brute'
+
+    def __init__(self, vectors):
+        """
+        Arguments
+            vectors - array of shape (number of names, dim), normalized to unit length
+        """
+        self.vectors = vectors
+
+    def __len__(self):
+        return len(self.vectors)
+
+    @classmethod
+    def build(cls, vectors, dtype=np.float32):
+        return cls(normalize_rows(vectors).astype(dtype))
+
+    def arrays(self):
+        return {'vectors': self.vectors}
+
+    @classmethod
+    def from_arrays(cls, arrays, **kwargs):
+        return cls(arrays['vectors'])
+
+    def search(self, queries, k=10):
+        """ Returns (scores, ids) of the k nearest vectors of each query, lists of arrays, nearest first. """
+        scores = normalize_rows(queries).dot(self.vectors.T)
+        ids = [top_k(query_scores, k) for query_scores in scores]
+        return [query_scores[query_ids] for query_scores, query_ids in zip(scores, ids)], ids
+
+
+class IVFIndex(object):
+    """
+    Approximate cosine similarity search with an inverted file index.
+
+    The vectors are partitioned by spherical k-means into n_lists lists (about sqrt(number of names)),
+    stored contiguously list after list. A query is only compared to the centroids and to the vectors
+    of its n_probe nearest non-empty lists, so the search cost grows with the square root of the gazetteer size.
+    """
+
+    kind = 'ivf'
+
+    def __init__(self, vectors, ids, centroids, list_offsets, n_probe=8):
+        """
+        Arguments
+            vectors - array of shape (number of names, dim), normalized to unit length and sorted by list
+            ids - array of the name index of each vector
+            centroids - array of shape (n_lists, dim), normalized to unit length
+            list_offsets - array of n_lists + 1 offsets, the vectors of list i are vectors[offsets[i]:offsets[i + 1]]
+            n_probe - integer, number of lists searched per query
+        """
+        self.vectors = vectors
+        self.ids = ids
+        self.centroids = centroids
+        self.list_offsets = list_offsets
+        self.n_probe = n_probe
+
+        # the k-means can leave lists empty, they are never probed
+        self.non_empty_lists = np.flatnonzero(np.diff(list_offsets) > 0)
+
+    def __len__(self):
+        return len(self.vectors)
+
+    @classmethod
+    def build(cls, vectors, n_lists=None, n_probe=8, iterations=10, seed=0, dtype=np.float32):
+        vectors = normalize_rows(vectors)
+        n_lists = min(n_lists or max(1, int(np.sqrt(len(vectors)))), len(vectors))
+
+        # spherical k-means, initialized with random vectors
+        random = np.random.RandomState(seed)
+        centroids = vectors[random.choice(len(vectors), n_lists, replace=False)]
+        for _ in range(iterations):
+            assignment = vectors.dot(centroids.T).argmax(1)
+            order = np.argsort(assignment, kind='stable')
+            counts = np.bincount(assignment, minlength=n_lists)
+            non_empty = counts > 0
+            sums = np.zeros_like(centroids)
+            sums[non_empty] = np.add.reduceat(vectors[order], (np.cumsum(counts) - counts)[non_empty])
+            # an empty list keeps its centroid
+            centroids = np.where(non_empty[:, None], normalize_rows(sums), centroids)
+        assignment = vectors.dot(centroids.T).argmax(1)
+
+        ids = np.argsort(assignment, kind='stable')
+        list_offsets = np.concatenate([[0], np.cumsum(np.bincount(assignment, minlength=n_lists))])
+        return cls(vectors[ids].astype(dtype), ids.astype(np.int64), centroids, list_offsets.astype(np.int64),
+                   n_probe)
+
+    def arrays(self):
+        return {'vectors': self.vectors, 'ids': self.ids, 'centroids': self.centroids,
+                'list_offsets': self.list_offsets}
+
+    @classmethod
+    def from_arrays(cls, arrays, n_probe=8):
+        return cls(arrays['vectors'], arrays['ids'], arrays['centroids'], arrays['list_offsets'], n_probe)
+
+    def search(self, queries, k=10):
+        """ Returns (scores, ids) of the k nearest vectors of each query, lists of arrays, nearest first. """
+        queries = normalize_rows(queries)
+        n_probe = min(self.n_probe, len(self.non_empty_lists))
+        all_scores, all_ids = [], []
+        for query, centroid_scores in zip(queries, queries.dot(self.centroids[self.non_empty_lists].T)):
+            lists = self.non_empty_lists[top_k(centroid_scores, n_probe)]
+            positions = np.concatenate([np.arange(self.list_offsets[i], self.list_offsets[i + 1]) for i in lists] +
+                                       [np.zeros(0, dtype=np.int64)])
+            scores = self.vectors[positions].dot(query)
+            best = top_k(scores, k)
+            all_scores.append(scores[best])
+            all_ids.append(self.ids[positions[best]])
+        return all_scores, all_ids
+
+
+INDEXES = {index.kind: index for index in [BruteForceIndex, IVFIndex]}
+
+
+def pca_projection(vectors, dim, max_samples=5000, seed=0):
+    """ Returns (mean, projection of shape (vectors dim, dim)), the first principal components of the vectors. """
+    if len(vectors) > max_samples:
+        vectors = vectors[np.random.RandomState(seed).choice(len(vectors), max_samples, replace=False)]
+    mean = vectors.mean(0)
+    _, _, components = np.linalg.svd(vectors - mean, full_matrices=False)
+    return mean.astype(np.float32), components[:dim].T.astype(np.float32)
+
+
+class RetrievalLinker(object):
+    """
+    Link a mention to a gazetteer name by nearest neighbor search instead of a softmax over the names.
+
+    The mentions and the gazetteer names are embedded in the same space, the hidden layer of a trained FOFE model
+    (NumpyFofeModel.hidden) projected on its first principal components, so a gazetteer can grow without
+    a new output layer nor a new training, for dim floats per name.
+    The rerank_size nearest names are re-ranked with their character trigram similarity to the mention.
+
+    The confidence of a link is its re-ranking score, between 0 and 1: a cosine similarity blended with
+    a string similarity, not a probability like the softmax models.
+
+    Example:
+        linker = RetrievalLinker.build(load_model('./models/streets_montreal.fofe'), gazetteer, 'ivf')
+        linker.link(['rue sherbrooke'])  --> [('Rue Sherbrooke', 0.97)]
+    """
+
+    def __init__(self, model, names, index, projection=None, rerank_size=10, alpha=0.5, header=None):
+        """
+        Arguments
+            model - NumpyFofeModel, the encoder of the mentions and names
+            names - list of entity names, the gazetteer
+            index - BruteForceIndex or IVFIndex of the name vectors
+            projection - (mean, matrix) applied to the hidden layer output, see pca_projection(), None to use it as is
+            rerank_size - integer, number of nearest names re-ranked
+            alpha - float, weight of the cosine similarity in the re-ranking score (1 - alpha for the trigrams)
+            header - dict, the index file metadata when loaded from a file
+        """
+        self.model = model
+        self.names = names
+        self.index = index
+        self.projection = projection
+        self.rerank_size = rerank_size
+        self.alpha = alpha
+        self.header = header
+        self.normalized_names = [normalize_text(name) for name in names]
+
+        # same attributes as a numpy model, used by CityMetro for the labels and the exact match map
+        self.labels = names
+        self.gazetteer = names
+
+    @classmethod
+    def build(cls, model, names, index='brute', dim=128, batch_size=128, rerank_size=10, alpha=0.5, **kwargs):
+        """
+        Embed the names with the model and index them.
+
+        Arguments
+            index - 'brute' or 'ivf', the index type, the other keyword arguments are passed to its build()
+            dim - integer, number of principal components kept, None to keep the whole hidden layer
+        """
+        names = [name.strip() for name in names if name.strip()]
+        vectors = np.concatenate([model.hidden(names[start:start + batch_size])
+                                  for start in range(0, len(names), batch_size)])
+
+        projection = None
+        if dim and dim < min(vectors.shape):
+            projection = pca_projection(vectors, dim)
+            vectors = (vectors - projection[0]).dot(projection[1])
+
+        return cls(model, names, INDEXES[index].build(vectors, **kwargs), projection, rerank_size, alpha)
+
+    def save(self, filename):
+        metadata = {
+            'index': self.index.kind,
+            'names': self.names,
+            'encoder_checksum': self.model.header.get('checksum'),
+            'encoder_name': self.model.header.get('name'),
+            'n_probe': getattr(self.index, 'n_probe', None),
+            'rerank_size': self.rerank_size,
+            'alpha': self.alpha,
+        }
+        arrays = dict(self.index.arrays())
+        if self.projection is not None:
+            arrays['projection_mean'], arrays['projection'] = self.projection
+        write_artifact(filename, arrays, metadata)
+
+    @classmethod
+    def load(cls, filename, model, verify=True):
+        """ Load an index file saved by save(), the model must be the one the names were embedded with. """
+        header, arrays = read_artifact(filename, verify)
+        if header['encoder_checksum'] != model.header.get('checksum'):
+            raise ValueError(f'{filename} was built with another model than {header["encoder_name"]}')
+
+        kwargs = {'n_probe': header['n_probe']} if header['index'] == 'ivf' else {}
+        index = INDEXES[header['index']].from_arrays(arrays, **kwargs)
+        projection = (arrays['projection_mean'], arrays['projection']) if 'projection' in arrays else None
+        return cls(model, header['names'], index, projection, header['rerank_size'], header['alpha'], header)
+
+    def embed(self, texts, max_tokens=50):
+        """ Returns the vectors of the given texts, in the space of the indexed names. """
+        vectors = self.model.hidden(texts, max_tokens)
+        if self.projection is not None:
+            vectors = (vectors - self.projection[0]).dot(self.projection[1])
+        return vectors
+
+    def candidates(self, texts, k=10, max_tokens=50):
+        """ Returns, for each text, the list of (name index, cosine similarity) of its k nearest names. """
+        scores, ids = self.index.search(self.embed(texts, max_tokens), k)
+        return [list(zip(text_ids.tolist(), text_scores.tolist())) for text_scores, text_ids in zip(scores, ids)]
+
+    def link(self, texts, max_tokens=50):
+        """
+        Returns the (entity name, confidence) of each text, see the class documentation,
+        or None for a text without any candidate name (an index without names): no link.
+        """
+        results = []
+        for text, candidates in zip(texts, self.candidates(texts, self.rerank_size, max_tokens)):
+            normalized_text = normalize_text(text)
+            best_id, best_score = None, -1.0
+            for name_id, similarity in candidates:
+                score = (self.alpha * max(similarity, 0.0) +
+                         (1 - self.alpha) * ngram_similarity(normalized_text, self.normalized_names[name_id]))
+                if score > best_score:
+                    best_id, best_score = name_id, score
+            results.append((self.names[best_id], best_score) if best_id is not None else None)
+        return results
+
+
+def load_linker(index_filename, models_dir='./models', verify=True):
+    """ Load a retrieval index with the model its names were embedded with ({models_dir}/{encoder name}.fofe). """
+    encoder_name = read_header(index_filename)['encoder_name']
+    return RetrievalLinker.load(index_filename, load_model(os.path.join(models_dir, f'{encoder_name}.fofe'), verify),
+                                verify)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser('Build the retrieval index of a gazetteer, see RetrievalLinker')
+    parser.add_argument('--encoder', type=str, default='streets_montreal',
+                        help='name of the exported model ({models_dir}/{encoder}.fofe) embedding the names')
+    parser.add_argument('--gazetteer', type=str, default='./streets_montreal.csv', help='one entity name per line')
+    parser.add_argument('--models_dir', type=str, default='./models')
+    parser.add_argument('--index', type=str, choices=sorted(INDEXES), default='ivf')
+    parser.add_argument('--n_lists', type=int, default=None, help='ivf: number of lists, default to sqrt(names)')
+    parser.add_argument('--n_probe', type=int, default=8, help='ivf: number of lists searched per query')
+    parser.add_argument('--dim', type=int, default=128, help='number of principal components, 0 for all')
+    parser.add_argument('--float16', action='store_true', help='store the name vectors in half precision')
+    parser.add_argument('--rerank_size', type=int, default=10)
+    parser.add_argument('--output', type=str, help='default to {models_dir}/{gazetteer name}.index')
+
+    args = parser.parse_args()
+
+    model = load_model(os.path.join(args.models_dir, f'{args.encoder}.fofe'))
+    with open(args.gazetteer) as gazetteer_file:
+        names = gazetteer_file.readlines()
+
+    kwargs = {'dtype': np.float16 if args.float16 else np.float32}
+    if args.index == 'ivf':
+        kwargs.update(n_lists=args.n_lists, n_probe=args.n_probe)
+
+    start = time.perf_counter()
+    linker = RetrievalLinker.build(model, names, args.index, args.dim, rerank_size=args.rerank_size, **kwargs)
+    build_time = time.perf_counter() - start
+
+    output = args.output or os.path.join(args.models_dir,
+                                         os.path.splitext(os.path.basename(args.gazetteer))[0] + '.index')
+    linker.save(output)
+
+    # latency of a single mention, as in the bot
+    mentions = [name.lower()[:-1] for name in linker.names[:200]]
+    start = time.perf_counter()
+    for mention in mentions:
+        linker.link([mention])
+    latency = (time.perf_counter() - start) / len(mentions) * 1000
+
+    print(f'{len(linker.names)} names, {args.index} index built in {build_time:.1f}s, '
+          f'{os.path.getsize(output) / 2**20:.1f} MB --> {output}, {latency:.2f} ms per mention')
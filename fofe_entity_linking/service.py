@@ -0,0 +1,346 @@
+import argparse
+import http.client
+import json
+import logging
+import math
+import os
+import queue
+import socketserver
+import threading
+import time
+
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from urllib.parse import urlparse
+
+
+logger = logging.getLogger(__name__)
+
+
+class MicroBatcher(object):
+    """
+    Gather the texts of concurrent requests into micro-batches, so a model runs one forward pass for many requests.
+
+    A batch is run as soon as it holds max_batch_size texts, or max_wait seconds after its first request.
+
+    Example:
+        batcher = MicroBatcher(lambda texts, max_tokens: [len(text) for text in texts])
+        batcher.submit(['berri uqam', 'verdun']).result()  --> [10, 6]
+    """
+
+    def __init__(self, predict_batch, max_batch_size=32, max_wait=0.005):
+        """
+        Arguments
+            predict_batch - function (texts, max_tokens) -> list of results, one per text
+            max_batch_size - integer, maximum number of texts in a batch
+            max_wait - float, maximum number of seconds a request waits for other requests
+        """
+        self.predict_batch = predict_batch
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+
+        self.batch_count = 0
+        self.text_count = 0
+
+        # (texts, max_tokens, future) of the pending requests
+        self._requests = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name='MicroBatcher', daemon=True)
+        self._thread.start()
+
+    def submit(self, texts, max_tokens=50):
+        """ Returns a Future of the list of results of the given texts. """
+        future = Future()
+        self._requests.put((list(texts), max_tokens, future))
+        return future
+
+    def _next_batch(self):
+        """ Wait for a request, then for others until the batch is full or max_wait is elapsed. """
+        batch = [self._requests.get()]
+        size = len(batch[0][0])
+        deadline = time.monotonic() + self.max_wait
+        while size < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                request = self._requests.get(timeout=remaining)
+            except queue.Empty:
+                break
+            batch.append(request)
+            size += len(request[0])
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+
+            # a forward pass per max_tokens value (always the same one in practice)
+            for max_tokens in {max_tokens for _, max_tokens, _ in batch}:
+                requests = [request for request in batch if request[1] == max_tokens]
+                texts = [text for request_texts, _, _ in requests for text in request_texts]
+                try:
+                    results = self.predict_batch(texts, max_tokens)
+                except Exception as e:
+                    for _, _, future in requests:
+                        future.set_exception(e)
+                    continue
+
+                self.batch_count += 1
+                self.text_count += len(texts)
+
+                start = 0
+                for request_texts, _, future in requests:
+                    future.set_result(results[start:start + len(request_texts)])
+                    start += len(request_texts)
+
+
+class ThreadingHTTPServer(socketserver.ThreadingMixIn, HTTPServer):
+    """ One thread per connection, so concurrent requests meet in the micro-batchers. """
+    daemon_threads = True
+
+
+class LinkerService(object):
+    """
+    Localhost HTTP service running the entity linking models for several NLU processes.
+
+        POST /link   {"model": "cities", "texts": ["montreal", ...], "max_tokens": 50}
+                     --> {"results": [["Montréal", 0.9987], ...]}  (linked name and probability of each text)
+        GET  /health --> {"status": "ok", "batches": ..., "texts": ...}
+    """
+
+    def __init__(self, linkers, host='127.0.0.1', port=8765, max_batch_size=32, max_wait=0.005):
+        """
+        Arguments
+            linkers - dict, model name -> function (texts, max_tokens) -> list of (linked name, probability)
+            host, port - the address to listen on, port 0 for any free port
+            max_batch_size, max_wait - see MicroBatcher
+        """
+        self.batchers = {name: MicroBatcher(linker, max_batch_size, max_wait) for name, linker in linkers.items()}
+        self.server = ThreadingHTTPServer((host, port), self._request_handler())
+        self.host, self.port = self.server.server_address[:2]
+        self._serving = False
+
+    def _request_handler(self):
+        service = self
+
+        class RequestHandler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def send_json(self, status, content):
+                body = json.dumps(content).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                if self.path != '/health':
+                    return self.send_json(404, {'error': f'unknown path {self.path}'})
+                batches = sum(batcher.batch_count for batcher in service.batchers.values())
+                texts = sum(batcher.text_count for batcher in service.batchers.values())
+                self.send_json(200, {'status': 'ok', 'models': list(service.batchers),
+                                     'batches': batches, 'texts': texts})
+
+            def do_POST(self):
+                if self.path != '/link':
+                    return self.send_json(404, {'error': f'unknown path {self.path}'})
+
+                request = json.loads(self.rfile.read(int(self.headers['Content-Length'])).decode('utf-8'))
+                batcher = service.batchers.get(request.get('model'))
+                if batcher is None:
+                    return self.send_json(404, {'error': f'unknown model {request.get("model")}'})
+
+                try:
+                    results = batcher.submit(request['texts'], request.get('max_tokens', 50)).result()
+                except Exception as e:
+                    logger.exception('entity linking failed')
+                    return self.send_json(500, {'error': str(e)})
+
+                self.send_json(200, {'results': [[name, probability] for name, probability in results]})
+
+            def log_message(self, format, *args):
+                logger.debug(format, *args)
+
+        return RequestHandler
+
+    @property
+    def url(self):
+        return f'http://{self.host}:{self.port}'
+
+    def serve_forever(self):
+        self._serving = True
+        self.server.serve_forever()
+
+    def start(self):
+        """ Serve on a background thread. """
+        self._serving = True
+        threading.Thread(target=self.server.serve_forever, name='LinkerService', daemon=True).start()
+        return self
+
+    def shutdown(self):
+        # shutdown() waits for serve_forever() to return, it would block if it was never called
+        if self._serving:
+            self.server.shutdown()
+        self.server.server_close()
+
+
+class LinkerClient(object):
+    """ Client of a LinkerService, keeps one connection per thread. """
+
+    def __init__(self, url, timeout=0.5):
+        address = urlparse(url)
+        self.host = address.hostname
+        self.port = address.port
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def _connection(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+            self._local.connection = connection
+        return connection
+
+    def link(self, model_name, texts, max_tokens=50):
+        """ Returns the list of (linked name, probability) of the given texts, raise an exception on failure. """
+        body = json.dumps({'model': model_name, 'texts': list(texts), 'max_tokens': max_tokens})
+        connection = self._connection()
+        try:
+            connection.request('POST', '/link', body=body, headers={'Content-Type': 'application/json'})
+            response = connection.getresponse()
+            content = json.loads(response.read().decode('utf-8'))
+        except Exception:
+            # the connection may be half closed, a new one is made by the next call
+            connection.close()
+            self._local.connection = None
+            raise
+
+        if response.status != 200:
+            raise RuntimeError(f'linker service error {response.status}: {content.get("error")}')
+        return [(name, probability) for name, probability in content['results']]
+
+
+class RemoteModel(object):
+    """
+    Stand-in for a gazetteer model, linking through a LinkerService.
+
+    When the service fails, the model is loaded in the process (once) and used for the next retry_interval seconds.
+    """
+
+    def __init__(self, client, model_name, load_local_model, retry_interval=30):
+        """
+        Arguments
+            client - LinkerClient
+            model_name - string, the model name known by the service (ex: 'cities')
+            load_local_model - function without argument returning (model, embedding), the in-process fallback
+            retry_interval - float, number of seconds before trying the service again after a failure
+        """
+        self.client = client
+        self.model_name = model_name
+        self.load_local_model = load_local_model
+        self.retry_interval = retry_interval
+
+        self._local_model = None
+        self._lock = threading.Lock()
+        self._retry_time = 0
+
+    def link(self, text, max_tokens=50):
+        """ Returns (linked name, probability), None if the service is not available. """
+        if time.monotonic() < self._retry_time:
+            return None
+        try:
+            return self.client.link(self.model_name, [text], max_tokens)[0]
+        except Exception as e:
+            logger.warning(f'*** linker service failed for {self.model_name} ({e!r}), '
+                           f'using the in-process model for {self.retry_interval}s ***')
+            self._retry_time = time.monotonic() + self.retry_interval
+            return None
+
+    def local_model(self):
+        """ Returns the in-process (model, embedding), loaded on the first call. """
+        with self._lock:
+            if self._local_model is None:
+                self._local_model = self.load_local_model()
+            return self._local_model
+
+
+def top_linker(predict_batch, labels):
+    """ Returns a linker function: texts --> list of (most probable label, probability) given log probabilities. """
+    def linker(texts, max_tokens=50):
+        log_probs = predict_batch(texts, max_tokens)
+        results = []
+        for text_log_probs in log_probs:
+            best = int(text_log_probs.argmax())
+            results.append((labels[best], math.exp(float(text_log_probs[best]))))
+        return results
+    return linker
+
+
+def load_predictors(names, runtime='numpy', models_dir='./models', data_dir='./data', shared_model=None):
+    """
+    Returns a dict: model name -> (predict function (texts, max_tokens) -> log probabilities numpy array, labels).
+    """
+    if runtime == 'numpy':
+        from .numpy_predict import load_model
+        if shared_model:
+            model = load_model(os.path.join(models_dir, f'{shared_model}.fofe'))
+            models = {name: model.head(name) for name in names}
+        else:
+            models = {name: load_model(os.path.join(models_dir, f'{name}.fofe')) for name in names}
+        return {name: (model.predict, model.labels) for name, model in models.items()}
+
+    from . import predict
+    from .export import load_labels
+
+    def predict_function(model, embedding):
+        return lambda texts, max_tokens: predict.predict_batch(model, embedding, texts, max_tokens).cpu().numpy()
+
+    if shared_model:
+        model, embedding = predict.load_artifact(os.path.join(models_dir, f'{shared_model}.fofe'))
+        predictor = predict.MultiHeadPredictor(model, embedding)
+        predict_functions = {name: predict_function(predictor.head(name), embedding) for name in names}
+    else:
+        predict_functions = {}
+        for name in names:
+            model, embedding = predict.load_models(os.path.join(models_dir, f'{name}.pth'),
+                                                   os.path.join(data_dir, f'{name}_embedding.pth'),
+                                                   os.path.join(data_dir, f'{name}_vocab.pickle'),
+                                                   folded=True)
+            predict_functions[name] = predict_function(model, embedding)
+
+    return {name: (predict_functions[name], load_labels(os.path.join(data_dir, f'{name}_training_labels.pickle')))
+            for name in names}
+
+
+def load_linkers(names, runtime='numpy', models_dir='./models', data_dir='./data', shared_model=None):
+    """ Returns a dict: model name -> linker function, for LinkerService. """
+    return {name: top_linker(predict_batch, labels)
+            for name, (predict_batch, labels) in load_predictors(names, runtime, models_dir, data_dir,
+                                                                 shared_model).items()}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser('Entity linking service, shared by the NLU processes of a host')
+    parser.add_argument('--names', type=str, default='cities,metro,quartiers,streets_montreal')
+    parser.add_argument('--runtime', type=str, choices=['torch', 'numpy'], default='numpy')
+    parser.add_argument('--shared_model', type=str, default=None, help='name of a multi-head model')
+    parser.add_argument('--models_dir', type=str, default='./models')
+    parser.add_argument('--data_dir', type=str, default='./data')
+    parser.add_argument('--host', type=str, default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--max_batch_size', type=int, default=32)
+    parser.add_argument('--max_wait_ms', type=float, default=5)
+
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    linkers = load_linkers(args.names.split(','), args.runtime, args.models_dir, args.data_dir, args.shared_model)
+
+    # warm-up, so the first requests do not pay the runtime lazy initialization
+    for linker in linkers.values():
+        linker(['montreal', 'berri uqam'], 50)
+
+    service = LinkerService(linkers, args.host, args.port, args.max_batch_size, args.max_wait_ms / 1000)
+    print(f'entity linking service on {service.url}, models {list(linkers)}')
+    service.serve_forever()
@@ -0,0 +1,65 @@
+import os
+import tempfile
+import unittest
+
+import numpy as np
+
+from fofe_entity_linking.artifact import ALIGNMENT, read_artifact, read_header, write_artifact
+
+
+class TestArtifact(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.filename = os.path.join(self.directory.name, "test.fofe")
+
+        self.arrays = {
+            'table': np.arange(12, dtype=np.float32).reshape(3, 4),
+            'bias': np.array([0.5, -1.0, 2.0], dtype=np.float32),
+            'indices': np.array([1, 2, 3], dtype=np.int64),
+        }
+        self.metadata = {'name': 'test', 'vocab': ['##', '#v', 'é#'], 'hyperparameters': {'epochs': 2}}
+        write_artifact(self.filename, self.arrays, self.metadata)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_read_artifact(self):
+        header, arrays = read_artifact(self.filename)
+
+        self.assertEqual(['##', '#v', 'é#'], header['vocab'])
+        self.assertEqual({'epochs': 2}, header['hyperparameters'])
+        for name, array in self.arrays.items():
+            self.assertEqual(array.dtype, arrays[name].dtype)
+            self.assertTrue(np.array_equal(array, arrays[name]))
+            self.assertEqual(0, header['arrays'][name]['offset'] % ALIGNMENT)
+            self.assertFalse(arrays[name].flags.writeable)
+
+    def test_read_header(self):
+        header = read_header(self.filename)
+
+        self.assertEqual('test', header['name'])
+        self.assertEqual([3, 4], header['arrays']['table']['shape'])
+
+    def test_corrupted_artifact(self):
+        with open(self.filename, 'r+b') as artifact_file:
+            artifact_file.seek(-1, os.SEEK_END)
+            artifact_file.write(b'\xff')
+
+        with self.assertRaises(ValueError):
+            read_artifact(self.filename)
+
+        # the checksum can be skipped
+        header, arrays = read_artifact(self.filename, verify=False)
+        self.assertEqual(3, len(arrays['indices']))
+
+    def test_not_an_artifact(self):
+        with open(self.filename, 'wb') as artifact_file:
+            artifact_file.write(b'not an artifact file')
+
+        with self.assertRaises(ValueError):
+            read_header(self.filename)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,77 @@
+import json
+import os
+import tempfile
+import unittest
+
+import numpy as np
+
+from fofe_entity_linking.benchmark import (benchmark_models, changes, latency_summary, read_mentions,
+                                           read_rasa_examples, throughput)
+
+
+class TestBenchmark(unittest.TestCase):
+
+    def test_latency_summary(self):
+        summary = latency_summary([i / 1000 for i in range(1, 101)])
+
+        self.assertEqual(100, summary['count'])
+        self.assertAlmostEqual(50.5, summary['p50_ms'])
+        self.assertAlmostEqual(np.percentile(range(1, 101), 99), summary['p99_ms'])
+        self.assertAlmostEqual(100, summary['max_ms'])
+        self.assertEqual({'count': 0}, latency_summary([]))
+
+    def test_throughput(self):
+        batches = []
+        results = throughput(lambda texts, max_tokens: batches.append(len(texts)), ['a'] * 10, [1, 4])
+
+        self.assertEqual(['1', '4'], list(results))
+        # a warm-up batch, then the timed batches
+        self.assertEqual([1] + [1] * 10 + [4, 4, 4, 2], batches)
+
+    def test_read_mentions(self):
+        dataset = {'rasa_nlu_data': {'common_examples': [
+            {'text': 'station berri', 'intent': 'inform',
+             'entities': [{'start': 8, 'end': 13, 'value': 'berri', 'entity': 'metro'}]},
+            {'text': 'rue ontario', 'intent': 'inform',
+             'entities': [{'start': 4, 'end': 11, 'value': 'ontario', 'entity': 'street'}]},
+            {'text': 'bonjour', 'intent': 'greet', 'entities': []},
+        ]}}
+
+        with tempfile.TemporaryDirectory() as directory:
+            with open(os.path.join(directory, 'metro_test_set.csv'), 'w') as f:
+                f.write('EntityMention,EntityName\nviau,0\nvieau,0\nverdun,1\n')
+            with open(os.path.join(directory, 'dataset.json'), 'w') as f:
+                json.dump(dataset, f)
+
+            examples = read_rasa_examples(os.path.join(directory, 'dataset.json'))
+            mentions = read_mentions(directory, examples)
+            sample = read_mentions(directory, examples, max_mentions=2)
+
+        self.assertEqual(2, len(examples))
+        self.assertEqual(['berri', 'verdun', 'viau', 'vieau'], sorted(mentions['metro']))
+        self.assertEqual(['ontario'], mentions['streets_montreal'])
+        self.assertEqual(2, len(sample['metro']))
+
+    def test_benchmark_models(self):
+        predictors = {'metro': (lambda texts, max_tokens: np.zeros((len(texts), 2)), ['a', 'b']),
+                      'cities': (lambda texts, max_tokens: np.zeros((len(texts), 2)), ['c', 'd'])}
+
+        latency, batch_throughput = benchmark_models(predictors, {'metro': ['berri'] * 20}, [1, 8])
+
+        self.assertEqual(['metro'], list(latency))
+        self.assertEqual(20, latency['metro']['count'])
+        self.assertEqual(['1', '8'], list(batch_throughput['metro']))
+
+    def test_changes(self):
+        baseline = {'environment': {'commit': 'a'}, 'stages': {'model': {'metro': {'count': 10, 'p50_ms': 1.0}}},
+                    'throughput': {'metro': {'8': 100.0}}}
+        results = {'environment': {'commit': 'b'}, 'stages': {'model': {'metro': {'count': 10, 'p50_ms': 0.5},
+                                                                        'cities': {'count': 10, 'p50_ms': 0.1}}},
+                   'throughput': {'metro': {'8': 200.0}}}
+
+        self.assertEqual([('stages.model.metro.p50_ms', 1.0, 0.5), ('throughput.metro.8', 100.0, 200.0)],
+                         list(changes(baseline, results)))
+
+
+if __name__ == '__main__':
+    unittest.main()
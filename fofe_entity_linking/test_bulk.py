@@ -0,0 +1,81 @@
+import io
+import os
+import tempfile
+import unittest
+
+import numpy as np
+import torch
+
+from fofe_entity_linking.artifact import write_artifact
+from fofe_entity_linking.bulk import batches, dictionary_link, link_all, load_dictionaries, read_mentions, top_k
+from fofe_entity_linking.embedding import NgramHashing
+from fofe_entity_linking.export import export_artifact
+from fofe_entity_linking.model import FofeNNModel, FoldedFofeNNModel
+from fofe_entity_linking.numpy_predict import load_model
+
+
+class TestBulk(unittest.TestCase):
+
+    def test_read_mentions(self):
+        self.assertEqual([(0, 'verdun'), (1, 'pie ix')], list(read_mentions(io.StringIO('verdun\npie ix\n'))))
+        self.assertEqual([('a', 'verdun'), ('b', 'pie ix')],
+                         list(read_mentions(io.StringIO('id,text\na,verdun\nb,pie ix\n'), 'csv', 'text', 'id')))
+        self.assertEqual([(0, 'verdun'), (1, 'pie ix')],
+                         list(read_mentions(io.StringIO('{"mention": "verdun"}\n\n{"mention": "pie ix"}\n'), 'jsonl')))
+
+    def test_batches(self):
+        self.assertEqual([[0, 1], [2, 3], [4]], list(batches(range(5), 2)))
+
+    def test_top_k(self):
+        log_probs = np.log(np.array([[0.1, 0.6, 0.3], [0.5, 0.2, 0.3]]))
+
+        self.assertEqual([[('b', 0.6), ('c', 0.3)], [('a', 0.5), ('c', 0.3)]], top_k(log_probs, 'abc', 2))
+        self.assertEqual(3, len(top_k(log_probs, 'abc', 10)[0]))
+
+    def test_link_all(self):
+        torch.manual_seed(999)
+        labels = ["Berri-UQAM", "Verdun", "Pie-IX", "Côte-Vertu"]
+        ngram = NgramHashing(2, corpus_text_list=labels)
+        model = FofeNNModel(8, hidden_size=16, dropoutrate=0.25, number_of_classes=4)
+        folded_model = FoldedFofeNNModel(model, torch.rand(len(ngram.vocab), 8), forgetting_factor=0.95)
+        metadata, arrays = export_artifact(folded_model, ngram.vocab, labels, 0.95)
+
+        with tempfile.TemporaryDirectory() as directory:
+            write_artifact(os.path.join(directory, 'metro.fofe'), arrays, metadata)
+            with open(os.path.join(directory, 'metro.csv'), 'w', encoding='utf-8') as gazetteer_file:
+                gazetteer_file.write("Verdun\nPie-IX\n")
+            mentions = [(i, text) for i, text in enumerate(['Verdun ', 'berri', 'Pie-IX', 'Cote  Vertu', 'jarry'] * 3)]
+            initializer_args = (['metro'], 'numpy', directory, directory, None, 1, directory)
+
+            records = list(link_all(iter(mentions), 0, batch_size=4, k=2, initializer_args=initializer_args))
+            pooled_records = list(link_all(iter(mentions), 2, batch_size=4, k=2, initializer_args=initializer_args))
+
+            expected = load_model(os.path.join(directory, 'metro.fofe')).predict(['berri', 'cote vertu', 'jarry'])
+
+        self.assertEqual(records, pooled_records)
+        self.assertEqual(list(range(15)), [record['id'] for record in records])
+        self.assertEqual(['verdun', 'berri', 'pie ix', 'cote vertu', 'jarry'],
+                         [record['input'] for record in records[:5]])
+
+        # the gazetteer names are linked by the exact map, the other mentions by the model
+        self.assertEqual([[('Verdun', 1.0)], [('Pie-IX', 1.0)]], [records[0]['metro'], records[2]['metro']])
+        self.assertEqual([labels[i] for i in expected.argmax(1)],
+                         [records[i]['metro'][0][0] for i in [1, 3, 4]])
+        self.assertEqual(2, len(records[1]['metro']))
+
+    def test_dictionary_link(self):
+        with tempfile.TemporaryDirectory() as directory:
+            with open(os.path.join(directory, 'streets.csv'), 'w', encoding='utf-8') as gazetteer_file:
+                gazetteer_file.write("Boulevard Saint-Laurent\nRue Sainte-Catherine\n")
+            exact_map, no_fuzzy_index = load_dictionaries(['streets'], directory)['streets']
+            _, fuzzy_index = load_dictionaries(['streets'], directory, 2)['streets']
+
+        self.assertIsNone(no_fuzzy_index)
+        self.assertEqual([('Boulevard Saint-Laurent', 1.0)], dictionary_link('boulevard saint laurent', exact_map))
+        self.assertIsNone(dictionary_link('rue sainte catherin', exact_map))
+        self.assertEqual([('Rue Sainte-Catherine', 0.95)],
+                         dictionary_link('rue sainte catherin', exact_map, fuzzy_index))
+
+
+if __name__ == '__main__':
+    unittest.main()
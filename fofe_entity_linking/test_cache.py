@@ -0,0 +1,52 @@
+import time
+import unittest
+
+from fofe_entity_linking.cache import LRUCache
+
+
+class TestLRUCache(unittest.TestCase):
+
+    def test_get_put(self):
+        cache = LRUCache(maxsize=2)
+        cache.put(('metro', 'berri'), ('Berri-UQAM', 0.99))
+
+        self.assertEqual(('Berri-UQAM', 0.99), cache.get(('metro', 'berri')))
+        self.assertIsNone(cache.get(('city', 'berri')))
+
+        stats = cache.stats()
+        self.assertEqual(1, stats['hits'])
+        self.assertEqual(1, stats['misses'])
+        self.assertEqual(0.5, stats['hit_rate'])
+
+    def test_lru_eviction(self):
+        cache = LRUCache(maxsize=2)
+        cache.put('a', 1)
+        cache.put('b', 2)
+
+        # 'a' becomes the most recently used, 'b' is evicted by 'c'
+        cache.get('a')
+        cache.put('c', 3)
+
+        self.assertEqual(2, len(cache))
+        self.assertIn('a', cache)
+        self.assertNotIn('b', cache)
+        self.assertEqual(1, cache.stats()['evictions'])
+
+    def test_ttl(self):
+        cache = LRUCache(maxsize=2, ttl=0.01)
+        cache.put('a', 1)
+        time.sleep(0.02)
+
+        self.assertIsNone(cache.get('a'))
+        self.assertEqual(1, cache.stats()['expirations'])
+
+    def test_clear(self):
+        cache = LRUCache()
+        cache.put('a', 1)
+        cache.clear()
+
+        self.assertEqual(0, len(cache))
+
+
+if __name__ == '__main__':
+    unittest.main()
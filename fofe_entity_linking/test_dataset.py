@@ -1,9 +1,12 @@
 import os
+import pickle
+import shutil
+import tempfile
 import torch
 import unittest
 
-from dataset import FofeDataset
-from embedding import NgramHashing, NgramEmbedding
+from fofe_entity_linking.dataset import FofeDataset, MultiHeadFofeDataset, batch_loader
+from fofe_entity_linking.embedding import NgramHashing, NgramEmbedding
 
 
 class TestDataset(unittest.TestCase):
@@ -111,6 +114,99 @@ class TestDataset(unittest.TestCase):
 
         self.assertEqual(1, y1)
 
+    def test_features(self):
+        # the precomputed encodings are the ones of each sample encoded alone
+        for index, text in enumerate(self.dataset.texts):
+            indices = torch.tensor(self.dataset.sentence_indices(text), dtype=torch.long)
+            expected = torch.zeros(self.vocab_length).index_add_(0, indices,
+                                                                 self.dataset.fofe.position_weights(len(indices)))
+            self.assertTrue(expected.equal(self.dataset.features[index]))
+
+    def test_get_batch(self):
+        x, y = self.dataset[[1, 0]]
+
+        self.assertEqual((2, self.vocab_length), tuple(x.shape))
+        self.assertEqual([1, 0], y.tolist())
+        self.assertTrue(x[1].equal(self.dataset[0][0]))
+
+    def test_batch_loader(self):
+        training_set, _ = torch.utils.data.random_split(self.dataset, [1, 1])
+        batches = list(batch_loader(training_set, batch_size=4, shuffle=True))
+
+        self.assertEqual(1, len(batches))
+        x, y = batches[0]
+        self.assertEqual((1, self.vocab_length), tuple(x.shape))
+        self.assertTrue(x[0].equal(self.dataset[training_set.indices[0]][0]))
+
+        self.assertEqual(2, len(batch_loader(self.dataset, batch_size=1)))
+
+    def test_cache(self):
+        cache_dir = tempfile.mkdtemp()
+        try:
+            dset = FofeDataset("test_dataset.csv", "EntityMention", "EntityClass", "utf-8",
+                               number_of_classes=2, forgetting_factor=0.5, cache_dir=cache_dir)
+            self.assertTrue(os.path.isfile(dset.cache_filename))
+            self.assertEqual([os.path.basename(dset.cache_filename)], os.listdir(cache_dir))
+
+            # same data: the encodings are read from the cache file
+            cached = FofeDataset("test_dataset.csv", "EntityMention", "EntityClass", "utf-8",
+                                 number_of_classes=2, forgetting_factor=0.5, cache_dir=cache_dir)
+            self.assertEqual(dset.cache_filename, cached.cache_filename)
+            self.assertTrue(cached.features.equal(self.dataset.features))
+
+            # the DataLoader workers map the cache file again
+            state = cached.__getstate__()
+            self.assertIsNone(state['features'])
+            self.assertTrue(pickle.loads(pickle.dumps(cached)).features.equal(self.dataset.features))
+
+            # another forgetting factor, another cache file
+            other = FofeDataset("test_dataset.csv", "EntityMention", "EntityClass", "utf-8",
+                                number_of_classes=2, forgetting_factor=0.9, cache_dir=cache_dir)
+            self.assertNotEqual(dset.cache_filename, other.cache_filename)
+        finally:
+            shutil.rmtree(cache_dir)
+
+    def test_multi_head(self):
+        test_bigram = NgramHashing(2, "test_word_hashing.csv")
+        embedding = NgramEmbedding(ngram=test_bigram)
+        embedding.embedding_layer = torch.nn.Embedding(len(test_bigram.vocab), 4)
+
+        dset = MultiHeadFofeDataset([('a', "test_dataset.csv"), ('b', "test_dataset.csv")],
+                                    "EntityMention", "EntityClass", "utf-8", embedding, forgetting_factor=0.5)
+        x, y, heads = dset[[0, 3]]
+
+        self.assertEqual(4, len(dset))
+        self.assertEqual((2, 4), tuple(x.shape))
+        self.assertEqual([0, 1], y.tolist())
+        self.assertEqual([0, 1], heads.tolist())
+        self.assertTrue(x[0].equal(dset.datasets[0].features[0]))
+        self.assertTrue(x[1].equal(dset.datasets[1].features[1]))
+        self.assertTrue(dset[3][0].equal(x[1]))
+
+    def test_multi_head_cache(self):
+        test_bigram = NgramHashing(2, "test_word_hashing.csv")
+        embedding = NgramEmbedding(ngram=test_bigram)
+        embedding.embedding_layer = torch.nn.Embedding(len(test_bigram.vocab), 4)
+
+        cache_dir = tempfile.mkdtemp()
+        try:
+            MultiHeadFofeDataset([('a', "test_dataset.csv")], "EntityMention", "EntityClass", "utf-8", embedding,
+                                 forgetting_factor=0.5, cache_dir=cache_dir)
+            dset = MultiHeadFofeDataset([('a', "test_dataset.csv"), ('b', "test_dataset.csv")],
+                                        "EntityMention", "EntityClass", "utf-8", embedding, forgetting_factor=0.5,
+                                        cache_dir=cache_dir)
+
+            # the heads keep their memory-mapped encodings (numpy storage, not a torch copy), in the workers too
+            workers_dset = pickle.loads(pickle.dumps(dset))
+            for dataset in dset.datasets + workers_dset.datasets:
+                self.assertFalse(dataset.features.untyped_storage().resizable())
+            x, _, heads = workers_dset[[3, 0, 2]]
+            self.assertEqual([1, 0, 1], heads.tolist())
+            self.assertTrue(x[0].equal(dset.datasets[1].features[1]))
+            self.assertTrue(x[2].equal(dset.datasets[1].features[0]))
+        finally:
+            shutil.rmtree(cache_dir)
+
 
 if __name__ == '__main__':
     unittest.main()
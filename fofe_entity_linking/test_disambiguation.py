@@ -0,0 +1,106 @@
+import itertools
+import os
+import re
+import tempfile
+import unittest
+
+from fofe_entity_linking.disambiguation import DisambiguationRules, Rule
+from fofe_entity_linking.keywords import trie_pattern
+
+
+RULES_FILENAME = os.path.join(os.path.dirname(__file__), '..', 'disambiguation.yml')
+
+
+def hard_coded_rules(entity_type, context, confidence):
+    """ the CityMetro rules before disambiguation.yml """
+    selected_entity, disambiguated = entity_type, False
+    if 'métro' in context or 'station' in context:
+        if confidence('metro') > 0.60:
+            selected_entity, disambiguated = 'metro', True
+    if any(keyword in context for keyword in ['rue ', 'rues ', 'avenue', 'ave ', 'levard', 'boul.', 'boul ', 'bld',
+                                              'street', 'road', ' coin', 'rsection']):
+        if confidence('street') > 0.60:
+            selected_entity, disambiguated = 'street', True
+    if not disambiguated and any(keyword in context for keyword in ['quartier', 'dissement', 'secteur']):
+        if confidence('quartier') > 0.60:
+            selected_entity, disambiguated = 'quartier', True
+    if not disambiguated and any(keyword in context for keyword in ['ville', 'village']):
+        if confidence('city') > 0.60:
+            selected_entity, disambiguated = 'city', True
+    if not disambiguated and confidence(selected_entity) < 0.60:
+        if confidence('city') > 0.95:
+            selected_entity = 'city'
+        elif confidence('metro') > 0.95:
+            selected_entity = 'metro'
+        elif confidence('quartier') > 0.95:
+            selected_entity = 'quartier'
+        elif confidence('street') > 0.95:
+            selected_entity = 'quartier'
+    return selected_entity
+
+
+class TestDisambiguation(unittest.TestCase):
+
+    def test_trie_pattern(self):
+        keywords = ['rue ', 'rues ', 'road', 'ave ', 'avenue', 'a']
+        pattern = re.compile('(?=(' + trie_pattern(keywords) + '))')
+
+        # the longest keyword at each position
+        self.assertEqual(['avenue', 'a', 'rues '], [m.group(1) for m in pattern.finditer('avenue la rues ')])
+        self.assertEqual(['a', 'a', 'ave '], [m.group(1) for m in pattern.finditer('avant ave ')])
+        self.assertEqual('', trie_pattern([]))
+
+    def test_matching_rules(self):
+        rules = DisambiguationRules([Rule('street', 'street', ['rue ', 'avenue']), Rule('rue', 'street', ['rue']),
+                                     Rule('city', 'city', ['ville', 'village'])])
+
+        # 'rue' is found inside 'rue ', 'ville' overlaps 'avenue'
+        self.assertEqual(0b011, rules.matching_rules('la rue '))
+        self.assertEqual(0b010, rules.matching_rules('la rue'))
+        self.assertEqual(0b100, rules.matching_rules('grande ville'))
+        self.assertEqual(0, rules.matching_rules('bornes à '))
+
+    def test_select(self):
+        rules = DisambiguationRules([Rule('metro_keyword', 'metro', ['métro'], 0.60),
+                                     Rule('street_keyword', 'street', ['rue '], 0.60, overrides=True),
+                                     Rule('low_confidence_city', 'city', min_confidence=0.95,
+                                          max_selected_confidence=0.60)])
+        asked = []
+
+        def confidence(entity_type):
+            asked.append(entity_type)
+            return {'metro': 0.90, 'street': 0.70, 'city': 0.99, 'quartier': 0.10}[entity_type]
+
+        self.assertEqual(('metro', 'metro_keyword'), rules.select('city', 'au métro ', confidence))
+        self.assertEqual(('street', 'street_keyword'), rules.select('city', 'métro rue ', confidence))
+        self.assertEqual(('city', 'low_confidence_city'), rules.select('quartier', 'dans ', confidence))
+
+        # no keyword: only the low confidence rule asks for confidences
+        asked.clear()
+        self.assertEqual(('metro', None), rules.select('metro', 'dans ', confidence))
+        self.assertEqual(['metro'], asked)
+
+    def test_rules_file(self):
+        rules = DisambiguationRules.load(RULES_FILENAME)
+        contexts = ['bornes au métro ', 'à la station ', 'coin de la rue ', 'au métro sur la rue ', 'le quartier ',
+                    'arrondissement ', 'dans la ville ', 'bornes près de ']
+        levels = [0.10, 0.70, 0.99]
+
+        for context, entity_type in itertools.product(contexts, ['city', 'metro', 'quartier', 'street']):
+            for levels_by_type in itertools.product(levels, repeat=4):
+                confidence = dict(zip(['city', 'metro', 'quartier', 'street'], levels_by_type)).get
+                self.assertEqual(hard_coded_rules(entity_type, context, confidence),
+                                 rules.select(entity_type, context, confidence)[0], (context, levels_by_type))
+
+    def test_load_errors(self):
+        with tempfile.TemporaryDirectory() as directory:
+            filename = os.path.join(directory, 'rules.yml')
+            with open(filename, 'w') as f:
+                f.write('rules:\n  - name: metro\n    entity: metro\n    keyword: [métro]\n')
+
+            with self.assertRaises(ValueError):
+                DisambiguationRules.load(filename)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -4,7 +4,7 @@ import torch
 
 import numpy as np
 
-from embedding import NgramHashing, NgramEmbedding, Fofe
+from fofe_entity_linking.embedding import NgramHashing, NgramEmbedding, Fofe
 
 
 class TestWordHashing(unittest.TestCase):
@@ -61,6 +61,54 @@ class TestWordHashing(unittest.TestCase):
 
         self.assertTrue(expected_fofe_encoding.equal(encoding))
 
+    def test_fofe_sentence_encoding_long_sentence(self):
+        ff = 0.95
+        fofe = Fofe(ff)
+
+        # longer than the initial decay vector and than the old 50 matrices limit
+        sentence = torch.rand(120, 4)
+        expected_encoding = torch.zeros(4)
+        for token in sentence:
+            expected_encoding = ff * expected_encoding + token
+
+        self.assertTrue(torch.allclose(expected_encoding, fofe.encode_sentence(sentence), atol=1e-4))
+
+    def test_fofe_batch_encoding(self):
+        fofe = Fofe(0.5)
+
+        sentences = torch.rand(3, 6, 5)
+        lengths = torch.tensor([6, 2, 4])
+
+        # right padded positions must not contribute to the encoding
+        sentences[1, 2:] = 100.0
+        sentences[2, 4:] = 100.0
+
+        encodings = fofe.encode_batch(sentences, lengths)
+
+        self.assertEqual((3, 5), tuple(encodings.shape))
+        for i, length in enumerate(lengths.tolist()):
+            expected_encoding = fofe.encode_sentence(sentences[i, :length])
+            self.assertTrue(torch.allclose(expected_encoding, encodings[i]))
+
+    def test_fofe_bags_encoding(self):
+        fofe = Fofe(0.95)
+        weight = torch.rand(10, 4)
+
+        sentences = [[1, 2, 3], [4], [5, 6, 7, 8, 9, 0, 1]]
+        indices = torch.tensor([i for sentence in sentences for i in sentence], dtype=torch.long)
+        offsets = torch.tensor([0, 3, 4], dtype=torch.long)
+
+        encodings = fofe.encode_bags(weight, indices, offsets)
+
+        self.assertEqual((3, 4), tuple(encodings.shape))
+        for i, sentence in enumerate(sentences):
+            expected_encoding = fofe.encode_sentence(weight[sentence])
+            self.assertTrue(torch.allclose(expected_encoding, encodings[i]))
+
+    def test_fofe_shared(self):
+        self.assertIs(Fofe.shared(0.95), Fofe.shared(0.95))
+        self.assertIsNot(Fofe.shared(0.95), Fofe.shared(0.5))
+
     def test_vocab_oov(self):
         # test vocab created
         self.assertGreater(len(self.test_trigram.vocab), 0)
@@ -71,6 +119,10 @@ class TestWordHashing(unittest.TestCase):
         self.assertEqual(self.test_trigram.vocab,
                          ['##', '#v', 've', 'er', 'rd', 'du', 'un', 'n#', '#p', 'pi', 'ie', 'e-', '-i', 'ix', 'x#'])
 
+    def test_vocab_min_frequency(self):
+        ngram_hashing = NgramHashing(2, corpus_text_list=["Verdun", "Verdi", "Pie-IX"], min_frequency=2)
+        self.assertEqual(ngram_hashing.vocab, ['##', '#v', 've', 'er', 'rd'])
+
     def test_word_hashing(self):
         self.assertEqual(self.test_trigram.ngram('Verdun'), ['#v', 've', 'er', 'rd', 'du', 'un', 'n#'])
         self.assertEqual(self.test_trigram.ngram('Ver_un'), ['#v', 've', 'er', '##', '##', 'un', 'n#'])
@@ -80,6 +132,18 @@ class TestWordHashing(unittest.TestCase):
     def test_word_hashing_indexes(self):
         self.assertEqual(self.test_trigram.ngram_indexes('Verdun'), [1, 2, 3, 4, 5, 6, 7])
 
+    def test_word_hashing_indexes_oov(self):
+        self.assertEqual(self.test_trigram.ngram_indexes('Ver_un'), [1, 2, 3, 0, 0, 6, 7])
+        self.assertEqual(self.test_trigram.ngram_indexes('Vérdun'), [1, 2, 3, 4, 5, 6, 7])
+
+    def test_word_hashing_index_batch(self):
+        indices, offsets = self.test_trigram.index_batch(['Verdun', 'Pie-IX', 'Verdun'], max_tokens=3)
+
+        self.assertEqual(np.int32, indices.dtype)
+        self.assertEqual([1, 2, 3, 8, 9, 10, 1, 2, 3], indices.tolist())
+        self.assertEqual([0, 3, 6], offsets.tolist())
+        self.assertEqual([1, 2, 3, 4, 5, 6, 7], self.test_trigram.index_array('Verdun').tolist())
+
     def test_embedding_lm_training(self):
         training_sentence = self.test_trigram.ngram('Verdun') + self.test_trigram.ngram('Pie-IX')
 
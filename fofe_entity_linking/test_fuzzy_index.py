@@ -0,0 +1,48 @@
+import unittest
+
+from fofe_entity_linking.fuzzy_index import SymmetricDeleteIndex
+
+
+class TestSymmetricDeleteIndex(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        """ This is called before tests in an individual class are run. """
+        cls.index = SymmetricDeleteIndex({
+            'rosemont': 'Rosemont',
+            'rougemont': 'Rougemont',
+            'berri uqam': 'Berri-UQAM',
+            'verdun': 'Verdun',
+            'verdon': 'Verdon',
+            'laval': 'Laval',
+        })
+
+    def test_edit_distance(self):
+        self.assertEqual(0, SymmetricDeleteIndex.edit_distance('berri', 'berri', 2))
+        self.assertEqual(1, SymmetricDeleteIndex.edit_distance('berri', 'berry', 2))
+        self.assertEqual(1, SymmetricDeleteIndex.edit_distance('berri', 'breri', 2))
+        self.assertEqual(2, SymmetricDeleteIndex.edit_distance('rosemont', 'rosmon', 2))
+        self.assertEqual(3, SymmetricDeleteIndex.edit_distance('rosemont', 'laval', 2))
+
+    def test_lookup(self):
+        self.assertEqual([('rosemont', 'Rosemont', 0)], self.index.lookup('rosemont', 0))
+        self.assertEqual([('rosemont', 'Rosemont', 1)], self.index.lookup('rosemon', 1))
+        self.assertEqual([('rosemont', 'Rosemont', 1), ('rougemont', 'Rougemont', 1)], self.index.lookup('rousemont', 2))
+
+    def test_best_match(self):
+        self.assertEqual(('Rosemont', 1), self.index.best_match('rosemon'))
+        self.assertEqual(('Berri-UQAM', 1), self.index.best_match('berri uqan'))
+        self.assertEqual(('Berri-UQAM', 2), self.index.best_match('beri uqan'))
+
+    def test_best_match_ambiguous(self):
+        # at distance 1 of both 'verdun' and 'verdon'
+        self.assertIsNone(self.index.best_match('verdin'))
+
+    def test_best_match_short_name(self):
+        # no typo allowed on names shorter than 4 chars
+        self.assertIsNone(self.index.best_match('lav'))
+        self.assertIsNone(self.index.best_match('xyzxyzxyz'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,54 @@
+import unittest
+
+from fofe_entity_linking.gazetteer_scanner import GazetteerScanner, evaluate, tokenize
+
+
+class TestGazetteerScanner(unittest.TestCase):
+
+    def setUp(self):
+        self.scanner = GazetteerScanner({
+            'city': ['Longueuil', 'Sherbrooke', 'Saint-Jean-sur-Richelieu'],
+            'metro': ['Berri-UQAM', 'Sherbrooke', 'Parc'],
+            'street': ['Rue Saint-Denis', 'Saint-Denis', 'Boulevard'],
+        }, entity_types=['metro', 'city', 'street'], excluded_names=['boulevard'])
+
+    def test_tokenize(self):
+        self.assertEqual([(0, 2, 'saint'), (3, 7, 'jean'), (8, 11, 'sainte')], tokenize("St-Jean Ste"))
+        self.assertEqual([(0, 8, 'montreal')], tokenize("Montréal"))
+
+    def test_scan(self):
+        text = "bornes au métro berri uqam et rue St-Denis à Longueuil?"
+        entities = self.scanner.scan(text)
+
+        self.assertEqual([('berri uqam', 'metro'), ('rue St-Denis', 'street'), ('Longueuil', 'city')],
+                         [(e['value'], e['entity']) for e in entities])
+        for entity in entities:
+            self.assertEqual(entity['value'], text[entity['start']:entity['end']])
+            self.assertEqual(1.0, entity['confidence'])
+
+    def test_longest_name(self):
+        self.assertEqual(['Saint-Jean-sur-Richelieu'],
+                         [e['value'] for e in self.scanner.scan("à Saint-Jean-sur-Richelieu")])
+        self.assertEqual(['saint denis'], [e['value'] for e in self.scanner.scan("saint denis")])
+
+    def test_entity_types_order(self):
+        self.assertEqual(['metro'], [e['entity'] for e in self.scanner.scan("Sherbrooke")])
+
+    def test_not_found(self):
+        self.assertEqual([], self.scanner.scan(""))
+        self.assertEqual([], self.scanner.scan("au boulevard de la rue"))
+        # the tokens of a name are not separated by other punctuation
+        self.assertEqual([], self.scanner.scan("berri, uqam"))
+        self.assertEqual([], self.scanner.scan("parcours"))
+
+    def test_evaluate(self):
+        examples = [("au métro Parc", [{'start': 9, 'end': 13, 'entity': 'metro'}]),
+                    ("Longueuil et Laval", [{'start': 0, 'end': 9, 'entity': 'metro'},
+                                            {'start': 13, 'end': 18, 'entity': 'city'}])]
+
+        self.assertEqual({'precision': 1.0, 'recall': 2 / 3, 'type_accuracy': 0.5},
+                         evaluate(self.scanner, examples))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,134 @@
+import argparse
+import os
+import pickle
+import tempfile
+import unittest
+
+import pandas as pd
+import torch
+
+from fofe_entity_linking.embedding import NgramHashing
+from fofe_entity_linking.incremental import (REMOVED_LABEL_BIAS, extend_embedding, extend_model, extend_vocab,
+                                             gazetteer_changes, labels_weight, merge_samples, replay_samples, update)
+from fofe_entity_linking.model import FofeNNModel
+
+
+class TestIncremental(unittest.TestCase):
+
+    def test_gazetteer_changes(self):
+        labels, new_labels, removed_labels = gazetteer_changes(
+            ["Verdun", "Pie-IX", "Jarry"], [1.0, 0.5, 0.0], ["Verdun", "Jarry", "Snowdon", "Snowdon"])
+
+        # the old indexes are kept, Jarry was removed before and is back
+        self.assertEqual(["Verdun", "Pie-IX", "Jarry", "Snowdon"], labels)
+        self.assertEqual(["Jarry", "Snowdon"], new_labels)
+        self.assertEqual(["Pie-IX"], removed_labels)
+
+    def test_same_update_twice(self):
+        # Pie-IX removed by the first update (weight 0), the gazetteer did not change since
+        labels, new_labels, removed_labels = gazetteer_changes(
+            ["Verdun", "Pie-IX", "Jarry"], [1.0, 0.0, 1.0], ["Verdun", "Jarry"])
+
+        self.assertEqual(["Verdun", "Pie-IX", "Jarry"], labels)
+        self.assertEqual([], new_labels)
+        self.assertEqual([], removed_labels)
+
+        with tempfile.TemporaryDirectory() as directory:
+            with open(os.path.join(directory, 'metro_training_labels.pickle'), 'wb') as labels_file:
+                pickle.dump([labels, {label: i for i, label in enumerate(labels)}, [1.0, 0.0, 1.0]], labels_file)
+            gazetteer_filename = os.path.join(directory, 'metro.csv')
+            with open(gazetteer_filename, 'w') as gazetteer_file:
+                gazetteer_file.write("Verdun\nJarry\n")
+
+            # no fine-tuning: the model files are not even read
+            args = argparse.Namespace(name='metro', gazetteer=gazetteer_filename, data_dir=directory,
+                                      models_dir=directory)
+            self.assertIsNone(update(args))
+
+    def test_merge_samples(self):
+        old_samples = pd.DataFrame({'EntityMention': ['verdun', 'pie ix', 'pie', 'jarry'],
+                                    'EntityName': [0, 1, 1, 2]})
+        new_samples = pd.DataFrame({'EntityMention': ['snowdon', 'pie', 'jarry'], 'EntityName': [3, 3, 2]})
+
+        samples = merge_samples(old_samples, new_samples, [2, 3], [0], 'EntityMention', 'EntityName')
+
+        # 'pie' is ambiguous, the old 'jarry' sample is replaced by the new one
+        self.assertEqual([('pie ix', 1), ('snowdon', 3), ('jarry', 2)],
+                         list(zip(samples['EntityMention'], samples['EntityName'])))
+        self.assertEqual([0.0, 1.0, 1.0, 0.5], labels_weight([1, 2, 3, 3], 4))
+
+    def test_replay_samples(self):
+        samples = pd.DataFrame({'EntityMention': [f'mention {i}' for i in range(30)],
+                                'EntityName': [i % 3 for i in range(30)]})
+
+        replay = replay_samples(samples, [2], 4, 'EntityName')
+
+        self.assertEqual([4, 4], replay.groupby('EntityName').size().tolist())
+
+    def test_extend_vocab_and_embedding(self):
+        ngram = NgramHashing(2, corpus_text_list=["Verdun", "Pie-IX"])
+        weight = torch.rand(len(ngram.vocab), 4)
+
+        extended = extend_vocab(ngram, ["verdun", "verdy", "v_rdy"])
+        self.assertEqual(ngram.vocab + ['dy', 'y#'], extended.vocab)
+
+        extended_weight = extend_embedding(weight, ngram.vocab, extended.vocab)
+        self.assertTrue(torch.equal(weight, extended_weight[:len(ngram.vocab)]))
+        # 'dy' from 'd?' ('du') and '?y' (none), 'y#' from 'y?' (none) and '?#' ('n#', 'x#')
+        self.assertTrue(torch.allclose(weight[ngram.ngram2idx['du']], extended_weight[-2]))
+        self.assertTrue(torch.allclose(weight[[ngram.ngram2idx['n#'], ngram.ngram2idx['x#']]].mean(0),
+                                       extended_weight[-1]))
+
+    def test_extend_model(self):
+        torch.manual_seed(999)
+        model = FofeNNModel(8, hidden_size=16, dropoutrate=0.25, number_of_classes=3)
+        model.eval()
+
+        extended = extend_model(model.state_dict(), 8, 5, 0.25)
+        extended.eval()
+
+        inputs = torch.rand(10, 8)
+        with torch.no_grad():
+            expected = model(inputs).argmax(1)
+            predicted = extended(inputs).argmax(1)
+
+        self.assertEqual(5, extended.fc2.out_features)
+        self.assertTrue(torch.equal(expected, predicted))
+
+    def test_extend_model_after_removal(self):
+        torch.manual_seed(999)
+        centers = torch.eye(8)[:4] * 4
+        inputs = torch.cat([centers[label] + 0.1 * torch.randn(20, 8) for label in range(4)])
+        targets = torch.arange(4).repeat_interleave(20)
+
+        def fit(model, samples, steps):
+            optimizer = torch.optim.Adam(model.parameters(), lr=0.01)
+            model.train()
+            for _ in range(steps):
+                optimizer.zero_grad()
+                loss = torch.nn.functional.nll_loss(model(inputs[samples]), targets[samples])
+                loss.backward()
+                optimizer.step()
+            model.eval()
+
+        # trained on labels 0, 1 and 2, then an update removed label 2
+        model = FofeNNModel(8, hidden_size=16, dropoutrate=0.25, number_of_classes=3)
+        fit(model, targets < 3, 200)
+        with torch.no_grad():
+            model.fc2.bias[2] = REMOVED_LABEL_BIAS
+
+        # the next update adds label 2 back and a new label 3
+        extended = extend_model(model.state_dict(), 8, 4, 0.25, [1.0, 1.0, 0.0], [2, 3])
+
+        in_use_bias = model.fc2.bias[:2].min().item()
+        self.assertEqual([in_use_bias] * 2, extended.fc2.bias[2:].tolist())
+
+        fit(extended, torch.ones(len(targets), dtype=torch.bool), 50)
+        with torch.no_grad():
+            predicted = extended(inputs).argmax(1)
+
+        self.assertTrue(torch.equal(targets, predicted))
+
+
+if __name__ == '__main__':
+    unittest.main()
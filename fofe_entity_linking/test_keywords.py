@@ -0,0 +1,62 @@
+import json
+import os
+import tempfile
+import unittest
+
+from fofe_entity_linking.keywords import KeywordReplacer, read_replacements, sequential_replace
+
+
+class TestKeywords(unittest.TestCase):
+
+    def test_replace(self):
+        replacer = KeywordReplacer([(' metro ', ' métro '), (' pres ', ' près '), ('st', 'saint'), ('ste', 'sainte'),
+                                    ('a', 'b'), ('b', 'c'), ('st', 'street')])
+
+        self.assertEqual(6, len(replacer))
+        # a space between two keywords is used by both
+        self.assertEqual(' le métro près de ', replacer.replace(' le metro pres de '))
+        self.assertEqual(' prendre le metro', replacer.replace(' prendre le metro'))
+        # the longest keyword, the first replacement of a keyword, the replacements are not replaced again
+        self.assertEqual('sainte saint', replacer.replace('ste st'))
+        self.assertEqual('bc', replacer.replace('ab'))
+        self.assertEqual('texte', KeywordReplacer([]).replace('texte'))
+
+    def test_same_as_sequential_replace(self):
+        replacements = [(' metro ', ' métro '), (' pres ', ' près '), (' boul ', ' boulevard '), (' st ', ' saint ')]
+        replacer = KeywordReplacer(replacements)
+
+        for text in [' bornes au metro pres de la station ', ' metro  pres ', ' boul st laurent ', ' ste foy ']:
+            self.assertEqual(sequential_replace(replacements, text), replacer.replace(text))
+
+    def test_different_from_sequential_replace(self):
+        # the documented differences, on overlapping or chained keywords
+        for replacements, text, expected, sequential in [
+                ([('a', 'b'), ('b', 'c')], 'ab', 'bc', 'cc'),
+                ([('boul', 'boulevard'), ('boul.', 'boulevard')], 'boul. st', 'boulevard st', 'boulevard. st'),
+                ([(' metro ', ' métro ')], ' metro metro ', ' métro métro ', ' métro metro ')]:
+            self.assertEqual(expected, KeywordReplacer(replacements).replace(text))
+            self.assertEqual(sequential, sequential_replace(replacements, text))
+
+    def test_same_as_sequential_replace_on_training_messages(self):
+        # the keywords file and the training messages of the bot
+        root = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+        replacements = read_replacements(os.path.join(root, 'normalization.yml'))
+        with open(os.path.join(root, 'data', 'rasa_dataset_training.json'), encoding='utf-8') as f:
+            texts = [example['text'] for example in json.load(f)['rasa_nlu_data']['common_examples']]
+        replacer = KeywordReplacer(replacements)
+
+        self.assertGreater(len(texts), 1000)
+        for text in texts:
+            self.assertEqual(sequential_replace(replacements, text), replacer.replace(text))
+
+    def test_read_replacements(self):
+        with tempfile.TemporaryDirectory() as directory:
+            filename = os.path.join(directory, 'normalization.yml')
+            with open(filename, 'w', encoding='utf-8') as f:
+                f.write('# comment\n_metro_: _métro_\n_pres_: _près_\n')
+
+            self.assertEqual([(' metro ', ' métro '), (' pres ', ' près ')], read_replacements(filename))
+
+
+if __name__ == '__main__':
+    unittest.main()
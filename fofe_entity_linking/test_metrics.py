@@ -0,0 +1,50 @@
+import unittest
+
+from fofe_entity_linking.metrics import Registry, format_labels
+
+
+class TestMetrics(unittest.TestCase):
+
+    def test_counter(self):
+        registry = Registry()
+        counter = registry.counter('linked_total', 'Linked mentions', ['entity_type', 'source'])
+        counter.inc(entity_type='metro', source='model')
+        counter.inc(2, entity_type='metro', source='model')
+        counter.inc(entity_type='city', source='exact_map')
+
+        self.assertEqual(3, counter.value(entity_type='metro', source='model'))
+        self.assertIs(counter, registry.counter('linked_total', 'Linked mentions', ['entity_type', 'source']))
+        self.assertEqual('# HELP linked_total Linked mentions\n'
+                         '# TYPE linked_total counter\n'
+                         'linked_total{entity_type="city",source="exact_map"} 1\n'
+                         'linked_total{entity_type="metro",source="model"} 3\n', registry.exposition())
+
+        with self.assertRaises(ValueError):
+            registry.histogram('linked_total', 'Linked mentions')
+
+    def test_histogram(self):
+        registry = Registry()
+        histogram = registry.histogram('duration_seconds', 'Duration', ['stage'], buckets=[0.001, 0.01])
+        for value in [0.0005, 0.001, 0.005, 0.5]:
+            histogram.observe(value, stage='keywords')
+
+        self.assertEqual(4, histogram.count(stage='keywords'))
+        self.assertEqual(0, histogram.count(stage='link'))
+        self.assertEqual('# HELP duration_seconds Duration\n'
+                         '# TYPE duration_seconds histogram\n'
+                         'duration_seconds_bucket{stage="keywords",le="0.001"} 2\n'
+                         'duration_seconds_bucket{stage="keywords",le="0.01"} 3\n'
+                         'duration_seconds_bucket{stage="keywords",le="+Inf"} 4\n'
+                         'duration_seconds_sum{stage="keywords"} 0.5065\n'
+                         'duration_seconds_count{stage="keywords"} 4\n', registry.exposition())
+
+        registry.clear()
+        self.assertEqual(0, histogram.count(stage='keywords'))
+
+    def test_format_labels(self):
+        self.assertEqual('', format_labels([]))
+        self.assertEqual(r'{value="rue \"st\\denis\"\n"}', format_labels([('value', 'rue "st\\denis"\n')]))
+
+
+if __name__ == '__main__':
+    unittest.main()
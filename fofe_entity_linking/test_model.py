@@ -0,0 +1,103 @@
+import unittest
+import torch
+import torch.nn as nn
+
+from fofe_entity_linking.embedding import Fofe
+from fofe_entity_linking.export import export_artifact
+from fofe_entity_linking.model import FofeNNModel, FoldedFofeNNModel, MultiHeadFofeNNModel
+
+
+class TestModel(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        """ This is called before tests in an individual class are run. """
+        torch.manual_seed(999)
+
+        cls.vocab_size = 20
+        cls.embedding_dim = 8
+        cls.embedding_weight = torch.rand(cls.vocab_size, cls.embedding_dim)
+
+        cls.model = FofeNNModel(cls.embedding_dim, hidden_size=32, dropoutrate=0.25, number_of_classes=5)
+        cls.model.eval()
+
+        # 3 mentions as flat n-gram indices and start offsets
+        cls.sentences = [[1, 2, 3, 4], [5, 6], [7, 8, 9, 10, 11, 12, 0]]
+        cls.indices = torch.tensor([i for sentence in cls.sentences for i in sentence], dtype=torch.long)
+        cls.offsets = torch.tensor([0, 4, 6], dtype=torch.long)
+
+    def test_folded_model_same_predictions(self):
+        fofe = Fofe(0.95)
+        fofe_input = fofe.encode_bags(self.embedding_weight, self.indices, self.offsets)
+
+        folded_model = FoldedFofeNNModel(self.model, self.embedding_weight, forgetting_factor=0.95)
+        folded_model.eval()
+
+        with torch.no_grad():
+            expected_log_probs = self.model(fofe_input)
+            folded_log_probs = folded_model(self.indices, self.offsets)
+
+        self.assertEqual((3, 5), tuple(folded_log_probs.shape))
+        self.assertTrue(torch.allclose(expected_log_probs, folded_log_probs, atol=1e-5))
+
+    def test_folded_model_hidden_table(self):
+        folded_model = FoldedFofeNNModel(self.model, self.embedding_weight)
+
+        self.assertEqual((self.vocab_size, 32), tuple(folded_model.hidden_table.shape))
+        self.assertFalse(folded_model.hidden_table.requires_grad)
+
+
+    def test_multi_head_model(self):
+        model = MultiHeadFofeNNModel(self.embedding_dim, hidden_size=32, dropoutrate=0.25,
+                                     head_classes=[('cities', 5), ('metro', 3)])
+        model.eval()
+
+        fofe_input = Fofe(0.95).encode_bags(self.embedding_weight, self.indices, self.offsets)
+        with torch.no_grad():
+            log_probs = model(fofe_input)
+
+        self.assertEqual(['cities', 'metro'], list(log_probs))
+        self.assertEqual((3, 5), tuple(log_probs['cities'].shape))
+        self.assertEqual((3, 3), tuple(log_probs['metro'].shape))
+
+        # folded version gives the same distributions for every head
+        folded_model = FoldedFofeNNModel(model, self.embedding_weight, forgetting_factor=0.95)
+        with torch.no_grad():
+            folded_log_probs = folded_model(self.indices, self.offsets)
+
+        for name in ['cities', 'metro']:
+            self.assertTrue(torch.allclose(log_probs[name], folded_log_probs[name], atol=1e-5))
+
+    def test_folded_model_from_arrays(self):
+        folded_model = FoldedFofeNNModel(self.model, self.embedding_weight, forgetting_factor=0.95)
+        vocab = ['##'] + [f'#{i}' for i in range(1, self.vocab_size)]
+        header, arrays = export_artifact(folded_model, vocab, [f'label {i}' for i in range(5)], 0.95)
+
+        shared_model = FoldedFofeNNModel.from_arrays(header, arrays)
+        with torch.no_grad():
+            expected_log_probs = folded_model(self.indices, self.offsets)
+            shared_log_probs = shared_model(self.indices, self.offsets)
+
+        self.assertTrue(torch.allclose(expected_log_probs, shared_log_probs, atol=1e-6))
+
+        # the tensors use the arrays memory, nothing is copied
+        self.assertEqual(arrays['hidden_table'].ctypes.data, shared_model.hidden_table.data_ptr())
+        self.assertEqual(arrays['fc2_weight'].ctypes.data, shared_model.fc2.weight.data_ptr())
+
+    def test_quantized_folded_model(self):
+        folded_model = FoldedFofeNNModel(self.model, self.embedding_weight, forgetting_factor=0.95)
+        folded_model.eval()
+        with torch.no_grad():
+            expected_log_probs = folded_model(self.indices, self.offsets)
+
+        quantized_model = torch.quantization.quantize_dynamic(folded_model, {nn.Linear}, dtype=torch.qint8)
+        with torch.no_grad():
+            quantized_log_probs = quantized_model(self.indices, self.offsets)
+
+        # the hidden table stays in fp32, only fc2 is int8
+        self.assertIsInstance(quantized_model, FoldedFofeNNModel)
+        self.assertEqual(torch.float32, quantized_model.hidden_table.dtype)
+        self.assertTrue(torch.allclose(expected_log_probs, quantized_log_probs, atol=0.05))
+
+if __name__ == '__main__':
+    unittest.main()
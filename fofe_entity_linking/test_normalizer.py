@@ -0,0 +1,37 @@
+import unittest
+
+import unidecode
+
+from fofe_entity_linking.normalizer import (expand_saint_abbreviation, fold, normalize_mention, normalize_name,
+                                            normalize_text)
+
+
+class TestNormalizer(unittest.TestCase):
+
+    def test_fold(self):
+        for text in ["Côte-Vertu", "Université-de-Montréal", "ŒUVRE Ærø", "東京 Straße", "berri uqam"]:
+            self.assertEqual(unidecode.unidecode(text).lower(), fold(text))
+
+    def test_normalize_text(self):
+        self.assertEqual("l ile bizard  sainte genevieve ", normalize_text("L'Île-Bizard -Sainte-Geneviève "))
+
+    def test_normalize_name(self):
+        self.assertEqual("cote des neiges notre dame de grace",
+                         normalize_name(" Côte-des-Neiges - Notre-Dame-de-Grâce\n"))
+        self.assertEqual("l ile bizard", normalize_name("L'Île--Bizard"))
+
+    def test_expand_saint_abbreviation(self):
+        self.assertEqual("saint-jean-sur-richelieu", expand_saint_abbreviation("St-Jean-sur-Richelieu"))
+        self.assertEqual("sainte foy", expand_saint_abbreviation("ste foy"))
+        self.assertEqual("rue saint denis", expand_saint_abbreviation("rue st denis"))
+        # not an abbreviation
+        self.assertEqual("saint-juste-du-lac", expand_saint_abbreviation("Saint-Juste-du-Lac"))
+        self.assertEqual("ouest-st", expand_saint_abbreviation("ouest-st"))
+
+    def test_normalize_mention(self):
+        self.assertEqual("sainte anne de bellevue", normalize_mention("Ste-Anne-de-Bellevue"))
+        self.assertEqual("saint leonard", normalize_mention("St-Léonard"))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,110 @@
+import os
+import tempfile
+import unittest
+
+import numpy as np
+import torch
+
+from fofe_entity_linking.embedding import NgramHashing
+from fofe_entity_linking.artifact import write_artifact
+from fofe_entity_linking.export import export_artifact
+from fofe_entity_linking.model import FofeNNModel, FoldedFofeNNModel, MultiHeadFofeNNModel
+from fofe_entity_linking.numpy_predict import NumpyFofeModel, load_model
+from fofe_entity_linking.predict import get_ngram_bags
+
+
+class Embedding(object):
+    """ the part of NgramEmbedding used by get_ngram_bags() """
+
+    def __init__(self, ngram):
+        self.ngram = ngram
+
+
+class TestNumpyPredict(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        """ This is called before tests in an individual class are run. """
+        torch.manual_seed(999)
+
+        cls.ngram = NgramHashing(2, corpus_text_list=["Berri-UQAM", "Verdun", "Pie-IX", "Côte-Vertu"])
+        cls.embedding_weight = torch.rand(len(cls.ngram.vocab), 8)
+        cls.texts = ["verdun", "berri uqam", "cote vertu", "pie ix", "montréal", "x" * 80]
+
+    def torch_log_probs(self, model):
+        indices, offsets = get_ngram_bags(Embedding(self.ngram), self.texts, 50)
+        with torch.no_grad():
+            return model(indices, offsets)
+
+    def test_same_predictions_as_torch(self):
+        model = FofeNNModel(8, hidden_size=32, dropoutrate=0.25, number_of_classes=4)
+        folded_model = FoldedFofeNNModel(model, self.embedding_weight, forgetting_factor=0.95)
+        labels = ["Berri-UQAM", "Verdun", "Pie-IX", "Côte-Vertu"]
+
+        numpy_model = NumpyFofeModel(*export_artifact(folded_model, self.ngram.vocab, labels, 0.95))
+
+        expected = self.torch_log_probs(folded_model).numpy()
+        log_probs = numpy_model.predict(self.texts)
+
+        self.assertEqual(expected.shape, log_probs.shape)
+        self.assertTrue(np.allclose(expected, log_probs, atol=1e-5))
+        self.assertEqual(labels, numpy_model.labels)
+        self.assertIsNone(numpy_model.heads)
+
+    def test_dense_same_as_gather(self):
+        model = FofeNNModel(8, hidden_size=32, dropoutrate=0.25, number_of_classes=4)
+        folded_model = FoldedFofeNNModel(model, self.embedding_weight, forgetting_factor=0.95)
+        numpy_model = NumpyFofeModel(*export_artifact(folded_model, self.ngram.vocab, list("abcd"), 0.95))
+        texts = self.texts * 20
+
+        # small chunks: the batch spans several gather chunks and several FOFE matrices
+        numpy_model.gather_chunk_size = 7
+        numpy_model.max_fofe_matrix_size = 10 * len(self.ngram.vocab)
+        numpy_model.dense_min_batch = len(texts) + 1
+        gathered = numpy_model.hidden(texts)
+        numpy_model.dense_min_batch = len(texts)
+        dense = numpy_model.hidden(texts)
+
+        self.assertTrue(np.allclose(gathered, dense, atol=1e-5))
+        self.assertTrue(np.allclose(numpy_model.hidden(self.texts), gathered[:len(self.texts)], atol=1e-5))
+
+    def test_multi_head_same_predictions_as_torch(self):
+        model = MultiHeadFofeNNModel(8, hidden_size=32, dropoutrate=0.25, head_classes=[('cities', 3), ('metro', 2)])
+        folded_model = FoldedFofeNNModel(model, self.embedding_weight, forgetting_factor=0.95)
+        labels = {'cities': ["Montréal", "Verdun", "Laval"], 'metro': ["Berri-UQAM", "Pie-IX"]}
+
+        numpy_model = NumpyFofeModel(*export_artifact(folded_model, self.ngram.vocab, labels, 0.95))
+        expected = self.torch_log_probs(folded_model)
+
+        self.assertEqual(['cities', 'metro'], numpy_model.heads)
+        for name in ['cities', 'metro']:
+            head = numpy_model.head(name)
+            self.assertEqual(labels[name], head.labels)
+            self.assertTrue(np.allclose(expected[name].numpy(), head.predict(self.texts), atol=1e-5))
+
+    def test_save_load(self):
+        model = FofeNNModel(8, hidden_size=16, dropoutrate=0.25, number_of_classes=2)
+        folded_model = FoldedFofeNNModel(model, self.embedding_weight, forgetting_factor=0.5)
+        metadata, arrays = export_artifact(folded_model, self.ngram.vocab, ["Verdun", "Côte-Vertu"], 0.5,
+                                           gazetteers=["Verdun\n", "Côte-Vertu\n"],
+                                           hyperparameters={'epochs': 2})
+
+        with tempfile.TemporaryDirectory() as directory:
+            filename = os.path.join(directory, "test.fofe")
+            write_artifact(filename, arrays, metadata)
+            numpy_model = load_model(filename)
+
+            self.assertEqual(0.5, numpy_model.forgetting_factor)
+            self.assertEqual(["Verdun", "Côte-Vertu"], numpy_model.labels)
+            self.assertEqual(["Verdun\n", "Côte-Vertu\n"], numpy_model.gazetteer)
+            self.assertEqual({'epochs': 2}, numpy_model.header['hyperparameters'])
+            self.assertEqual(self.ngram.vocab, numpy_model.ngram.vocab)
+
+            # the weights stay in the read-only memory map
+            self.assertFalse(numpy_model.hidden_table.flags.writeable)
+            self.assertTrue(np.allclose(NumpyFofeModel(metadata, arrays).predict(self.texts),
+                                        numpy_model.predict(self.texts)))
+
+
+if __name__ == '__main__':
+    unittest.main()
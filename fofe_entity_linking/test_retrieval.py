@@ -0,0 +1,122 @@
+import os
+import tempfile
+import unittest
+
+import numpy as np
+import torch
+
+from fofe_entity_linking.artifact import write_artifact
+from fofe_entity_linking.embedding import NgramHashing
+from fofe_entity_linking.export import export_artifact
+from fofe_entity_linking.model import FofeNNModel, FoldedFofeNNModel
+from fofe_entity_linking.numpy_predict import NumpyFofeModel, load_model
+from fofe_entity_linking.retrieval import BruteForceIndex, IVFIndex, RetrievalLinker, ngram_similarity
+
+
+class TestIndexes(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        """ This is called before tests in an individual class are run. """
+        random = np.random.RandomState(999)
+        cls.vectors = random.randn(500, 16).astype(np.float32)
+        cls.queries = random.randn(20, 16).astype(np.float32)
+
+    def expected_ids(self, k):
+        vectors = self.vectors / np.linalg.norm(self.vectors, axis=1, keepdims=True)
+        return np.argsort(-self.queries.dot(vectors.T), axis=1)[:, :k]
+
+    def test_brute_force(self):
+        scores, ids = BruteForceIndex.build(self.vectors).search(self.queries, 5)
+
+        self.assertEqual(self.expected_ids(5).tolist(), [query_ids.tolist() for query_ids in ids])
+        self.assertTrue(all((np.diff(query_scores) <= 0).all() for query_scores in scores))
+
+    def test_ivf_all_lists_is_exact(self):
+        index = IVFIndex.build(self.vectors, n_lists=10, n_probe=10)
+        _, ids = index.search(self.queries, 5)
+
+        self.assertEqual(10, len(index.centroids))
+        self.assertEqual(len(self.vectors), index.list_offsets[-1])
+        self.assertEqual(self.expected_ids(5).tolist(), [query_ids.tolist() for query_ids in ids])
+
+    def test_ivf_recall(self):
+        _, ids = IVFIndex.build(self.vectors, n_lists=10, n_probe=3).search(self.queries, 1)
+        recall = np.mean([query_ids[0] == expected[0] for query_ids, expected in zip(ids, self.expected_ids(1))])
+
+        self.assertGreater(recall, 0.5)
+
+    def test_ivf_empty_list(self):
+        # the nearest list of the queries is empty: the next non-empty list is probed
+        vectors = self.vectors / np.linalg.norm(self.vectors, axis=1, keepdims=True)
+        centroid = vectors[:5].mean(0)
+        index = IVFIndex(vectors, np.arange(len(vectors)), np.array([centroid, -centroid]) / np.linalg.norm(centroid),
+                         np.array([0, 0, len(vectors)]), n_probe=1)
+        scores, ids = index.search(vectors[:5], 3)
+
+        self.assertEqual([0, 1, 2, 3, 4], [query_ids[0] for query_ids in ids])
+        self.assertEqual([3] * 5, [len(query_scores) for query_scores in scores])
+
+
+class TestRetrievalLinker(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        """ This is called before tests in an individual class are run. """
+        torch.manual_seed(999)
+
+        cls.names = ["Berri-UQAM", "Verdun", "Pie-IX", "Côte-Vertu", "Rosemont", "Laurier", "Jean-Talon", "Snowdon"]
+        ngram = NgramHashing(2, corpus_text_list=cls.names)
+        model = FofeNNModel(8, hidden_size=64, dropoutrate=0.25, number_of_classes=4)
+        folded_model = FoldedFofeNNModel(model, torch.rand(len(ngram.vocab), 8), forgetting_factor=0.95)
+        cls.artifact = export_artifact(folded_model, ngram.vocab, cls.names[:4], 0.95)
+
+    def test_ngram_similarity(self):
+        self.assertEqual(1.0, ngram_similarity('verdun', 'verdun'))
+        self.assertEqual(0.0, ngram_similarity('verdun', 'laval'))
+        self.assertGreater(ngram_similarity('verdun', 'verdum'), ngram_similarity('verdun', 'vertu'))
+
+    def test_link(self):
+        for index, kwargs in [('brute', {}), ('ivf', {'n_lists': 2})]:
+            linker = RetrievalLinker.build(NumpyFofeModel(*self.artifact), self.names, index, dim=4, **kwargs)
+
+            # names the model was not trained on are linked too
+            self.assertEqual(self.names, [name for name, _ in linker.link(self.names)])
+            self.assertEqual('Jean-Talon', linker.link(['jean talon'])[0][0])
+            self.assertEqual(self.names, linker.labels)
+            self.assertEqual(4, linker.embed(['verdun']).shape[1])
+
+    def test_link_without_candidate(self):
+        linker = RetrievalLinker.build(NumpyFofeModel(*self.artifact), self.names, 'ivf', dim=4, n_lists=2)
+        linker.index = IVFIndex(linker.index.vectors[:0], linker.index.ids[:0], linker.index.centroids,
+                                np.zeros(3, dtype=np.int64))
+
+        self.assertEqual([None, None], linker.link(['verdun', 'snowdon']))
+
+    def test_save_load(self):
+        metadata, arrays = self.artifact
+
+        with tempfile.TemporaryDirectory() as directory:
+            model_filename = os.path.join(directory, "metro.fofe")
+            write_artifact(model_filename, arrays, dict(metadata, name='metro'))
+            model = load_model(model_filename)
+
+            linker = RetrievalLinker.build(model, self.names + ["\n"], 'ivf', dim=4, n_lists=2, n_probe=1)
+            index_filename = os.path.join(directory, "metro.index")
+            linker.save(index_filename)
+            loaded = RetrievalLinker.load(index_filename, model)
+
+            self.assertEqual(self.names, loaded.names)
+            self.assertEqual(1, loaded.index.n_probe)
+            self.assertEqual('metro', loaded.header['encoder_name'])
+            self.assertEqual(linker.link(['verdun', 'snowdom']), loaded.link(['verdun', 'snowdom']))
+
+            # the names must be embedded with the same model
+            other_filename = os.path.join(directory, "other.fofe")
+            write_artifact(other_filename, dict(arrays, fc1_bias=arrays['fc1_bias'] + 1), metadata)
+            with self.assertRaises(ValueError):
+                RetrievalLinker.load(index_filename, load_model(other_filename))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,85 @@
+import threading
+import unittest
+
+from fofe_entity_linking.service import LinkerClient, LinkerService, MicroBatcher, RemoteModel
+
+
+def upper_linker(texts, max_tokens=50):
+    return [(text.upper(), 1.0 / (1 + len(text))) for text in texts]
+
+
+class TestMicroBatcher(unittest.TestCase):
+
+    def test_results_per_request(self):
+        batcher = MicroBatcher(lambda texts, max_tokens: [len(text) for text in texts], max_wait=0.001)
+
+        self.assertEqual([10, 6], batcher.submit(['berri uqam', 'verdun']).result(timeout=1))
+        self.assertEqual([], batcher.submit([]).result(timeout=1))
+
+    def test_concurrent_requests_batched(self):
+        batch_sizes = []
+        start = threading.Event()
+
+        def predict_batch(texts, max_tokens):
+            start.wait()
+            batch_sizes.append(len(texts))
+            return [text + '!' for text in texts]
+
+        batcher = MicroBatcher(predict_batch, max_batch_size=8, max_wait=0.05)
+        futures = [batcher.submit([f'text {i}']) for i in range(12)]
+        start.set()
+
+        self.assertEqual([[f'text {i}!'] for i in range(12)], [future.result(timeout=1) for future in futures])
+        # the first request is alone (the model is busy while the others arrive), then full batches
+        self.assertEqual(12, sum(batch_sizes))
+        self.assertLess(len(batch_sizes), 12)
+        self.assertLessEqual(max(batch_sizes), 8 + 1)
+
+    def test_error(self):
+        def predict_batch(texts, max_tokens):
+            raise ValueError('model error')
+
+        batcher = MicroBatcher(predict_batch, max_wait=0.001)
+        with self.assertRaises(ValueError):
+            batcher.submit(['verdun']).result(timeout=1)
+
+
+class TestLinkerService(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        """ This is called before tests in an individual class are run. """
+        cls.service = LinkerService({'metro': upper_linker}, port=0, max_wait=0.001).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.service.shutdown()
+
+    def test_link(self):
+        client = LinkerClient(self.service.url)
+
+        self.assertEqual([('VERDUN', 1 / 7), ('PIE IX', 1 / 7)], client.link('metro', ['verdun', 'pie ix']))
+        # same connection for the next request
+        self.assertEqual([('LIONEL GROULX', 1 / 14)], client.link('metro', ['lionel groulx']))
+
+    def test_unknown_model(self):
+        with self.assertRaises(RuntimeError):
+            LinkerClient(self.service.url).link('cities', ['laval'])
+
+    def test_remote_model(self):
+        model = RemoteModel(LinkerClient(self.service.url), 'metro', lambda: ('local model', None))
+
+        self.assertEqual(('VERDUN', 1 / 7), model.link('verdun'))
+
+    def test_remote_model_fallback(self):
+        # nothing listens on this port
+        service = LinkerService({}, port=0)
+        service.shutdown()
+        model = RemoteModel(LinkerClient(service.url, timeout=0.1), 'metro', lambda: ('local model', None))
+
+        self.assertIsNone(model.link('verdun'))
+        self.assertEqual(('local model', None), model.local_model())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,6 +1,7 @@
 import os
 import shutil
 import argparse
+import json
 import pickle
 
 import torch
@@ -9,13 +10,12 @@ import torch.nn.functional as F
 import numpy as np
 import pandas as pd
 
-from torch.utils.data import DataLoader
 #from tensorboardX import SummaryWriter
 from sklearn import metrics
 from tqdm import tqdm
 
-from .model import FofeNNModel
-from .dataset import FofeDataset
+from .model import FofeNNModel, MultiHeadFofeNNModel
+from .dataset import FofeDataset, MultiHeadFofeDataset, batch_loader
 from .embedding import NgramEmbedding
 
 
@@ -129,9 +129,10 @@ def run_testset(args, model, embedding=None):
                           embedding=embedding,
                           forgetting_factor=args.fofe_forgetting_factor,
                           ngram=args.ngram_size,
-                          max_tokens=args.max_length)
+                          max_tokens=args.max_length,
+                          cache_dir=args.feature_cache_dir)
 
-    test_generator = DataLoader(testset, batch_size=256, shuffle=False, num_workers=args.workers)
+    test_generator = batch_loader(testset, batch_size=256, shuffle=False, num_workers=args.workers)
 
     if torch.cuda.is_available():
         model.cuda()
@@ -174,7 +175,8 @@ def run(args, embedding=None, labels_weight=None):
                                embedding=embedding,
                                forgetting_factor=args.fofe_forgetting_factor,
                                ngram=args.ngram_size,
-                               max_tokens=args.max_length)
+                               max_tokens=args.max_length,
+                               cache_dir=args.feature_cache_dir)
 
     train_size = int(args.validation_split * len(full_dataset))
     validation_size = len(full_dataset) - train_size
@@ -182,8 +184,8 @@ def run(args, embedding=None, labels_weight=None):
     training_set, validation_set = torch.utils.data.random_split(full_dataset, [train_size, validation_size])
 
     # DATASET LOADER
-    training_generator = DataLoader(training_set, **training_params)
-    validation_generator = DataLoader(validation_set, **validation_params)
+    training_generator = batch_loader(training_set, **training_params)
+    validation_generator = batch_loader(validation_set, **validation_params)
 
     if labels_weight:
         labels_weight = torch.tensor(np.array(labels_weight), dtype=torch.float32)
@@ -275,6 +277,184 @@ def run(args, embedding=None, labels_weight=None):
     return bad_predictions, model
 
 
+def save_hyperparameters(args):
+    """ Save the training arguments next to the model, export.py copies them to the artifact header. """
+    if not os.path.exists(args.output):
+        os.makedirs(args.output)
+    with open(os.path.join(args.output, args.model_name + "_hyperparameters.json"), 'w') as output_file:
+        json.dump(vars(args), output_file, indent=2)
+
+
+def multi_head_loss(predictions, labels, heads, criterions):
+    """
+    Returns the loss of a batch mixing samples of several heads:
+    each head loss is computed on its own samples only and weighted by its share of the batch.
+    """
+    loss = 0
+    for head, (name, criterion) in enumerate(criterions.items()):
+        mask = heads == head
+        if mask.any():
+            loss = loss + criterion(predictions[name][mask], labels[mask]) * mask.sum().float() / len(heads)
+    return loss
+
+
+def multi_head_accuracies(predictions, labels, heads, head_names):
+    """ Returns a dict: head name -> (number of good predictions, number of samples) """
+    result = {}
+    for head, name in enumerate(head_names):
+        mask = heads == head
+        predicted = predictions[name][mask].argmax(1)
+        result[name] = ((predicted == labels[mask]).sum().item(), mask.sum().item())
+    return result
+
+
+def run_multi_head_epoch(model, generator, criterions, optimizer=None):
+    """
+    Train (if an optimizer is given) or evaluate the multi-head model for one epoch.
+
+    Arguments
+        criterions - dict: head name -> loss, in the order of the dataset head indexes
+    """
+    model.train() if optimizer else model.eval()
+
+    head_names = list(criterions)
+    losses = []
+    good_predictions = {name: [0, 0] for name in head_names}
+
+    for iter, batch in tqdm(enumerate(generator), total=len(generator)):
+        features, labels, heads = batch
+        if torch.cuda.is_available():
+            features = features.cuda()
+            labels = labels.cuda()
+            heads = heads.cuda()
+
+        if optimizer:
+            optimizer.zero_grad()
+            predictions = model(features)
+            loss = multi_head_loss(predictions, labels, heads, criterions)
+            loss.backward()
+            optimizer.step()
+        else:
+            with torch.no_grad():
+                predictions = model(features)
+                loss = multi_head_loss(predictions, labels, heads, criterions)
+
+        losses.append(loss.item())
+        for name, (good, count) in multi_head_accuracies(predictions, labels, heads, head_names).items():
+            good_predictions[name][0] += good
+            good_predictions[name][1] += count
+
+    accuracies = {name: good / count if count else 0.0 for name, (good, count) in good_predictions.items()}
+    return np.mean(losses), accuracies
+
+
+def run_multi_head(args, embedding, head_labels_weight):
+    """
+    Train a single model with a shared hidden layer and one head per gazetteer,
+    jointly on the training sets of all gazetteers.
+
+    Arguments
+        head_labels_weight - list of (head name, labels weight list)
+    """
+    if not os.path.exists(args.output):
+        os.makedirs(args.output)
+    model_output_filename = os.path.join(args.output, args.model_name + ".pth")
+
+    head_names = [name for name, _ in head_labels_weight]
+
+    # DATASET
+    full_dataset = MultiHeadFofeDataset([(name, os.path.join(args.data_dir, name + "_training_set.csv"))
+                                         for name in head_names],
+                                        args.text_column, args.label_column, args.encoding,
+                                        embedding=embedding,
+                                        forgetting_factor=args.fofe_forgetting_factor,
+                                        max_tokens=args.max_length,
+                                        cache_dir=args.feature_cache_dir)
+
+    train_size = int(args.validation_split * len(full_dataset))
+    validation_size = len(full_dataset) - train_size
+    training_set, validation_set = torch.utils.data.random_split(full_dataset, [train_size, validation_size])
+
+    training_generator = batch_loader(training_set, batch_size=args.batch_size, shuffle=True, num_workers=args.workers)
+    validation_generator = batch_loader(validation_set, batch_size=args.batch_size, shuffle=False, num_workers=args.workers)
+
+    # MODEL
+    model = MultiHeadFofeNNModel(full_dataset.embedding_dim,
+                                 hidden_size=args.hidden_layer_size,
+                                 dropoutrate=args.dropout_rate,
+                                 head_classes=[(name, len(labels_weight)) for name, labels_weight in head_labels_weight])
+
+    # one loss per head, taking care of its classes imbalance
+    criterions = {}
+    for name, labels_weight in head_labels_weight:
+        labels_weight = torch.tensor(np.array(labels_weight), dtype=torch.float32)
+        if torch.cuda.is_available():
+            labels_weight = labels_weight.cuda()
+        criterions[name] = nn.NLLLoss(weight=labels_weight)
+
+    if torch.cuda.is_available():
+        model.cuda()
+
+    if args.optimizer == 'sgd':
+        optimizer = torch.optim.SGD(model.parameters(), lr=args.learning_rate, momentum=0.9)
+    else:
+        optimizer = torch.optim.Adam(model.parameters(), lr=args.learning_rate)
+
+    best_loss = 1e10
+    best_epoch = 0
+
+    # TRAINING LOOP
+    for epoch in range(args.epochs):
+        train_loss, train_accuracies = run_multi_head_epoch(model, training_generator, criterions, optimizer)
+        val_loss, val_accuracies = run_multi_head_epoch(model, validation_generator, criterions)
+
+        print('\n[Epoch: {} / {}]\ttrain_loss: {:.4f} \tval_loss: {:.4f}'.format(epoch + 1, args.epochs, train_loss, val_loss))
+        for name in head_names:
+            print(f'\t{name}\ttrain_acc: {train_accuracies[name]:.4f} \tval_acc: {val_accuracies[name]:.4f}')
+        print("=" * 50)
+
+        # learning rate scheduling
+        if args.schedule != 0 and epoch % args.schedule == 0 and epoch > 0:
+            for param_group in optimizer.param_groups:
+                param_group['lr'] *= 0.20
+            print('Decreasing learning rate to {0}'.format(optimizer.param_groups[0]['lr']))
+
+        if val_loss < best_loss:
+            best_loss = val_loss
+            best_epoch = epoch
+            if args.checkpoint == 1:
+                torch.save(model.state_dict(), model_output_filename)
+
+        # early stopping
+        if epoch - best_epoch > args.patience > 0:
+            print("Stop training at epoch {}. The lowest loss achieved is {} at epoch {}".format(epoch, val_loss, best_epoch))
+            break
+
+    if args.checkpoint == 0:
+        torch.save(model.state_dict(), model_output_filename)
+
+    # TEST - the gazetteers that have a test set
+    test_heads = [name for name in head_names
+                  if os.path.isfile(os.path.join(args.data_dir, name + "_test_set.csv"))]
+    if test_heads:
+        model.load_state_dict(torch.load(model_output_filename))
+        for name in test_heads:
+            testset = MultiHeadFofeDataset([(name, os.path.join(args.data_dir, name + "_test_set.csv"))],
+                                           args.text_column, args.label_column, args.encoding,
+                                           embedding=embedding,
+                                           forgetting_factor=args.fofe_forgetting_factor,
+                                           max_tokens=args.max_length,
+                                           cache_dir=args.feature_cache_dir)
+            test_generator = batch_loader(testset, batch_size=256, shuffle=False, num_workers=args.workers)
+
+            # the test set only has samples of this head (head index 0)
+            test_loss, test_accuracies = run_multi_head_epoch(model, test_generator, {name: criterions[name]})
+
+            print(f'\n{name}\ttest_loss: {test_loss:.4f} \ttest_acc: {test_accuracies[name]:.4f}')
+
+    return model
+
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser('FOFE-based NN for text classification')
 
@@ -300,6 +480,9 @@ if __name__ == "__main__":
     parser.add_argument('--patience', type=int, default=50)
     parser.add_argument('--checkpoint', type=int, choices=[0, 1], default=1)
     parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--feature_cache_dir', type=str, default=None,
+                        help='directory of the FOFE encodings of the datasets, reused by the next trainings '
+                             'of the same data, vocab and forgetting factor')
     parser.add_argument('--log_path', type=str, default='./logs/')
     parser.add_argument('--output', type=str, default='./models/')
     parser.add_argument('--model_name', type=str, default='')
@@ -309,6 +492,12 @@ if __name__ == "__main__":
     parser.add_argument('--dropout_rate', type=float, default=0.50)
     parser.add_argument('--hidden_layer_size', type=int, default=1536)
 
+    # multi-head model: one shared hidden layer, one head per gazetteer.
+    # Reads {data_dir}/{name}_training_set.csv and {data_dir}/{name}_training_labels.pickle for each name.
+    parser.add_argument('--multi_head_names', type=str, default=None,
+                        help='comma separated gazetteer names, ex: cities,metro,quartiers,streets_montreal')
+    parser.add_argument('--data_dir', type=str, default='./data')
+
     # TODO - 2 hidden layers with different size [1024x512]
     # TODO - experimement with various forgetting_factor
 
@@ -320,6 +509,20 @@ if __name__ == "__main__":
         torch.cuda.manual_seed_all(999)
 
     args = parser.parse_args()
+    save_hyperparameters(args)
+
+    if args.multi_head_names:
+        head_labels_weight = []
+        for name in args.multi_head_names.split(','):
+            labels_filename = os.path.join(args.data_dir, name + "_training_labels.pickle")
+            labels, label2idx, labels_weight = pickle.load(open(labels_filename, "rb"))
+            assert len(labels_weight) == len(labels), f"{name} labels weight list do not match labels: {len(labels_weight)} != {len(labels)}"
+            head_labels_weight.append((name, labels_weight))
+
+        embedding = NgramEmbedding(embedding_filename=args.embedding_path, vocab_filename=args.vocab_path)
+
+        run_multi_head(args, embedding, head_labels_weight)
+        exit(0)
 
     # load labels weight to balance the training data
     labels, label2idx, labels_weight = pickle.load(open(args.label_weight_path, "rb"))
@@ -0,0 +1,104 @@
+import argparse
+import multiprocessing
+import os
+
+
+def process_memory():
+    """
+    Returns the memory of the current process in bytes: rss, pss (proportional set size: the shared pages
+    are divided by the number of processes mapping them), shared and private.
+    """
+    memory = {}
+    try:
+        with open('/proc/self/smaps_rollup') as smaps:
+            for line in smaps:
+                fields = line.split()
+                if len(fields) == 3 and fields[2] == 'kB':
+                    memory[fields[0].rstrip(':')] = int(fields[1]) * 1024
+    except OSError:
+        # no smaps_rollup (old kernel or not linux): resident size only
+        with open('/proc/self/statm') as statm:
+            rss = int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+        return {'rss': rss, 'pss': rss, 'shared': 0, 'private': rss}
+
+    return {
+        'rss': memory['Rss'],
+        'pss': memory['Pss'],
+        'shared': memory.get('Shared_Clean', 0) + memory.get('Shared_Dirty', 0),
+        'private': memory.get('Private_Clean', 0) + memory.get('Private_Dirty', 0),
+    }
+
+
+def load_linkers(mode, names, models_dir, data_dir):
+    """ Load the models the way CityMetro does for the given mode and returns a predict function per model. """
+    if mode == 'numpy':
+        from .numpy_predict import load_model
+        models = [load_model(os.path.join(models_dir, f'{name}.fofe')) for name in names]
+        return [lambda text, model=model: model.predict([text]) for model in models]
+
+    from . import predict
+    if mode == 'torch_shared':
+        models = [predict.load_artifact(os.path.join(models_dir, f'{name}.fofe')) for name in names]
+    else:
+        models = [predict.load_models(os.path.join(models_dir, f'{name}.pth'),
+                                      os.path.join(data_dir, f'{name}_embedding.pth'),
+                                      os.path.join(data_dir, f'{name}_vocab.pickle'),
+                                      folded=True)
+                  for name in names]
+    return [lambda text, model=model, embedding=embedding: predict.predict(model, embedding, text)
+            for model, embedding in models]
+
+
+def worker(args, loaded, done, results):
+    if args.num_threads:
+        if args.mode != 'numpy':
+            import torch
+            torch.set_num_threads(args.num_threads)
+
+    linkers = load_linkers(args.mode, args.names.split(','), args.models_dir, args.data_dir)
+    for predict in linkers:
+        for text in ['montreal', 'berri uqam', 'rosemont', 'rue sherbrooke']:
+            predict(text)
+
+    # measure once every worker is loaded, so the shared pages are counted by all of them
+    loaded.wait()
+    results.put(process_memory())
+    done.wait()
+
+
+def measure(args):
+    """ Start args.workers processes loading the linkers, returns the memory of each worker. """
+    context = multiprocessing.get_context('spawn')
+    loaded = context.Barrier(args.workers)
+    done = context.Barrier(args.workers + 1)
+    results = context.Queue()
+
+    processes = [context.Process(target=worker, args=(args, loaded, done, results)) for _ in range(args.workers)]
+    for process in processes:
+        process.start()
+
+    memory = [results.get() for _ in processes]
+    done.wait()
+    for process in processes:
+        process.join()
+
+    return memory
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser('Memory of N worker processes running the entity linking models')
+    parser.add_argument('--mode', type=str, choices=['torch', 'torch_shared', 'numpy'], default='torch',
+                        help='torch: private .pth models, torch_shared and numpy: memory-mapped .fofe artifacts')
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--num_threads', type=int, default=None, help='torch intra-op threads per worker')
+    parser.add_argument('--names', type=str, default='cities,metro,quartiers,streets_montreal')
+    parser.add_argument('--models_dir', type=str, default='./models')
+    parser.add_argument('--data_dir', type=str, default='./data')
+
+    args = parser.parse_args()
+
+    memory = measure(args)
+    for i, worker_memory in enumerate(memory):
+        print(f"worker {i}: rss {worker_memory['rss'] / 2**20:.1f} MB, pss {worker_memory['pss'] / 2**20:.1f} MB, "
+              f"shared {worker_memory['shared'] / 2**20:.1f} MB, private {worker_memory['private'] / 2**20:.1f} MB")
+    print(f"{args.mode}: {args.workers} workers, total pss {sum(m['pss'] for m in memory) / 2**20:.1f} MB")
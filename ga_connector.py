@@ -8,6 +8,9 @@ from rasa.core.channels.channel import UserMessage, OutputChannel
 from rasa.core.channels.channel import InputChannel
 from rasa.core.channels.channel import CollectingOutputChannel
 
+from entity_linking import CityMetro
+from fofe_entity_linking import metrics
+
 logger = logging.getLogger(__name__)
 
 
@@ -29,7 +32,17 @@ class GoogleConnector(InputChannel):
 
         @google_webhook.route("/", methods=['GET'])
         async def health(request):
-            return response.json({"status": "ok"})
+            # only report ok once the entity linking models are loaded and warmed up (or when the pipeline
+            # has no entity linking), so a load balancer does not route messages to an instance still loading
+            entity_linking_status = CityMetro.loading_status()
+            if entity_linking_status in ("ready", "not_applicable"):
+                return response.json({"status": "ok", "entity_linking": entity_linking_status})
+            return response.json({"status": "unavailable", "entity_linking": entity_linking_status}, status=503)
+
+        @google_webhook.route("/metrics", methods=['GET'])
+        async def metrics_exposition(request):
+            # Prometheus scrape target, the NLU components record their metrics with the "metrics" option
+            return response.text(metrics.registry.exposition(), content_type="text/plain; version=0.0.4")
 
         @google_webhook.route("/webhook", methods=['POST'])
         async def receive(request):
@@ -0,0 +1,93 @@
+import logging
+import time
+
+
+from rasa.nlu.extractors import EntityExtractor
+from rasa.nlu.extractors.crf_entity_extractor import CRFEntityExtractor
+
+from fofe_entity_linking.metrics import STAGE_DURATION
+from fofe_entity_linking.gazetteer_scanner import GazetteerScanner
+
+
+logger = logging.getLogger(__name__)
+
+
+class GazetteerExtractor(EntityExtractor):
+    """
+    Find the names of the CityMetro gazetteers (cities, metro, quartiers and streets_montreal) in the message,
+    as city, metro, quartier and street entities linked next by entity_linking.CityMetro.
+
+    The names are matched after normalization (accents, case, dashes, "st" and "ste"), the longest name
+    first, in a single scan of the message (see fofe_entity_linking.gazetteer_scanner).
+
+    Used in place of CRFEntityExtractor, or before gazetteer.CRFEntityExtractorFallback to run the CRF
+    only on the messages without a gazetteer name:
+    - name: "gazetteer.GazetteerExtractor"
+    - name: "gazetteer.CRFEntityExtractorFallback"
+
+    Entity example:
+        {'start': 16, 'end': 25, 'value': 'longueuil', 'entity': 'city', 'confidence': 1.0,
+         'extractor': 'GazetteerExtractor'}
+    """
+
+    name = "GazetteerExtractor"
+
+    provides = ["entities"]
+
+    requires = []
+
+    defaults = {
+        # entity type of the names found in several gazetteers ("Sherbrooke"): the first of this list,
+        # the disambiguation rules of CityMetro then choose from the context
+        "entity_types": ["quartier", "street", "metro", "city"],
+
+        # names never extracted, ex: common words that are also names
+        "excluded_names": ["Boulevard"],
+
+        # True to record the duration of the scan in fofe_entity_linking.metrics (GET /metrics)
+        "metrics": False,
+    }
+
+    language_list = None
+
+    def __init__(self, component_config=None):
+        super(GazetteerExtractor, self).__init__(component_config)
+        self.instrumented = self.component_config.get("metrics", False)
+
+        self.scanner = GazetteerScanner.load(entity_types=self.component_config.get("entity_types"),
+                                             excluded_names=self.component_config.get("excluded_names", ()))
+        logger.info(f"*** gazetteer names: {len(self.scanner)} ***")
+
+    def train(self, training_data, cfg, **kwargs):
+        pass
+
+    def process(self, message, **kwargs):
+        """ Add an entity for each gazetteer name of the message. """
+        start_time = time.perf_counter() if self.instrumented else None
+
+        entities = self.add_extractor_name(self.scanner.scan(message.text))
+        if entities:
+            logger.info(f"*** gazetteer entities: {[(e['value'], e['entity']) for e in entities]} ***")
+        self.append_entities(message, entities)
+
+        if self.instrumented:
+            STAGE_DURATION.observe(time.perf_counter() - start_time, stage="gazetteer")
+
+    def persist(self, file_name, model_dir):
+        """ Persist this component to disk for future loading. """
+        pass
+
+
+class CRFEntityExtractorFallback(CRFEntityExtractor):
+    """
+    CRFEntityExtractor skipped on the messages where GazetteerExtractor already found a gazetteer name:
+    only the messages without an exact name (typos, partial names) pay for the CRF.
+    Trained and persisted as CRFEntityExtractor.
+    """
+
+    name = "CRFEntityExtractorFallback"
+
+    def process(self, message, **kwargs):
+        if any(e.get('extractor') == GazetteerExtractor.name for e in message.get("entities", [])):
+            return
+        super(CRFEntityExtractorFallback, self).process(message, **kwargs)
@@ -1,9 +1,13 @@
 import logging
-import yaml
+import os
+import time
 
 
 from rasa.nlu.components import Component
 
+from fofe_entity_linking.metrics import STAGE_DURATION
+from fofe_entity_linking.keywords import KeywordReplacer, read_replacements
+
 
 logger = logging.getLogger(__name__)
 
@@ -16,6 +20,9 @@ class Keywords(Component):
     The yaml file structure is one keyword per line, '_' to mark space.
     ex:
     _metro_: _métro_
+
+    The keywords are replaced in a single pass over the text (see KeywordReplacer). The file is read again
+    when it changes, checked at most every "reload_check_interval" seconds (0 to never reload).
     """
 
     name = "normalization"
@@ -24,26 +31,68 @@ class Keywords(Component):
 
     requires = []
 
-    defaults = {}
+    defaults = {
+        # yaml file of the keywords to replace
+        "keywords_file": "normalization.yml",
+        # number of seconds between two checks for a changed keywords file, 0 to never reload
+        "reload_check_interval": 10,
+
+        # True to record the duration of the replacements in fofe_entity_linking.metrics (GET /metrics)
+        "metrics": False,
+    }
 
     language_list = None
 
     def __init__(self, component_config=None):
         super(Keywords, self).__init__(component_config)
+        self.instrumented = self.component_config.get("metrics", False)
 
-        self.keywords_list = []
-        # Read keywords to look for. Note that '_' are replaced by empty space.
-        with open('normalization.yml') as file:
-            yaml_dict = yaml.load(file, Loader=yaml.BaseLoader)
-            self.keywords_list = [{'keyword': key.replace('_', ' '), 'replace_by': yaml_dict[key].replace('_', ' ')} for key in yaml_dict]
+        self.keywords_filename = self.component_config.get("keywords_file", "normalization.yml")
+        self.reload_check_interval = self.component_config.get("reload_check_interval", 10)
+        self.reload_last_check = time.monotonic()
 
-        logger.info(f"*** keywords normalization: {len(self.keywords_list)} ***")
+        self.load_keywords()
+
+    def file_signature(self):
+        """ Returns the modification time and size of the keywords file, None if it does not exist. """
+        try:
+            stat = os.stat(self.keywords_filename)
+        except OSError:
+            return None
+        return stat.st_mtime, stat.st_size
+
+    def load_keywords(self):
+        # Read keywords to look for. Note that '_' are replaced by empty space.
+        signature = self.file_signature()
+        replacer = KeywordReplacer(read_replacements(self.keywords_filename))
+
+        # a message being processed keeps the replacer it started with
+        self.keywords_replacer, self.keywords_signature = replacer, signature
+        logger.info(f"*** keywords normalization: {len(replacer)} ***")
+
+    def check_reload(self):
+        """ Load the keywords file again if it changed since the last check, keep the current keywords on error. """
+        if not self.reload_check_interval or time.monotonic() - self.reload_last_check < self.reload_check_interval:
+            return
+
+        self.reload_last_check = time.monotonic()
+        signature = self.file_signature()
+        if signature != self.keywords_signature:
+            logger.info(f"*** {self.keywords_filename} changed, reloading the keywords ***")
+            try:
+                self.load_keywords()
+            except Exception:
+                # tried again when the file changes again
+                self.keywords_signature = signature
+                logger.exception(f"*** {self.keywords_filename} reloading failed, the previous keywords are kept ***")
 
     def train(self, training_data, cfg, **kwargs):
         pass
 
     def process(self, message, **kwargs):
         """ Search for some important keywords and normalize them. """
+        start_time = time.perf_counter() if self.instrumented else None
+        self.check_reload()
         original_text = message.text
 
         # remove "?" character at the end of a message because it could be
@@ -52,12 +101,14 @@ class Keywords(Component):
             message.text = message.text.replace('?', '').rstrip()
 
         # look and replace keywords
-        for item in self.keywords_list:
-            message.text = message.text.replace(item['keyword'], item['replace_by'])
+        message.text = self.keywords_replacer.replace(message.text)
 
         if message.text != original_text:
             logger.info(f"*** text message keywords normalized: <{message.text}> ***")
 
+        if self.instrumented:
+            STAGE_DURATION.observe(time.perf_counter() - start_time, stage="keywords")
+
     def persist(self, file_name, model_dir):
         """ Persist this component to disk for future loading. """
         pass
@@ -0,0 +1,88 @@
+import threading
+import unittest
+
+from rasa.nlu.training_data import Message
+from rasa_sdk import Tracker
+
+from actions import ChargingPlaceForm
+from entity_linking import CityMetro
+from fofe_entity_linking.disambiguation import DisambiguationRules
+from test_entity_linking import numpy_model
+
+
+def linking(value, confidence):
+    return {'value': value, 'confidence': confidence, 'input': 'verdun', 'module': 'entity_linking.CityMetro'}
+
+
+class TestRequestedSlotCorrection(unittest.TestCase):
+    """ ChargingPlaceForm.correct_entity_based_on_requested_slot on the entities linked by CityMetro. """
+
+    def setUp(self):
+        # without __init__: no Neo4J connection
+        self.form = ChargingPlaceForm.__new__(ChargingPlaceForm)
+
+    @staticmethod
+    def tracker(entities, requested_slot='quartier'):
+        return Tracker('test', {'requested_slot': requested_slot}, {'text': 'Verdun', 'entities': entities},
+                       [], False, None, {'name': 'charging_place_form'}, 'action_listen')
+
+    @staticmethod
+    def entity(entity_linking):
+        return {'start': 0, 'end': 6, 'value': 'Verdun', 'entity': 'street', 'confidence': 0.95,
+                'extractor': 'CRFEntityExtractor', 'entity_linking': entity_linking}
+
+    def test_correction(self):
+        entity = self.entity({'city': linking('Verdun', 0.41), 'metro': linking('Verdun', 0.93),
+                              'quartier': linking('Verdun', 0.97), 'street': linking('Rue Verdun', 0.95)})
+        self.form.correct_entity_based_on_requested_slot(self.tracker([entity]))
+
+        self.assertEqual(('quartier', 'Verdun', 0.97), (entity['entity'], entity['value'], entity['confidence']))
+
+    def test_no_correction(self):
+        entity = self.entity({'quartier': linking('Verdun', 0.90), 'street': linking('Rue Verdun', 0.95)})
+        self.form.correct_entity_based_on_requested_slot(self.tracker([entity]))
+        self.assertEqual('street', entity['entity'])
+
+        # no link for the requested entity type
+        entity = self.entity({'street': linking('Rue Verdun', 0.95)})
+        self.form.correct_entity_based_on_requested_slot(self.tracker([entity]))
+        self.assertEqual(('street', 0.95), (entity['entity'], entity['confidence']))
+
+        # the requested slot is already in the message
+        entity = self.entity({'quartier': linking('Verdun', 0.97)})
+        entity['entity'] = 'quartier'
+        self.form.correct_entity_based_on_requested_slot(self.tracker([entity, self.entity({})]))
+        self.assertEqual('quartier', entity['entity'])
+
+    def test_process(self):
+        # without __init__: no model loading, the four gazetteers use the same model
+        component = CityMetro.__new__(CityMetro)
+        component.instrumented = False
+        component.cache = None
+        component.disambiguation_rules = DisambiguationRules.load("./disambiguation.yml")
+        component.loaded = threading.Event()
+        component.loaded.set()
+        component.loading_error = None
+
+        labels = ["Berri-UQAM", "Verdun", "Pie-IX", "Jarry"]
+        model = numpy_model(labels)
+        component.linkers = {entity_type: (model, None, labels, {}, None)
+                             for entity_type in ["city", "metro", "quartier", "street"]}
+        component.linkers["quartier"] = (model, None, labels, {"verdun": "Verdun"}, None)
+        component.linkers["street"] = (model, None, labels, {"verdun": "Rue Verdun"}, None)
+
+        message = Message("Verdun", {'entities': [self.entity({})]})
+        del message.get('entities')[0]['entity_linking']
+        component.process(message)
+
+        # every entity type is linked, the form corrects the street to the requested quartier
+        entity = message.get('entities')[0]
+        self.assertEqual(['city', 'metro', 'quartier', 'street'], sorted(entity['entity_linking']))
+        self.assertEqual(('street', 'Rue Verdun'), (entity['entity'], entity['value']))
+
+        self.form.correct_entity_based_on_requested_slot(self.tracker([entity]))
+        self.assertEqual(('quartier', 'Verdun', 1.0), (entity['entity'], entity['value'], entity['confidence']))
+
+
+if __name__ == '__main__':
+    unittest.main()
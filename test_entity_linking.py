@@ -0,0 +1,171 @@
+import os
+import tempfile
+import threading
+import unittest
+import weakref
+
+from unittest import mock
+
+import torch
+
+from entity_linking import CityMetro
+from fofe_entity_linking import bulk
+from fofe_entity_linking.artifact import write_artifact
+from fofe_entity_linking.embedding import NgramHashing
+from fofe_entity_linking.export import export_artifact
+from fofe_entity_linking.fuzzy_index import SymmetricDeleteIndex
+from fofe_entity_linking.model import FofeNNModel, FoldedFofeNNModel
+from fofe_entity_linking.numpy_predict import load_model
+from fofe_entity_linking.retrieval import BruteForceIndex, RetrievalLinker
+
+
+def write_numpy_model(filename, labels):
+    """ Write the artifact of a model of random weights with the given labels. """
+    torch.manual_seed(999)
+    ngram = NgramHashing(2, corpus_text_list=labels)
+    model = FofeNNModel(8, hidden_size=16, dropoutrate=0.25, number_of_classes=len(labels))
+    folded_model = FoldedFofeNNModel(model, torch.rand(len(ngram.vocab), 8), forgetting_factor=0.95)
+    metadata, arrays = export_artifact(folded_model, ngram.vocab, labels, 0.95)
+    write_artifact(filename, arrays, metadata)
+
+
+def numpy_model(labels):
+    """ Returns a numpy runtime model of random weights with the given labels. """
+    with tempfile.TemporaryDirectory() as directory:
+        write_numpy_model(os.path.join(directory, 'model.fofe'), labels)
+        return load_model(os.path.join(directory, 'model.fofe'))
+
+
+class TestPredictEntityLinking(unittest.TestCase):
+    """ CityMetro.predict_entity_linking with a numpy runtime model (no embedding). """
+
+    @classmethod
+    def setUpClass(cls):
+        cls.labels = ["Berri-UQAM", "Verdun", "Pie-IX", "Jarry"]
+        cls.model = numpy_model(cls.labels)
+        cls.exact_map = {CityMetro.normalize_name(label): label for label in cls.labels}
+
+    def link(self, value, fuzzy_index=None):
+        entities = [{'start': 0, 'end': len(value), 'value': value, 'entity': 'metro', 'confidence': 0.9}]
+        CityMetro.predict_entity_linking(entities, self.model, None, self.labels, self.exact_map, 'metro',
+                                         fuzzy_index=fuzzy_index)
+        linked = entities[0]['entity_linking']['metro']
+        return linked['value'], linked['confidence']
+
+    def model_prediction(self, text):
+        return CityMetro.link_entity_model_inference(text, self.model, None, self.labels)
+
+    def test_exact_map(self):
+        self.assertEqual(('Pie-IX', 1.0), self.link("Pie IX"))
+
+    def test_fuzzy_disabled_by_default(self):
+        self.assertEqual(0, CityMetro.defaults['fuzzy_max_distance'])
+
+        # a typo is linked by the model, as without the fuzzy index
+        self.assertEqual(self.model_prediction('verdn'), self.link("Verdn"))
+
+    def test_fuzzy(self):
+        fuzzy_index = SymmetricDeleteIndex(self.exact_map, 2)
+        self.assertEqual(('Verdun', 0.95), self.link("Verdn", fuzzy_index))
+
+        # no typo allowed on a mention shorter than 4 chars: the near-miss of a short name goes to the model
+        self.assertEqual(self.model_prediction('jar'), self.link("Jar", fuzzy_index))
+
+    def test_retrieval_without_candidate(self):
+        linker = RetrievalLinker.build(self.model, self.labels, 'brute', dim=None)
+        linker.index = BruteForceIndex(linker.index.vectors[:0])
+
+        # an exact name is still linked, a mention without candidate gets no link for this entity type
+        entities = [{'start': 0, 'end': 6, 'value': value, 'entity': 'metro', 'confidence': 0.9}
+                    for value in ["Verdun", "Verdn"]]
+        CityMetro.predict_entity_linking(entities, linker, None, self.labels, self.exact_map, 'metro')
+
+        self.assertEqual(('Verdun', 1.0), (entities[0]['entity_linking']['metro']['value'],
+                                           entities[0]['entity_linking']['metro']['confidence']))
+        self.assertNotIn('entity_linking', entities[1])
+        self.assertEqual(0.0, CityMetro.confidence(entities[1], 'metro'))
+
+
+class TestBulkLinking(unittest.TestCase):
+    """ fofe_entity_linking.bulk links the logged mentions as CityMetro.predict_entity_linking. """
+
+    def test_same_as_predict_entity_linking(self):
+        labels = ["Saint-Laurent", "Verdun", "Berri-UQAM", "Pie-IX"]
+        mentions = ["St-Laurent", "  verdun ", "Verdn", "ST-LAURENT", "jarry", "Ste-Catherine"]
+
+        with tempfile.TemporaryDirectory() as directory:
+            write_numpy_model(os.path.join(directory, 'metro.fofe'), labels)
+            with open(os.path.join(directory, 'metro.csv'), 'w', encoding='utf-8') as gazetteer_file:
+                gazetteer_file.write('\n'.join(labels) + '\n')
+
+            records = list(bulk.link_all(enumerate(mentions), 0, k=1, initializer_args=(
+                ['metro'], 'numpy', directory, directory, None, 1, directory, 2)))
+
+            model = load_model(os.path.join(directory, 'metro.fofe'))
+            exact_map = CityMetro.create_exact_map(os.path.join(directory, 'metro.csv'))
+
+        entities = [{'start': 0, 'end': len(mention), 'value': mention, 'entity': 'metro', 'confidence': 0.9}
+                    for mention in mentions]
+        CityMetro.predict_entity_linking(entities, model, None, labels, exact_map, 'metro',
+                                         fuzzy_index=SymmetricDeleteIndex(exact_map, 2))
+
+        expected = [entity['entity_linking']['metro'] for entity in entities]
+        self.assertEqual([linked['input'] for linked in expected], [record['input'] for record in records])
+        self.assertEqual([(linked['value'], round(linked['confidence'], 6)) for linked in expected],
+                         [tuple(record['metro'][0]) for record in records])
+
+        # the abbreviated and padded mentions are exact gazetteer names, the typo a fuzzy match
+        self.assertEqual([('Saint-Laurent', 1.0), ('Verdun', 1.0), ('Verdun', 0.95), ('Saint-Laurent', 1.0)],
+                         [tuple(record['metro'][0]) for record in records[:4]])
+
+
+class TestLoadingStatus(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.with_entity_linking = self.config('pipeline:\n- name: "CRFEntityExtractor"\n'
+                                               '- name: "entity_linking.CityMetro"\n  cache_size: 1024\n')
+        self.without_entity_linking = self.config('pipeline:\n- name: "CRFEntityExtractor"\n')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def config(self, content):
+        filename = os.path.join(self.directory.name, f'config_{len(os.listdir(self.directory.name))}.yml')
+        with open(filename, 'w') as f:
+            f.write(content)
+        return filename
+
+    @staticmethod
+    def component(loaded=True):
+        # without __init__: no model loading
+        component = CityMetro.__new__(CityMetro)
+        component.loaded = threading.Event()
+        component.loading_error = None
+        if loaded:
+            component.loaded.set()
+        return component
+
+    def test_no_component(self):
+        with mock.patch.object(CityMetro, 'instances', weakref.WeakSet()):
+            # configured but not created yet
+            self.assertEqual("loading", CityMetro.loading_status(self.with_entity_linking))
+
+            # a pipeline without entity linking, or a connector started without the NLU config
+            self.assertEqual("not_applicable", CityMetro.loading_status(self.without_entity_linking))
+            self.assertEqual("not_applicable", CityMetro.loading_status(os.path.join(self.directory.name, 'none.yml')))
+
+    def test_components(self):
+        components = [self.component(), self.component(loaded=False)]
+        with mock.patch.object(CityMetro, 'instances', weakref.WeakSet(components)):
+            self.assertEqual("loading", CityMetro.loading_status(self.with_entity_linking))
+
+            components[1].loaded.set()
+            self.assertEqual("ready", CityMetro.loading_status(self.with_entity_linking))
+
+            components[0].loading_error = RuntimeError()
+            self.assertEqual("failed", CityMetro.loading_status(self.with_entity_linking))
+
+
+if __name__ == '__main__':
+    unittest.main()
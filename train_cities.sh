@@ -28,4 +28,11 @@ python -m fofe_entity_linking.train \
 --data_testset_path ./fofe_entity_linking/data/cities_test_set.csv \
 --label_weight_path ./fofe_entity_linking/data/cities_training_labels.pickle \
 --embedding_path ./fofe_entity_linking/data/cities_embedding.pth \
---vocab_path ./fofe_entity_linking/data/cities_vocab.pickle
\ No newline at end of file
+--vocab_path ./fofe_entity_linking/data/cities_vocab.pickle
+
+# export the model, its vocab, labels and gazetteer to a single artifact for the numpy runtime --> ./fofe_entity_linking/models/cities.fofe
+python -m fofe_entity_linking.export \
+--names cities \
+--models_dir ./fofe_entity_linking/models \
+--data_dir ./fofe_entity_linking/data \
+--gazetteer_dir ./fofe_entity_linking
@@ -29,3 +29,10 @@ python -m fofe_entity_linking.train \
 --label_weight_path ./fofe_entity_linking/data/metro_training_labels.pickle \
 --embedding_path ./fofe_entity_linking/data/metro_embedding.pth \
 --vocab_path ./fofe_entity_linking/data/metro_vocab.pickle
+
+# export the model, its vocab, labels and gazetteer to a single artifact for the numpy runtime --> ./fofe_entity_linking/models/metro.fofe
+python -m fofe_entity_linking.export \
+--names metro \
+--models_dir ./fofe_entity_linking/models \
+--data_dir ./fofe_entity_linking/data \
+--gazetteer_dir ./fofe_entity_linking
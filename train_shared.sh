@@ -0,0 +1,37 @@
+#!/usr/bin/env bash
+
+# requires the training sets generated by train_cities.sh, train_metro.sh, train_quartiers.sh and train_streets_montreal.sh
+
+# create a single embedding for the vocabulary of the four training sets --> ./fofe_entity_linking/data/shared_embedding.pth
+python -m fofe_entity_linking.dataset \
+--shared_training_sets ./fofe_entity_linking/data/cities_training_set.csv,./fofe_entity_linking/data/metro_training_set.csv,./fofe_entity_linking/data/quartiers_training_set.csv,./fofe_entity_linking/data/streets_montreal_training_set.csv \
+--shared_name shared --output_path ./fofe_entity_linking/data --verbose True \
+--embedding_dim 256 \
+--embedding_hidden_layer_size 1024 \
+--embedding_ngram_size 2 \
+--embedding_learning_rate 0.0005 \
+--embedding_epochs 2 \
+
+# train a FOFE-based Neural Network with a shared hidden layer and one head per gazetteer
+python -m fofe_entity_linking.train \
+--model_name shared \
+--multi_head_names cities,metro,quartiers,streets_montreal \
+--data_dir ./fofe_entity_linking/data \
+--output ./fofe_entity_linking/models \
+--hidden_layer_size 2048 \
+--fofe_forgetting_factor 0.95 \
+--dropout_rate 0.25 \
+--epochs 150 \
+--learning_rate 0.0005 \
+--batch_size 128 \
+--schedule 10 \
+--patience 200 \
+--embedding_path ./fofe_entity_linking/data/shared_embedding.pth \
+--vocab_path ./fofe_entity_linking/data/shared_vocab.pickle
+
+# export the model, its vocab, labels and gazetteer to a single artifact for the numpy runtime --> ./fofe_entity_linking/models/shared.fofe
+python -m fofe_entity_linking.export \
+--names shared \
+--models_dir ./fofe_entity_linking/models \
+--data_dir ./fofe_entity_linking/data \
+--gazetteer_dir ./fofe_entity_linking
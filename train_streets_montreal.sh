@@ -27,4 +27,11 @@ python -m fofe_entity_linking.train \
 --data_path ./fofe_entity_linking/data/streets_montreal_training_set.csv \
 --label_weight_path ./fofe_entity_linking/data/streets_montreal_training_labels.pickle \
 --embedding_path ./fofe_entity_linking/data/streets_montreal_embedding.pth \
---vocab_path ./fofe_entity_linking/data/streets_montreal_vocab.pickle
\ No newline at end of file
+--vocab_path ./fofe_entity_linking/data/streets_montreal_vocab.pickle
+
+# export the model, its vocab, labels and gazetteer to a single artifact for the numpy runtime --> ./fofe_entity_linking/models/streets_montreal.fofe
+python -m fofe_entity_linking.export \
+--names streets_montreal \
+--models_dir ./fofe_entity_linking/models \
+--data_dir ./fofe_entity_linking/data \
+--gazetteer_dir ./fofe_entity_linking